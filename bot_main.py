@@ -2,15 +2,27 @@
 import datetime
 import logging
 import pathlib
-from typing import Any
+import secrets
+import signal
+import threading
+from typing import Any, List
 
 import telebot
-import turicreate as tc
 
-from src.config import DBSettings, Settings
-from src.handlers import HelpHandler, RecommendHandler, StartHandler
+from src.config import DBSettings, ModelBackend, ServingMode, Settings
+from src.content import ContentSettings, blend_content
+from src.cooccurrence import CooccurrenceRecommender, CooccurrenceSettings, CooccurrenceStorage
+from src.handlers import HelpHandler, RecommendHandler, SearchHandler, StartHandler, TrendingHandler
+from src.listeners import make_submit_listeners
 from src.loader import TimusAPIClient, TimusClientSettings
-from src.storage import SubmitStorage, UserStorage
+from src.metrics import MetricsSettings, start_exporters
+from src.popularity import PopularityRecommender, PopularitySettings, PopularityStorage
+from src.recommenders import ComplexityRecommender, IRecommender, ModelRecommender
+from src.storage import Interactions, ProblemStorage, SubmitStorage, SyncStateStorage, UserStorage
+from src.sync import Backfiller, SubmitSyncer, SyncSettings
+from src.timing import PhaseTimer
+from src.warmup import ModelHolder
+from src.webhook import WebhookServer, stop_bot_workers
 
 logger = logging.getLogger(__name__)
 
@@ -38,45 +50,149 @@ def setup_logging() -> None:
     root_logger.addHandler(logging.StreamHandler())
 
 
-class _MockModel:
-    def recommend_from_interactions(self, frame: tc.SFrame) -> Any:
-        return {'problemid': [1, 2, 3, 4, 5]}
+class _MockModel(IRecommender):
+    def recommend(self, interactions: Interactions, k: int) -> List[int]:
+        return [1, 2, 3, 4, 5][:k]
 
 
 class ModelLoader:
-    def __init__(self, settings: Settings):
+    def __init__(self, settings: Settings, timer: PhaseTimer):
         self._settings = settings
+        self._timer = timer
 
-    def load(self) -> Any:
+    def load(self) -> IRecommender:
+        model = self._load_model()
+        with self._timer.phase('load content'):
+            return blend_content(model, ContentSettings())
+
+    def _load_model(self) -> IRecommender:
         if self._settings.use_mock_model:
             return _MockModel()
-        return tc.load_model(str(self._settings.model_path))
+        if self._settings.model_backend == ModelBackend.COOCCURRENCE:
+            cooccurrence_settings = CooccurrenceSettings()
+            return CooccurrenceRecommender(
+                CooccurrenceStorage(), cooccurrence_settings.similarity, cooccurrence_settings.neighbours
+            )
+        # turicreate takes seconds to import, so it is only imported when the model is actually needed
+        with self._timer.phase('import turicreate'):
+            import turicreate as tc
+        with self._timer.phase('load model'):
+            return ModelRecommender(tc.load_model(str(self._settings.model_path)))
+
+    def load_fallback(self) -> ComplexityRecommender:
+        with self._timer.phase('load fallback'):
+            fallback = ComplexityRecommender.from_storage(ProblemStorage())
+            if len(fallback) == 0 and self._settings.complexities_path.exists():
+                fallback = ComplexityRecommender.from_csv(self._settings.complexities_path)
+        logger.info("Fallback recommender knows %s problems", len(fallback))
+        return fallback
+
+
+def serve_webhook(bot: telebot.TeleBot, settings: Settings) -> None:
+    if settings.webhook_url is None:
+        raise ValueError("webhook_url must be set to serve updates through a webhook")
+    secret_token = settings.webhook_secret_token or secrets.token_urlsafe(32)
+    server = WebhookServer(
+        lambda update: bot.process_new_updates([update]),
+        host=settings.webhook_host,
+        port=settings.webhook_port,
+        path=settings.webhook_path,
+        secret_token=secret_token,
+        queue_size=settings.webhook_queue_size,
+        workers=settings.webhook_workers,
+    )
+    server.start()
+    bot.remove_webhook()
+    bot.set_webhook(url=settings.webhook_url.rstrip('/') + settings.webhook_path, secret_token=secret_token)
+
+    stopped = threading.Event()
+
+    def _stop(signum: int, frame: Any) -> None:
+        logger.info("Got signal %s, stopping", signum)
+        stopped.set()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    stopped.wait()
+    server.stop(timeout=30)
+    stop_bot_workers(bot, timeout=30)
 
 
 def main() -> None:
-    DBSettings().setup_db()
+    setup_logging()
+    timer = PhaseTimer('startup')
 
     settings = Settings()
+    start_exporters(MetricsSettings())
+    with timer.phase('setup db'):
+        DBSettings().setup_db()
+
     user_storage = UserStorage()
-    submit_storage = SubmitStorage()
+    submit_storage = SubmitStorage(listeners=make_submit_listeners())
+    sync_state_storage = SyncStateStorage()
     timus_client = TimusAPIClient.from_settings(TimusClientSettings())
-    model = ModelLoader(settings).load()
-
-    setup_logging()
+    sync_settings = SyncSettings()
+    backfiller = Backfiller(sync_settings, submit_storage, sync_state_storage, timus_client)
+    backfiller.start()
+    submit_syncer = SubmitSyncer(sync_settings, submit_storage, sync_state_storage, timus_client, backfiller)
+
+    model = ModelHolder()
+    model_loader = ModelLoader(settings, timer)
+    complexity = model_loader.load_fallback()
+    fallback: IRecommender = complexity
+    popularity_settings = PopularitySettings()
+    if popularity_settings.enabled:
+        popularity_storage = PopularityStorage()
+        with timer.phase('rank fallback'):
+            # Of problems with equal difficulty the ones solved by more people are the safer next step
+            popularity = popularity_storage.get(complexity.problems)
+            complexity = complexity.with_solvers({problem_id: row.solvers for problem_id, row in popularity.items()})
+        fallback = PopularityRecommender(popularity_storage, popularity_settings.fallback_days, complexity)
+    # Cold-start users are answered by the fallback, so it reserves slots for rarely solved problems too
+    fallback = blend_content(fallback, ContentSettings())
+    if settings.warm_up_model_in_background:
+        model.warm_up_in_background(
+            model_loader.load, on_ready=lambda: logger.info("Model is ready, %s", timer.report())
+        )
+    else:
+        model.set(model_loader.load())
 
-    logger.info("Started")
+    logger.info("Started, %s", timer.report())
     bot = telebot.TeleBot(settings.token, exception_handler=AmazingExceptionHandler())
     bot.message_handler(commands=['help'])(HelpHandler(bot))
-    bot.message_handler(commands=['start'])(
-        StartHandler(bot, user_storage=user_storage, submit_storage=submit_storage, timus_client=timus_client)
-    )
+    bot.message_handler(commands=['start'])(StartHandler(bot, user_storage=user_storage, submit_syncer=submit_syncer))
     bot.message_handler(commands=['recommend'])(
         RecommendHandler(
-            bot, user_storage=user_storage, submit_storage=submit_storage, timus_client=timus_client, model=model
+            bot,
+            user_storage=user_storage,
+            submit_storage=submit_storage,
+            submit_syncer=submit_syncer,
+            model=model,
+            fallback=fallback,
+            cold_start_threshold=settings.cold_start_threshold,
+            recommendations_count=settings.recommendations_count,
         )
     )
 
-    if True:
+    bot.message_handler(commands=['search'])(
+        SearchHandler(bot, problem_storage=ProblemStorage(), limit=settings.search_results_count)
+    )
+    if popularity_settings.enabled:
+        bot.message_handler(commands=['trending'])(
+            TrendingHandler(
+                bot,
+                popularity_storage=PopularityStorage(),
+                problem_storage=ProblemStorage(),
+                days=popularity_settings.trending_days,
+                limit=popularity_settings.trending_count,
+            )
+        )
+
+    if settings.mode == ServingMode.WEBHOOK:
+        serve_webhook(bot, settings)
+    else:
+        # Telegram refuses getUpdates while a webhook from a previous webhook mode run is set
+        bot.remove_webhook()
         try:
             bot.polling(timeout=1, long_polling_timeout=1)
         # TGBot wraps this exception :(
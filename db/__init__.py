@@ -1,3 +1,21 @@
 # flake8: noqa
 from .base import create_session, metadata
-from .schemas import Problem, Submit, TelegramUser
+from .counters import increment
+from .migrations import run_migrations
+from .schemas import (
+    MAIN_SPACE,
+    IngestionCursor,
+    IngestionShard,
+    Problem,
+    ProblemDailySolvers,
+    ProblemPair,
+    ProblemSolvers,
+    ProblemStatement,
+    ProblemStats,
+    Submit,
+    TelegramUser,
+    UserSyncState,
+    compress_statement,
+    decompress_statement,
+)
+from .search import PROBLEM_SEARCH_TABLE
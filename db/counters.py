@@ -0,0 +1,40 @@
+from typing import Any, Callable, Dict, List, Sequence, Type
+
+import sqlalchemy as sa
+from sqlalchemy import orm as so
+from sqlalchemy.dialects import postgresql, sqlite
+
+from db.base import Base
+
+_UPSERTS: Dict[str, Callable[[sa.Table], Any]] = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def increment(
+    session: so.Session, model: Type[Base], keys: Sequence[str], counters: Sequence[str], rows: List[Dict[str, Any]]
+) -> None:
+    """Adds the counters of every row to the stored row with the same keys, or inserts the row if there is none.
+
+    The addition is done by the database, so writers running at the same time never lose each other's increments.
+    keys must be covered by a unique constraint of the table.
+    """
+    if not rows:
+        return
+    table = model.__table__  # type: ignore
+    upsert = _UPSERTS.get(session.get_bind(model).dialect.name)
+    if upsert is not None:
+        statement = upsert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c[key] for key in keys],
+            set_={counter: table.c[counter] + statement.excluded[counter] for counter in counters},
+        )
+        session.execute(statement, rows)
+        return
+    # Other backends still add atomically, only two writers inserting the same new row make one of them fail
+    for row in rows:
+        updated = session.execute(
+            table.update()
+            .where(*[table.c[key] == row[key] for key in keys])
+            .values({counter: table.c[counter] + row[counter] for counter in counters})
+        )
+        if updated.rowcount == 0:
+            session.execute(table.insert().values(row))
@@ -0,0 +1,97 @@
+import logging
+from typing import Any, Callable, Dict, List, Tuple
+
+import sqlalchemy as sa
+
+from db.base import Base
+from db.schemas import MAIN_SPACE, Problem, ProblemStatement, Submit, compress_statement
+
+logger = logging.getLogger(__name__)
+
+_COPY_CHUNK_SIZE = 500
+
+
+class SchemaMigration(Base):
+    name = sa.Column(sa.Text, unique=True, nullable=False)
+
+
+def _columns(connection: sa.engine.Connection, table: str) -> List[str]:
+    return [column['name'] for column in sa.inspect(connection).get_columns(table)]
+
+
+def _indexes(connection: sa.engine.Connection, table: str) -> Dict[str, Any]:
+    return {index['name']: index for index in sa.inspect(connection).get_indexes(table)}
+
+
+def add_space(connection: sa.engine.Connection) -> None:
+    """Adds the space column to submits and problems, existing rows belong to the main space."""
+    for table in (Problem.__table__, Submit.__table__):
+        if 'space' not in _columns(connection, table.name):
+            connection.execute(
+                sa.text(f'ALTER TABLE {table.name} ADD COLUMN space INTEGER NOT NULL DEFAULT {MAIN_SPACE}')
+            )
+
+    # Problem numbers are only unique within a space
+    number_index = _indexes(connection, Problem.__tablename__).get('ix_problem_number')
+    if number_index is not None and number_index['unique']:
+        connection.execute(sa.text('DROP INDEX ix_problem_number'))
+    for table in (Problem.__table__, Submit.__table__):
+        _create_missing_indexes(connection, table)
+
+
+def _create_missing_indexes(connection: sa.engine.Connection, table: sa.Table) -> None:
+    existing = _indexes(connection, table.name)
+    for index in table.indexes:
+        if index.name not in existing:
+            index.create(connection)
+
+
+def split_statements(connection: sa.engine.Connection) -> None:
+    """Moves limits and text of problems into the compressed problem_statement table."""
+    ProblemStatement.__table__.create(connection, checkfirst=True)
+    if 'text' in _columns(connection, Problem.__tablename__):
+        last = 0
+        while True:
+            rows = connection.execute(
+                sa.text(
+                    'SELECT problem_id, limits, text FROM problem WHERE problem_id > :last'
+                    ' ORDER BY problem_id LIMIT :limit'
+                ),
+                {'last': last, 'limit': _COPY_CHUNK_SIZE},
+            ).fetchall()
+            if not rows:
+                break
+            connection.execute(
+                sa.insert(ProblemStatement.__table__),
+                [
+                    {'problem_id': problem_id, 'limits': compress_statement(limits), 'text': compress_statement(text)}
+                    for problem_id, limits, text in rows
+                ],
+            )
+            last = rows[-1][0]
+        for column in ('limits', 'text'):
+            connection.execute(sa.text(f'ALTER TABLE {Problem.__tablename__} DROP COLUMN {column}'))
+    _create_missing_indexes(connection, Problem.__table__)
+
+
+MIGRATIONS: List[Tuple[str, Callable[[sa.engine.Connection], None]]] = [
+    ('0001_add_space', add_space),
+    ('0002_split_statements', split_statements),
+]
+
+
+def run_migrations(engine: sa.engine.Engine) -> None:
+    """Applies the migrations which have not been applied yet, each one in its own transaction.
+
+    Migrations are idempotent: a database created by metadata.create_all already has the latest schema and they
+    only record themselves as applied there.
+    """
+    with engine.begin() as connection:
+        applied = {name for (name,) in connection.execute(sa.select(SchemaMigration.name))}
+    for name, migration in MIGRATIONS:
+        if name in applied:
+            continue
+        with engine.begin() as connection:
+            migration(connection)
+            connection.execute(sa.insert(SchemaMigration.__table__).values(name=name))
+        logger.info("Applied migration %s", name)
@@ -1,7 +1,12 @@
+import zlib
+
 import sqlalchemy as sa
+from sqlalchemy import orm as so
 
 from db.base import Base
 
+MAIN_SPACE = 1
+
 
 class TelegramUser(Base):
     user_id = sa.Column(sa.BigInteger, unique=True, nullable=False)
@@ -9,15 +14,40 @@ class TelegramUser(Base):
 
 
 class Problem(Base):
-    number = sa.Column(sa.Integer, index=True, nullable=False, unique=True)
+    space = sa.Column(sa.Integer, nullable=False, default=MAIN_SPACE, server_default=sa.text(str(MAIN_SPACE)))
+    number = sa.Column(sa.Integer, index=True, nullable=False)
     title = sa.Column(sa.Text, nullable=False)
     difficulty = sa.Column(sa.Integer, nullable=False)
     solutions = sa.Column(sa.Integer, nullable=False)
-    limits = sa.Column(sa.Text, nullable=False)
-    text = sa.Column(sa.Text, nullable=False)
+
+    statement = so.relationship('ProblemStatement', uselist=False, cascade='all, delete-orphan', passive_deletes=True)
+
+    __table_args__ = (
+        sa.Index('uq_problem_space_number', 'space', 'number', unique=True),
+        sa.Index('ix_problem_space_difficulty', 'space', 'difficulty'),
+    )
+
+
+def compress_statement(text: str) -> bytes:
+    return zlib.compress(text.encode())
+
+
+def decompress_statement(data: bytes) -> str:
+    return zlib.decompress(data).decode()
+
+
+class ProblemStatement(Base):
+    """Statement of a problem, zlib-compressed and kept apart so reading problem metadata never touches it."""
+
+    problem_id = sa.Column(
+        sa.Integer, sa.ForeignKey(Problem.__table__.c.id, ondelete='CASCADE'), unique=True, nullable=False
+    )
+    limits = so.deferred(sa.Column(sa.LargeBinary, nullable=False))
+    text = so.deferred(sa.Column(sa.LargeBinary, nullable=False))
 
 
 class Submit(Base):
+    space = sa.Column(sa.Integer, nullable=False, default=MAIN_SPACE, server_default=sa.text(str(MAIN_SPACE)))
     timus_submit_id = sa.Column(sa.BigInteger, unique=True, nullable=False)
     timus_user_id = sa.Column(sa.Integer, index=True, nullable=False)
     timus_problem_id = sa.Column(sa.Integer, nullable=False)
@@ -27,3 +57,68 @@ class Submit(Base):
     test = sa.Column(sa.Integer, nullable=False)
     runtime_ms = sa.Column(sa.Integer, nullable=False)
     memory_kb = sa.Column(sa.Integer, nullable=False)
+
+    __table_args__ = (sa.Index('ix_submit_space_timus_submit_id', 'space', 'timus_submit_id'),)
+
+
+class UserSyncState(Base):
+    timus_user_id = sa.Column(sa.Integer, unique=True, nullable=False)
+    high_watermark = sa.Column(sa.BigInteger, nullable=False)
+    last_synced_at = sa.Column(sa.DateTime(timezone=True), nullable=True)
+    backfill_complete = sa.Column(sa.Boolean, nullable=False)
+    backfill_from = sa.Column(sa.BigInteger, nullable=True)
+    backfill_to = sa.Column(sa.BigInteger, nullable=False, default=0)
+
+
+class ProblemSolvers(Base):
+    timus_problem_id = sa.Column(sa.Integer, unique=True, nullable=False)
+    solvers = sa.Column(sa.Integer, nullable=False)
+    version = sa.Column(sa.Integer, nullable=False)
+
+
+class ProblemPair(Base):
+    first_problem_id = sa.Column(sa.Integer, nullable=False)
+    second_problem_id = sa.Column(sa.Integer, index=True, nullable=False)
+    solvers = sa.Column(sa.Integer, nullable=False)
+
+    __table_args__ = (sa.UniqueConstraint('first_problem_id', 'second_problem_id'),)
+
+
+class ProblemStats(Base):
+    timus_problem_id = sa.Column(sa.Integer, unique=True, nullable=False)
+    accepted = sa.Column(sa.Integer, nullable=False)
+    solvers = sa.Column(sa.Integer, nullable=False)
+    # Counts of accepted submits per bucket of src.popularity.RESOURCE_BUCKETS, little-endian int64
+    runtime_histogram = sa.Column(sa.LargeBinary, nullable=False)
+    memory_histogram = sa.Column(sa.LargeBinary, nullable=False)
+
+
+class ProblemDailySolvers(Base):
+    timus_problem_id = sa.Column(sa.Integer, nullable=False)
+    day = sa.Column(sa.Date, index=True, nullable=False)
+    solvers = sa.Column(sa.Integer, nullable=False)
+
+    __table_args__ = (sa.UniqueConstraint('timus_problem_id', 'day'),)
+
+
+class IngestionCursor(Base):
+    """Progress of loading the submits of a space, committed together with the submits it describes."""
+
+    space = sa.Column(sa.Integer, unique=True, nullable=False)
+    # Submits are loaded from the newest down to stop_at, the top of the previous completed run
+    stop_at = sa.Column(sa.BigInteger, nullable=True)
+    # Where an unfinished run continues from and the newest submit it has seen
+    next_from = sa.Column(sa.BigInteger, nullable=True)
+    run_top = sa.Column(sa.BigInteger, nullable=True)
+
+
+class IngestionShard(Base):
+    """A submit id range of an unfinished run which is loaded by several producers, removed once it is committed."""
+
+    space = sa.Column(sa.Integer, nullable=False)
+    # Submits with ids in (low, high] are loaded from high down, an interrupted shard continues from next_from
+    low = sa.Column(sa.BigInteger, nullable=False)
+    high = sa.Column(sa.BigInteger, nullable=False)
+    next_from = sa.Column(sa.BigInteger, nullable=True)
+
+    __table_args__ = (sa.UniqueConstraint('space', 'low'),)
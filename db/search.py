@@ -0,0 +1,22 @@
+import sqlalchemy as sa
+
+from db.base import metadata
+
+PROBLEM_SEARCH_TABLE = 'problem_search'
+
+# The search index is not a regular table on either backend, so it is created by plain DDL after the metadata.
+# Every statement is idempotent, which also adds the index to databases created before it existed.
+_SQLITE_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {PROBLEM_SEARCH_TABLE} USING fts5("
+    "number UNINDEXED, title, body, tokenize = 'unicode61 remove_diacritics 2')",
+]
+_POSTGRESQL_DDL = [
+    f"CREATE TABLE IF NOT EXISTS {PROBLEM_SEARCH_TABLE} ("
+    "number INTEGER PRIMARY KEY, title TEXT NOT NULL, document TSVECTOR NOT NULL)",
+    f"CREATE INDEX IF NOT EXISTS ix_{PROBLEM_SEARCH_TABLE}_document ON {PROBLEM_SEARCH_TABLE} USING GIN (document)",
+]
+
+for statement in _SQLITE_DDL:
+    sa.event.listen(metadata, 'after_create', sa.DDL(statement).execute_if(dialect='sqlite'))
+for statement in _POSTGRESQL_DDL:
+    sa.event.listen(metadata, 'after_create', sa.DDL(statement).execute_if(dialect='postgresql'))
@@ -1,48 +1,120 @@
+import csv
+import json
+import multiprocessing
+import os
 import time
-from typing import Iterable, Optional
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.queues import Queue
+from pathlib import Path
+from typing import Any, Callable, Iterable, List, NamedTuple, Optional
 
 import typer
 
+import db
 from src.config import DBSettings
+from src.content import ContentSettings, build_content_index
+from src.cooccurrence import CooccurrenceSettings, CooccurrenceStorage
+from src.evaluation import evaluate, time_based_holdout
+from src.ingestion import (
+    DBIngestionShard,
+    IngestionCursorStorage,
+    IngestionSettings,
+    IngestionWriter,
+    Message,
+    Producer,
+    ProducerFailed,
+    SubmitBatch,
+)
+from src.listeners import make_submit_listeners
 from src.loader import ProblemModel, TimusAPIClient, TimusAPISubmit, TimusClientSettings
-from src.storage import DBSubmit, ProblemStorage, SubmitStorage
+from src.popularity import PopularitySettings, PopularityStorage
+from src.search import SearchUnavailable
+from src.snapshot import Throughput, export_snapshot, import_snapshot, read_header
+from src.storage import ProblemStorage, SubmitRow, SubmitStorage
+from src.timing import PhaseTimer
+from src.training import MODEL_DIR, MemoryBudgetExceeded, filter_active_authors, load_unique_interactions, train
 
 timus_recommender = typer.Typer()
 
 
-def load_problems() -> None:
-    DBSettings().setup_db()
-    timus_client = TimusAPIClient.from_settings(TimusClientSettings())
+def _init_loader() -> None:
+    DBSettings(need_create_database=False).setup_db()
+
+
+def _run_per_space(function: Callable[..., int], spaces: List[int], what: str, **kwargs: Any) -> None:
+    """Runs function(space, **kwargs) for every space, each in its own process when there are several spaces.
+
+    Every space has its own cursor and its own connection, so a slow or failing archive does not hold back the
+    others.
+    """
+    if len(spaces) == 1:
+        loaded = function(spaces[0], progress=True, **kwargs)
+        typer.echo(f"Space {spaces[0]}: loaded {loaded} {what}")
+        return
+    with ProcessPoolExecutor(max_workers=len(spaces), initializer=_init_loader) as executor:
+        futures = {executor.submit(function, space, progress=False, **kwargs): space for space in spaces}
+        failed = False
+        for future in as_completed(futures):
+            try:
+                typer.echo(f"Space {futures[future]}: loaded {future.result()} {what}")
+            except Exception as e:
+                failed = True
+                typer.secho(f"Space {futures[future]}: failed with {e!r}", fg=typer.colors.RED, err=True)
+    if failed:
+        raise typer.Exit(code=1)
+
+
+def _load_space_problems(space: int, progress: bool) -> int:
+    settings = TimusClientSettings()
+    timus_client = TimusAPIClient.from_settings(settings)
     storage = ProblemStorage()
-    typer.echo("Start loading")
-    with typer.progressbar(timus_client.get_problems()) as problem_meta_list:
-        for problem_meta in problem_meta_list:
-            problem = timus_client.get_problem(number=problem_meta.number)
-            storage.create_or_update(
-                ProblemModel(
-                    number=problem.number,
-                    title=problem_meta.title,
-                    difficulty=problem_meta.difficulty,
-                    solutions=problem_meta.solutions,
-                    limits=problem.limits,
-                    text=problem.text,
+    problem_metas = timus_client.get_problems(space=space)
+    without_difficulty = 0
+    with ProcessPoolExecutor(max_workers=settings.parse_workers) as parse_executor:
+        problems = timus_client.iter_problems([meta.number for meta in problem_metas], space, parse_executor)
+        with typer.progressbar(zip(problem_metas, problems), length=len(problem_metas), hidden=not progress) as pairs:
+            for problem_meta, problem in pairs:
+                without_difficulty += problem.difficulty is None
+                storage.create_or_update(
+                    ProblemModel(
+                        number=problem.number,
+                        title=problem_meta.title,
+                        difficulty=problem_meta.difficulty if problem.difficulty is None else problem.difficulty,
+                        solutions=problem_meta.solutions,
+                        limits=problem.limits,
+                        text=problem.text,
+                        search_text=problem.search_text,
+                    ),
+                    space=space,
                 )
-            )
-    typer.echo(f"Load {problem_meta_list.length} problems")
+    if without_difficulty:
+        typer.secho(
+            f"Space {space}: {without_difficulty} problem pages have no difficulty, the problem set column is used",
+            fg=typer.colors.YELLOW,
+            err=True,
+        )
+    return len(problem_metas)
+
+
+def load_problems(space: Optional[List[int]] = typer.Option(None)) -> None:
+    DBSettings().setup_db()
+    typer.echo("Start loading")
+    _run_per_space(_load_space_problems, space or TimusClientSettings().spaces, 'problems')
 
 
 def _load_all(
     *,
+    space: int,
     from_submit_id: Optional[int],
     batch_size: int,
     interval: float,
-    last_submit: Optional[DBSubmit],
+    stop_at: Optional[int],
     timus_client: TimusAPIClient,
 ) -> Iterable[TimusAPISubmit]:
     while True:
-        batch = timus_client.get_submits(from_submit_id=from_submit_id, count=batch_size)
+        batch = timus_client.get_submits(from_submit_id=from_submit_id, count=batch_size, space=space)
         for submit in batch:
-            if last_submit is not None and submit.submit_id == last_submit.submit_id:
+            if stop_at is not None and submit.submit_id <= stop_at:
                 return
             yield submit
         if len(batch) == 0:
@@ -51,52 +123,398 @@ def _load_all(
         time.sleep(interval)
 
 
-def load_submits(
-    from_submit_id: Optional[int] = typer.Option(None),
-    interval: float = typer.Option(0.01),
-    batch_size: int = typer.Option(100),
+def _produce_space_submits(
+    messages: 'Queue[Message]',
+    producer: Producer,
+    *,
+    from_submit_id: Optional[int],
+    stop_at: Optional[int],
+    interval: float,
+    batch_size: int,
 ) -> None:
-    DBSettings().setup_db()
-
-    timus_client = TimusAPIClient.from_settings(TimusClientSettings())
-    storage = SubmitStorage()
-    last_submit = storage.get_last_or_none()
-
-    typer.echo("Start loading")
-    total = 0
-    saved = 0
-    with typer.progressbar(
-        _load_all(
+    """Fetches and parses submits of the space or of its shard in a worker process and hands them to the writer."""
+    space, shard = producer
+    try:
+        timus_client = TimusAPIClient.from_settings(TimusClientSettings())
+        submits = _load_all(
+            space=space,
             from_submit_id=from_submit_id,
             batch_size=batch_size,
             interval=interval,
-            last_submit=last_submit,
+            stop_at=stop_at,
             timus_client=timus_client,
         )
-    ) as submits:
         current_batch = []
         for submit in submits:
-            total += 1
             current_batch.append(submit)
             if len(current_batch) == batch_size:
-                storage.batch_create(current_batch)
-                saved += len(current_batch)
-                submits.label = f"Last saved submit: {current_batch[-1].submit_id}"
+                # Blocks while the writer is behind
+                messages.put(SubmitBatch(space, current_batch, shard=shard))
                 current_batch = []
+        messages.put(SubmitBatch(space, current_batch, done=True, shard=shard))
+    except Exception as e:
+        messages.put(ProducerFailed(space, repr(e), shard=shard))
+
+
+class _ProducerPlan(NamedTuple):
+    producer: Producer
+    from_submit_id: Optional[int]
+    stop_at: Optional[int]
+
+
+def _plan_space(
+    space: int, cursors: IngestionCursorStorage, workers: int, from_submit_id: Optional[int]
+) -> List[_ProducerPlan]:
+    """One producer for the space, or one per submit id range when a run of the main space is split.
+
+    An unfinished run always continues where it stopped, from_submit_id only applies to a new run.
+    """
+    cursor = cursors.get_or_create(space)
+    shards = cursors.get_shards(space)
+    if not shards and workers > 1 and space == db.MAIN_SPACE and cursor.next_from is None and from_submit_id is None:
+        shards = _start_shards(space, cursors, workers)
+    if shards:
+        _warn_start_ignored(space, from_submit_id, f"its {len(shards)} saved submit id ranges")
+        typer.echo(f"Space {space}: loading {len(shards)} submit id ranges in parallel")
+        return [
+            _ProducerPlan(
+                Producer(space, shard.id), shard.high if shard.next_from is None else shard.next_from, shard.low
+            )
+            for shard in shards
+        ]
+    if cursor.next_from is not None:
+        _warn_start_ignored(space, from_submit_id, f"submit {cursor.next_from}")
+        typer.echo(f"Space {space}: resuming the unfinished run from submit {cursor.next_from}")
+        from_submit_id = cursor.next_from
+    return [_ProducerPlan(Producer(space), from_submit_id, cursor.stop_at)]
+
+
+def _start_shards(space: int, cursors: IngestionCursorStorage, workers: int) -> List[DBIngestionShard]:
+    newest = TimusAPIClient.from_settings(TimusClientSettings()).get_submits(count=1, space=space)
+    if not newest:
+        return []
+    return cursors.create_shards(space, newest[0].submit_id, workers)
+
+
+def _warn_start_ignored(space: int, from_submit_id: Optional[int], resumed_from: str) -> None:
+    if from_submit_id is not None:
+        typer.secho(
+            f"Space {space}: --from-submit-id {from_submit_id} is ignored, the unfinished run continues from"
+            f" {resumed_from}",
+            fg=typer.colors.YELLOW,
+            err=True,
+        )
+
+
+def load_submits(
+    from_submit_id: Optional[int] = typer.Option(
+        None, help="Submit id a new run starts from, an unfinished run of a space continues where it stopped"
+    ),
+    interval: float = typer.Option(0.01),
+    batch_size: int = typer.Option(100),
+    space: Optional[List[int]] = typer.Option(None),
+) -> None:
+    DBSettings().setup_db()
+
+    settings = IngestionSettings()
+    spaces = space or TimusClientSettings().spaces
+    cursors = IngestionCursorStorage()
+    context = multiprocessing.get_context()
+    messages: 'Queue[Message]' = context.Queue(maxsize=settings.queue_size)
+    plans = [plan for space_id in spaces for plan in _plan_space(space_id, cursors, settings.workers, from_submit_id)]
+    processes = [
+        context.Process(
+            target=_produce_space_submits,
+            args=(messages, plan.producer),
+            kwargs={
+                'from_submit_id': plan.from_submit_id,
+                'stop_at': plan.stop_at,
+                'interval': interval,
+                'batch_size': batch_size,
+            },
+            name=f'submits-{plan.producer.space}',
+            daemon=True,
+        )
+        for plan in plans
+    ]
+
+    typer.echo("Start loading")
+    for process in processes:
+        process.start()
+    writer = IngestionWriter(
+        SubmitStorage(listeners=make_submit_listeners()),
+        settings,
+        cursors,
+        on_commit=lambda saved: typer.echo(f"Committed {sum(saved.values())} new submits"),
+    )
+    try:
+        result = writer.run(
+            messages, [plan.producer for plan in plans], alive=lambda: any(process.is_alive() for process in processes)
+        )
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+    for space_id in spaces:
+        if space_id in result.failed:
+            typer.secho(f"Space {space_id}: failed with {result.failed[space_id]}", fg=typer.colors.RED, err=True)
+        else:
+            typer.echo(f"Space {space_id}: loaded {result.saved.get(space_id, 0)} submits")
+    if result.failed:
+        raise typer.Exit(code=1)
+
+
+def train_model(
+    output: Path = typer.Option(Path('models')),
+    chunk_size: int = typer.Option(100_000),
+    min_problems: int = typer.Option(20),
+    test_fraction: float = typer.Option(0.0),
+    holdout_per_author: int = typer.Option(10),
+    seed: int = typer.Option(0),
+    memory_budget_mb: Optional[float] = typer.Option(None),
+) -> None:
+    DBSettings().setup_db()
+
+    timer = PhaseTimer('train')
+    try:
+        manifest = train(
+            storage=SubmitStorage(),
+            output=output,
+            chunk_size=chunk_size,
+            min_problems=min_problems,
+            test_fraction=test_fraction,
+            holdout_per_author=holdout_per_author,
+            seed=seed,
+            timer=timer,
+            memory_budget_mb=memory_budget_mb,
+        )
+    except MemoryBudgetExceeded as e:
+        typer.secho(str(e), fg=typer.colors.RED, err=True)
+        raise typer.Exit(code=1)
+
+    data = manifest['data']
+    typer.echo(
+        f"Read {data['accepted_submits']} accepted submits, trained on {data['train_interactions']} interactions"
+        f" of {data['authors']} authors and {data['problems']} problems"
+    )
+    for phase, duration in manifest['timings'].items():
+        typer.echo(f"{phase}: {duration:.2f}s")
+    typer.echo(f"Peak memory: {manifest['peak_memory_mb']:.0f} MB")
+    typer.echo(f"Model saved to {output / manifest['version'] / MODEL_DIR}")
+
+
+def evaluate_models(
+    model: List[str] = typer.Option(['complexity']),
+    k: int = typer.Option(10),
+    holdout_fraction: float = typer.Option(0.1),
+    min_problems: int = typer.Option(20),
+    min_train_problems: int = typer.Option(5),
+    max_users: Optional[int] = typer.Option(None),
+    batch_size: int = typer.Option(256),
+    workers: int = typer.Option(os.cpu_count() or 1),
+    chunk_size: int = typer.Option(100_000),
+    output: Optional[Path] = typer.Option(None),
+) -> None:
+    DBSettings().setup_db()
+
+    timer = PhaseTimer('evaluate')
+    with timer.phase('read'):
+        interactions, _ = load_unique_interactions(SubmitStorage(), chunk_size)
+    with timer.phase('holdout'):
+        interactions = filter_active_authors(interactions, min_problems)
+        holdout = time_based_holdout(interactions, holdout_fraction, min_train_problems, max_users)
+    typer.echo(
+        f"Evaluating on {holdout.authors.size} users: {len(holdout.train)} train and {len(holdout.test)} test"
+        f" interactions, {holdout.catalogue_size} problems"
+    )
+
+    reports = []
+    for spec in model:
+        with timer.phase(spec):
+            report = evaluate(spec, holdout, k=k, batch_size=batch_size, workers=workers)
+        reports.append(report._asdict())
+        typer.echo(
+            f"{spec}: MAP@{k}={report.map_at_k:.4f} recall@{k}={report.recall_at_k:.4f}"
+            f" coverage={report.coverage:.3f} latency mean={report.latency_mean_ms:.2f}ms"
+            f" p50={report.latency_p50_ms:.2f}ms p95={report.latency_p95_ms:.2f}ms"
+            f" p99={report.latency_p99_ms:.2f}ms wall={report.wall_time_s:.1f}s"
+        )
+
+    if output is not None:
+        output.write_text(json.dumps({'k': k, 'timings': timer.durations, 'models': reports}, indent=2))
+
+
+def rebuild_cooccurrence(chunk_size: int = typer.Option(100_000)) -> None:
+    DBSettings().setup_db()
+
+    timer = PhaseTimer('cooccurrence')
+    with timer.phase('read'):
+        interactions, _ = load_unique_interactions(SubmitStorage(), chunk_size)
+    with timer.phase('rebuild'):
+        CooccurrenceStorage().rebuild(interactions)
+    typer.echo(f"Rebuilt co-occurrence counts from {len(interactions)} interactions, {timer.report()}")
+
+
+def rebuild_popularity() -> None:
+    DBSettings().setup_db()
+
+    timer = PhaseTimer('popularity')
+    with timer.phase('rebuild'):
+        problems = PopularityStorage().rebuild()
+    typer.echo(f"Rebuilt popularity of {problems} problems, {timer.report()}")
+
+
+def export_submits(
+    output: Path = typer.Option(Path('submits.csv')),
+    chunk_size: int = typer.Option(10_000),
+) -> None:
+    DBSettings().setup_db()
+
+    started_at = time.perf_counter()
+    rows = 0
+    with output.open('w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(SubmitRow._fields)
+        for chunk in SubmitStorage().iter_rows(chunk_size):
+            writer.writerows(chunk)
+            rows += len(chunk)
+    duration = time.perf_counter() - started_at
+    typer.echo(f"Exported {rows} submits to {output} in {duration:.1f}s, {rows / max(duration, 1e-9):.0f} rows/s")
+
+
+def rebuild_search() -> None:
+    DBSettings().setup_db()
 
-        if current_batch:
-            storage.batch_create(current_batch)
-            saved += len(current_batch)
-            submits.label = f"Last saved submit: {current_batch[-1].submit_id}"
+    timer = PhaseTimer('search')
+    with timer.phase('rebuild'):
+        indexed = ProblemStorage().rebuild_search_index()
+    typer.echo(f"Indexed {indexed} problems, {timer.report()}")
 
-    typer.echo()
+
+def search_problems(query: str, limit: int = typer.Argument(10)) -> None:
+    DBSettings().setup_db()
+
+    started_at = time.perf_counter()
+    try:
+        results = ProblemStorage().search(query, limit)
+    except SearchUnavailable as e:
+        typer.secho(str(e), fg=typer.colors.RED, err=True)
+        raise typer.Exit(code=1)
+    duration = time.perf_counter() - started_at
+    for result in results:
+        typer.echo(f"{result.number}. {result.title} ({result.rank:.3f})")
+    typer.echo(f"Found {len(results)} problems in {duration * 1000:.1f}ms")
+
+
+def build_content(output: Optional[Path] = typer.Option(None)) -> None:
+    DBSettings().setup_db()
+
+    settings = ContentSettings()
+    output = output or settings.path
+    timer = PhaseTimer('content')
+    with timer.phase('read'):
+        statements = ProblemStorage().get_statements()
+    manifest = build_content_index(
+        statements,
+        output,
+        components=settings.components,
+        neighbours=settings.neighbours,
+        max_features=settings.max_features,
+        min_df=settings.min_df,
+        timer=timer,
+    )
+    data = manifest['data']
+    typer.echo(
+        f"Built neighbours of {data['problems']} problems over {data['terms']} terms"
+        f" and {data['components']} components to {output}, {timer.report()}"
+    )
+
+
+def export_snapshot_command(
+    output: Path = typer.Argument(...),
+    chunk_size: int = typer.Option(50_000),
+    compression_level: int = typer.Option(6),
+) -> None:
+    DBSettings().setup_db()
+
+    throughput = Throughput()
+    export_snapshot(output, chunk_size, compression_level, on_chunk=throughput)
+    typer.echo(f"Exported {throughput.report()} to {output} ({output.stat().st_size / 2**20:.1f} MB)")
+
+
+def import_snapshot_command(
+    snapshot: Path = typer.Argument(..., exists=True, dir_okay=False),
+    replace: bool = typer.Option(False),
+) -> None:
+    DBSettings().setup_db()
+
+    with snapshot.open('rb') as f:
+        total = sum(table['rows'] for table in read_header(f)['tables'])
+    throughput = Throughput()
+    with typer.progressbar(length=total, label="Importing") as progress:
+
+        def _on_chunk(table: str, rows: int) -> None:
+            throughput(table, rows)
+            progress.update(rows)
+
+        import_snapshot(snapshot, replace=replace, on_chunk=_on_chunk)
+    typer.echo(f"Imported {throughput.report()}")
+    _rebuild_after_import()
+
+
+def _rebuild_after_import() -> None:
+    """Rebuilds what the import cleared or left empty, aggregates only when their listener keeps them up to date."""
+    timer = PhaseTimer('import')
+    with timer.phase('search'):
+        indexed = ProblemStorage().rebuild_search_index()
+    typer.echo(f"Rebuilt the search index of {indexed} problems")
+    if CooccurrenceSettings().enabled:
+        with timer.phase('cooccurrence'):
+            interactions, _ = load_unique_interactions(SubmitStorage(), chunk_size=100_000)
+            CooccurrenceStorage().rebuild(interactions)
+        typer.echo(f"Rebuilt co-occurrence counts from {len(interactions)} interactions")
+    else:
+        typer.echo("Co-occurrence is disabled, run `cooccurrence rebuild` before enabling it")
+    if PopularitySettings().enabled:
+        with timer.phase('popularity'):
+            problems = PopularityStorage().rebuild()
+        typer.echo(f"Rebuilt popularity of {problems} problems")
+    else:
+        typer.echo("Popularity is disabled, run `popularity rebuild` before enabling it")
+    typer.echo(timer.report())
 
 
 loader = typer.Typer(name='loader')
 loader.command()(load_problems)
 loader.command()(load_submits)
 
+cooccurrence = typer.Typer(name='cooccurrence')
+cooccurrence.command(name='rebuild')(rebuild_cooccurrence)
+
+popularity = typer.Typer(name='popularity')
+popularity.command(name='rebuild')(rebuild_popularity)
+
+snapshot = typer.Typer(name='snapshot')
+snapshot.command(name='export')(export_snapshot_command)
+snapshot.command(name='import')(import_snapshot_command)
+
+content = typer.Typer(name='content')
+content.command(name='build')(build_content)
+
+search = typer.Typer(name='search')
+search.command(name='rebuild')(rebuild_search)
+search.command(name='query')(search_problems)
+
 timus_recommender.add_typer(loader)
+timus_recommender.add_typer(cooccurrence)
+timus_recommender.add_typer(popularity)
+timus_recommender.add_typer(search)
+timus_recommender.add_typer(content)
+timus_recommender.add_typer(snapshot)
+timus_recommender.command(name='train')(train_model)
+timus_recommender.command(name='evaluate')(evaluate_models)
+timus_recommender.command(name='export')(export_submits)
 
 if __name__ == '__main__':
     timus_recommender()
@@ -1,17 +1,44 @@
+import enum
 from pathlib import Path
-from typing import Callable, Iterator
+from typing import Any, Callable, Iterator, Optional
 
 import sqlalchemy as sa
 from pydantic import BaseSettings
 from sqlalchemy.engine.url import URL, make_url
 from sqlalchemy.exc import ArgumentError
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.pool import QueuePool, StaticPool
+
+
+class ServingMode(str, enum.Enum):
+    POLLING = 'polling'
+    WEBHOOK = 'webhook'
+
+
+class ModelBackend(str, enum.Enum):
+    TURICREATE = 'turicreate'
+    COOCCURRENCE = 'cooccurrence'
 
 
 class Settings(BaseSettings):
     token: str
     model_path: Path = Path('prod_model')
+    model_backend: ModelBackend = ModelBackend.TURICREATE
     use_mock_model: bool = False
+    warm_up_model_in_background: bool = True
+    complexities_path: Path = Path('compexities.csv')
+    cold_start_threshold: int = 5
+    recommendations_count: int = 10
+    search_results_count: int = 10
+
+    mode: ServingMode = ServingMode.POLLING
+    webhook_url: Optional[str] = None
+    webhook_host: str = '0.0.0.0'  # noqa: S104
+    webhook_port: int = 8443
+    webhook_path: str = '/telegram'
+    webhook_queue_size: int = 256
+    webhook_workers: int = 4
+    # Telegram sends it back in every request; a random one is generated on start when it is not set
+    webhook_secret_token: Optional[str] = None
 
     class Config:
         env_prefix = 'TIMUS_RECOMMENDER_BOT_'
@@ -34,23 +61,44 @@ class SAUrl(URL):
 class DBSettings(BaseSettings):
     url: SAUrl = SAUrl.validate('sqlite:///my-data.sqlite')  # type: ignore
     need_create_database: bool = True
+    # With WAL readers do not block the writer and the writer does not block readers, so the bot keeps answering
+    # while submits are loaded; the busy timeout makes a second writer wait instead of failing at once
+    sqlite_journal_mode: str = 'wal'
+    sqlite_busy_timeout_ms: int = 30_000
 
     def setup_db(self) -> None:
         from db import metadata
 
+        # Every thread checks out its own connection, so a commit or rollback of the backfiller or of one handler
+        # never ends a transaction of another. Only an in-memory database has to stay on one shared connection,
+        # every new connection would open an empty database.
+        in_memory = self.url.get_backend_name() == 'sqlite' and self.url.database in (None, '', ':memory:')
         engine = sa.engine_from_config(
-            {'url': self.url, "connect_args": {'check_same_thread': False}, 'poolclass': StaticPool},
+            {
+                'url': self.url,
+                "connect_args": {'check_same_thread': False},
+                'poolclass': StaticPool if in_memory else QueuePool,
+            },
             prefix="",
         )
+        if engine.dialect.name == 'sqlite':
+            sa.event.listen(engine, 'connect', self._configure_sqlite)
         metadata.bind = engine
 
         if self.need_create_database:
             self.create_database()
 
+    def _configure_sqlite(self, dbapi_connection: Any, connection_record: Any) -> None:
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'PRAGMA journal_mode={self.sqlite_journal_mode}')
+        cursor.execute(f'PRAGMA busy_timeout={int(self.sqlite_busy_timeout_ms)}')
+        cursor.close()
+
     def create_database(self) -> None:
-        from db.base import metadata
+        from db import metadata, run_migrations
 
         metadata.create_all()
+        run_migrations(metadata.bind)
 
     class Config:
         env_prefix = 'DB_'
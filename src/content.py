@@ -0,0 +1,222 @@
+import json
+import logging
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+from pydantic import BaseSettings
+
+from src.recommenders import IRecommender
+from src.search import strip_statement
+from src.storage import Interactions
+from src.timing import PhaseTimer
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+_ARRAYS = ('problems', 'solutions', 'neighbours', 'scores')
+_TOKEN = re.compile(r'[^\W\d_]{2,}')
+_BLOCK_SIZE = 1024
+
+
+class ContentSettings(BaseSettings):
+    path: Path = Path('content')
+    enabled: bool = False
+    components: int = 128
+    neighbours: int = 20
+    max_features: int = 10_000
+    min_df: int = 2
+    cold_solutions: int = 100
+    cold_slots: int = 2
+
+    class Config:
+        env_prefix = 'TIMUS_CONTENT_'
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower())
+
+
+def tfidf(documents: Sequence[List[str]], max_features: int, min_df: int) -> np.ndarray:
+    """Sublinear TF-IDF matrix with l2-normalised rows over the max_features most common terms."""
+    frequencies = [Counter(tokens) for tokens in documents]
+    document_frequency: Counter[str] = Counter()
+    for counts in frequencies:
+        document_frequency.update(counts.keys())
+    terms = [term for term, df in document_frequency.most_common() if df >= min_df][:max_features]
+    vocabulary = {term: i for i, term in enumerate(terms)}
+
+    matrix = np.zeros((len(documents), len(terms)), dtype=np.float32)
+    for row, counts in enumerate(frequencies):
+        columns = [vocabulary[term] for term in counts if term in vocabulary]
+        values = [counts[term] for term in counts if term in vocabulary]
+        matrix[row, columns] = 1 + np.log(values, dtype=np.float32)
+    df = np.array([document_frequency[term] for term in terms], dtype=np.float32)
+    matrix *= np.log((1 + len(documents)) / (1 + df)) + 1
+    return _normalize(matrix)
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    normalized: np.ndarray = matrix / np.maximum(norms, 1e-12)
+    return normalized
+
+
+def reduce_dimensions(matrix: np.ndarray, components: int) -> np.ndarray:
+    """Truncated SVD through the eigendecomposition of the document Gram matrix.
+
+    There are far fewer problems than terms, so the n x n Gram matrix is cheap to decompose and U * S gives the
+    same document embeddings as a truncated SVD of the full matrix.
+    """
+    gram = matrix.astype(np.float64) @ matrix.T.astype(np.float64)
+    eigenvalues, eigenvectors = np.linalg.eigh(gram)
+    top = np.argsort(eigenvalues)[::-1][: min(components, *matrix.shape)]
+    embeddings = eigenvectors[:, top] * np.sqrt(np.maximum(eigenvalues[top], 0))
+    return _normalize(embeddings.astype(np.float32))
+
+
+def nearest_neighbours(embeddings: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k cosine neighbours of every row, excluding the row itself, computed block by block."""
+    size = embeddings.shape[0]
+    k = min(k, size - 1)
+    indices = np.empty((size, max(k, 0)), dtype=np.int64)
+    scores = np.empty((size, max(k, 0)), dtype=np.float32)
+    if k <= 0:
+        return indices, scores
+    for start in range(0, size, _BLOCK_SIZE):
+        similarities = embeddings[start : start + _BLOCK_SIZE] @ embeddings.T
+        rows = np.arange(similarities.shape[0])
+        similarities[rows, rows + start] = -np.inf
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(similarities, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        indices[start : start + similarities.shape[0]] = np.take_along_axis(top, order, axis=1)
+        scores[start : start + similarities.shape[0]] = np.take_along_axis(top_scores, order, axis=1)
+    return indices, scores
+
+
+def build_content_index(
+    statements: List[Tuple[int, str, str, int]],
+    output: Path,
+    *,
+    components: int,
+    neighbours: int,
+    max_features: int,
+    min_df: int,
+    timer: PhaseTimer,
+) -> Dict[str, Any]:
+    """Builds content neighbours from (number, title, html statement, solutions) and saves them to output."""
+    statements = sorted(statements)
+    with timer.phase('tokenize'):
+        documents = [tokenize(f'{title} {strip_statement(text)}') for _, title, text, _ in statements]
+    with timer.phase('tfidf'):
+        matrix = tfidf(documents, max_features, min_df)
+    with timer.phase('svd'):
+        embeddings = reduce_dimensions(matrix, components)
+    with timer.phase('neighbours'):
+        indices, scores = nearest_neighbours(embeddings, neighbours)
+
+    problems = np.array([number for number, _, _, _ in statements], dtype=np.int64)
+    arrays = {
+        'problems': problems,
+        'solutions': np.array([solutions for _, _, _, solutions in statements], dtype=np.int64),
+        'neighbours': problems[indices],
+        'scores': scores,
+    }
+    with timer.phase('save'):
+        output.mkdir(parents=True, exist_ok=True)
+        for name, array in arrays.items():
+            np.save(output / f'{name}.npy', array)
+        manifest = {
+            'params': {
+                'components': components,
+                'neighbours': neighbours,
+                'max_features': max_features,
+                'min_df': min_df,
+            },
+            'data': {
+                'problems': int(problems.size),
+                'terms': int(matrix.shape[1]),
+                'components': int(embeddings.shape[1]),
+            },
+            'timings': timer.durations,
+        }
+        (output / MANIFEST_FILE).write_text(json.dumps(manifest, indent=2))
+    return manifest
+
+
+class ContentNeighbours:
+    """Precomputed content neighbours, memory-mapped so loading is instant and the pages are shared."""
+
+    def __init__(self, problems: np.ndarray, solutions: np.ndarray, neighbours: np.ndarray, scores: np.ndarray):
+        self._problems = problems
+        self._solutions = solutions
+        self._neighbours = neighbours
+        self._scores = scores
+
+    @classmethod
+    def load(cls, path: Path) -> 'ContentNeighbours':
+        return cls(*(np.load(path / f'{name}.npy', mmap_mode='r') for name in _ARRAYS))
+
+    def __len__(self) -> int:
+        return int(self._problems.size)
+
+    def _lookup(self, problem_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Positions of problem_ids in the index and the mask of the ids which are there at all."""
+        problem_ids = np.asarray(problem_ids, dtype=np.int64)
+        if self._problems.size == 0:
+            return np.zeros(problem_ids.size, dtype=np.int64), np.zeros(problem_ids.size, dtype=bool)
+        positions = np.searchsorted(self._problems, problem_ids).clip(max=self._problems.size - 1)
+        return positions, self._problems[positions] == problem_ids
+
+    def get(self, problem_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns neighbours and similarities of the known problems among problem_ids, one row per problem."""
+        positions, known = self._lookup(problem_ids)
+        return np.asarray(self._neighbours[positions[known]]), np.asarray(self._scores[positions[known]])
+
+    def solutions(self, problem_ids: np.ndarray) -> np.ndarray:
+        """Number of solutions of every problem when the index was built, 0 for unknown problems."""
+        positions, known = self._lookup(problem_ids)
+        return np.where(known, np.asarray(self._solutions[positions]) if self._problems.size else 0, 0)
+
+    def recommend_cold(self, solved: np.ndarray, max_solutions: int, exclude: np.ndarray, k: int) -> List[int]:
+        """Rarely solved problems which are the most similar to the solved ones."""
+        neighbours, scores = self.get(solved)
+        candidates, index = np.unique(neighbours.ravel(), return_inverse=True)
+        totals = np.bincount(index, weights=scores.ravel(), minlength=candidates.size)
+        eligible = (self.solutions(candidates) <= max_solutions) & ~np.isin(candidates, exclude)
+        candidates, totals = candidates[eligible], totals[eligible]
+        return [int(problem) for problem in candidates[np.argsort(-totals, kind='stable')[:k]]]
+
+
+class ContentBlendRecommender(IRecommender):
+    """Reserves a few slots of another recommender's list for rarely solved problems similar to the solved ones.
+
+    Interaction models almost never recommend problems with few solvers, so without the blend they stay hidden.
+    """
+
+    def __init__(self, base: IRecommender, content: ContentNeighbours, cold_solutions: int, cold_slots: int):
+        self._base = base
+        self._content = content
+        self._cold_solutions = cold_solutions
+        self._cold_slots = cold_slots
+
+    def recommend(self, interactions: Interactions, k: int) -> List[int]:
+        recommended = self._base.recommend(interactions, k)
+        solved = np.unique(interactions.problem_ids)
+        slots = max(min(self._cold_slots, k), k - len(recommended))
+        cold = self._content.recommend_cold(
+            solved, self._cold_solutions, np.concatenate([solved, np.array(recommended, dtype=np.int64)]), slots
+        )
+        return (recommended[: k - len(cold)] + cold)[:k]
+
+
+def blend_content(base: IRecommender, settings: ContentSettings) -> IRecommender:
+    """Wraps base with ContentBlendRecommender when the content index is enabled and built."""
+    if not settings.enabled or not (settings.path / MANIFEST_FILE).exists():
+        return base
+    content = ContentNeighbours.load(settings.path)
+    logger.info("Blending content neighbours of %s problems", len(content))
+    return ContentBlendRecommender(base, content, settings.cold_solutions, settings.cold_slots)
@@ -0,0 +1,330 @@
+import abc
+import enum
+import logging
+import threading
+from typing import Counter, Dict, List, Tuple
+
+import numpy as np
+import sqlalchemy as sa
+from pydantic import BaseSettings
+from sqlalchemy import orm as so
+
+import db
+from src.metrics import REGISTRY
+from src.recommenders import IRecommender
+from src.storage import AuthorSolutions, Interactions, ISubmitListener
+
+logger = logging.getLogger(__name__)
+
+_PAIRS_PER_CHUNK = 10_000_000
+
+NEIGHBOUR_CACHE = REGISTRY.counter(
+    'timus_recommender_neighbour_cache_total', 'Neighbour list lookups by result.', labels=('result',)
+)
+
+
+class Similarity(str, enum.Enum):
+    JACCARD = 'jaccard'
+    COSINE = 'cosine'
+
+
+class CooccurrenceSettings(BaseSettings):
+    enabled: bool = False
+    similarity: Similarity = Similarity.JACCARD
+    neighbours: int = 50
+
+    class Config:
+        env_prefix = 'TIMUS_COOCCURRENCE_'
+
+
+def count_pairs(
+    interactions: Interactions, pairs_per_chunk: int = _PAIRS_PER_CHUNK
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Counts solvers of every problem and of every pair of problems solved by the same author.
+
+    Returns problems with their solvers and the (first, second) problem pairs, first < second, with theirs. Pairs
+    are generated for chunks of authors with at most pairs_per_chunk pairs and merged into sparse counts, so memory
+    depends on the number of distinct pairs instead of the square of the number of problems.
+    """
+    problems, problem_index = np.unique(interactions.problem_ids, return_inverse=True)
+    solvers = np.bincount(problem_index, minlength=problems.size)
+    order = np.argsort(interactions.author_ids, kind='stable')
+    indices = problem_index[order]
+    authors = interactions.author_ids[order]
+    starts = np.flatnonzero(np.r_[True, authors[1:] != authors[:-1]])
+    sizes = np.diff(np.r_[starts, authors.size])
+    author_pairs = np.cumsum(sizes * (sizes - 1) // 2)
+
+    keys = np.empty(0, dtype=np.int64)
+    counts = np.empty(0, dtype=np.int64)
+    first_author = 0
+    while first_author < starts.size:
+        done = author_pairs[first_author - 1] if first_author else 0
+        last_author = max(int(np.searchsorted(author_pairs, done + pairs_per_chunk, side='right')), first_author + 1)
+        chunk_keys = _pair_keys(
+            indices, starts[first_author:last_author], sizes[first_author:last_author], problems.size
+        )
+        chunk_keys, chunk_counts = np.unique(chunk_keys, return_counts=True)
+        keys, index = np.unique(np.r_[keys, chunk_keys], return_inverse=True)
+        counts = np.bincount(index, weights=np.r_[counts, chunk_counts]).astype(np.int64)
+        first_author = last_author
+
+    first, second = np.divmod(keys, max(problems.size, 1))
+    return problems, solvers, problems[first], problems[second], counts
+
+
+def _pair_keys(indices: np.ndarray, starts: np.ndarray, sizes: np.ndarray, problems: int) -> np.ndarray:
+    """Encodes every pair of problem indices within each group as smaller * problems + larger."""
+    positions = np.repeat(starts, sizes) + np.arange(int(sizes.sum())) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    # Every position is paired with the positions after it in its group
+    later = np.repeat(starts + sizes, sizes) - positions - 1
+    left = np.repeat(positions, later)
+    offsets = np.arange(left.size) - np.repeat(np.cumsum(later) - later, later)
+    right = left + offsets + 1
+    smaller = np.minimum(indices[left], indices[right])
+    larger = np.maximum(indices[left], indices[right])
+    keys: np.ndarray = smaller * problems + larger
+    return keys
+
+
+class INeighbourStorage(abc.ABC):
+    @abc.abstractmethod
+    def get_versions(self, problem_ids: List[int]) -> Dict[int, int]:
+        """Versions of the counts of the problems, problems which are not listed have version 0."""
+
+    @abc.abstractmethod
+    def get_neighbours(
+        self, problem_ids: List[int], similarity: Similarity, limit: int
+    ) -> Dict[int, Tuple[int, np.ndarray, np.ndarray]]:
+        """Computes the most similar problems of each problem.
+
+        Returns a mapping from a problem to its version, neighbour problems and their similarities.
+        """
+
+
+def _top_neighbours(
+    problem_solvers: int,
+    neighbours: np.ndarray,
+    both: np.ndarray,
+    other_solvers: np.ndarray,
+    similarity: Similarity,
+    limit: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    both = both.astype(np.float64)
+    other_solvers = other_solvers.astype(np.float64)
+    if similarity == Similarity.JACCARD:
+        scores = both / np.maximum(problem_solvers + other_solvers - both, 1)
+    else:
+        scores = both / np.maximum(np.sqrt(problem_solvers * other_solvers), 1)
+    top = np.argsort(-scores, kind='stable')[:limit]
+    return neighbours[top], scores[top]
+
+
+class CooccurrenceStorage(ISubmitListener, INeighbourStorage):
+    """Number of solvers of every problem and of every pair of problems.
+
+    The counts are updated in the transaction which inserts new submits, so the cost of an update is proportional
+    to the number of new solutions times the number of problems their authors solved before. Every problem whose
+    counts changed gets its version bumped, which is how CooccurrenceRecommender finds stale neighbour lists.
+    """
+
+    def on_submits_created(
+        self, session: so.Session, submits: List[db.Submit], solutions: Dict[int, AuthorSolutions]
+    ) -> None:
+        solvers: Counter[int] = Counter()
+        pairs: Counter[Tuple[int, int]] = Counter()
+        for author in solutions.values():
+            known = set(author.solved_before)
+            for submit in author.new_solutions:
+                problem_id = submit.timus_problem_id
+                solvers[problem_id] += 1
+                for other_problem_id in known:
+                    pairs[min(problem_id, other_problem_id), max(problem_id, other_problem_id)] += 1
+                known.add(problem_id)
+        if solvers:
+            self._apply(session, solvers, pairs)
+
+    def _apply(self, session: so.Session, solvers: Counter[int], pairs: Counter[Tuple[int, int]]) -> None:
+        touched = set(solvers)
+        for first, second in pairs:
+            touched.update((first, second))
+        # Rows are always written in key order, so concurrent transactions lock them in the same order
+        db.increment(
+            session,
+            db.ProblemSolvers,
+            keys=('timus_problem_id',),
+            counters=('solvers', 'version'),
+            rows=[
+                {'timus_problem_id': problem_id, 'solvers': solvers.get(problem_id, 0), 'version': 1}
+                for problem_id in sorted(touched)
+            ],
+        )
+        db.increment(
+            session,
+            db.ProblemPair,
+            keys=('first_problem_id', 'second_problem_id'),
+            counters=('solvers',),
+            rows=[
+                {'first_problem_id': first, 'second_problem_id': second, 'solvers': count}
+                for (first, second), count in sorted(pairs.items())
+            ],
+        )
+
+    def get_versions(self, problem_ids: List[int]) -> Dict[int, int]:
+        with db.create_session() as session:
+            query = session.query(db.ProblemSolvers.timus_problem_id, db.ProblemSolvers.version).filter(
+                db.ProblemSolvers.timus_problem_id.in_(problem_ids)
+            )
+            return {problem_id: version for problem_id, version in query}
+
+    def get_neighbours(
+        self, problem_ids: List[int], similarity: Similarity, limit: int
+    ) -> Dict[int, Tuple[int, np.ndarray, np.ndarray]]:
+        with db.create_session() as session:
+            versions = {
+                problem_id: (solvers, version)
+                for problem_id, solvers, version in session.query(
+                    db.ProblemSolvers.timus_problem_id, db.ProblemSolvers.solvers, db.ProblemSolvers.version
+                ).filter(db.ProblemSolvers.timus_problem_id.in_(problem_ids))
+            }
+            pairs = session.query(
+                db.ProblemPair.first_problem_id, db.ProblemPair.second_problem_id, db.ProblemPair.solvers
+            ).filter(
+                sa.or_(
+                    db.ProblemPair.first_problem_id.in_(problem_ids),
+                    db.ProblemPair.second_problem_id.in_(problem_ids),
+                )
+            )
+            edges: Dict[int, List[Tuple[int, int]]] = {problem_id: [] for problem_id in problem_ids}
+            for first, second, count in pairs:
+                if first in edges:
+                    edges[first].append((second, count))
+                if second in edges:
+                    edges[second].append((first, count))
+            others = {other for problem_edges in edges.values() for other, _ in problem_edges}
+            solvers = dict(
+                session.query(db.ProblemSolvers.timus_problem_id, db.ProblemSolvers.solvers).filter(
+                    db.ProblemSolvers.timus_problem_id.in_(others)
+                )
+            )
+
+        result = {}
+        for problem_id, problem_edges in edges.items():
+            problem_solvers, version = versions.get(problem_id, (0, 0))
+            neighbours = np.array([other for other, _ in problem_edges], dtype=np.int64)
+            both = np.array([count for _, count in problem_edges], dtype=np.int64)
+            other_solvers = np.array([solvers.get(other, 0) for other, _ in problem_edges], dtype=np.int64)
+            result[problem_id] = (
+                version,
+                *_top_neighbours(problem_solvers, neighbours, both, other_solvers, similarity, limit),
+            )
+        return result
+
+    def rebuild(self, interactions: Interactions) -> None:
+        """Replaces all counts with the ones computed from unique (author, problem) interactions."""
+        problems, solvers, first, second, pair_solvers = count_pairs(interactions)
+        with db.create_session() as session:
+            # Versions keep growing, so neighbour lists cached before the rebuild become stale
+            version = (session.query(sa.func.max(db.ProblemSolvers.version)).scalar() or 0) + 1
+            session.query(db.ProblemPair).delete()
+            session.query(db.ProblemSolvers).delete()
+            session.bulk_insert_mappings(
+                db.ProblemSolvers,
+                [
+                    {'timus_problem_id': problem_id, 'solvers': count, 'version': version}
+                    for problem_id, count in zip(problems.tolist(), solvers.tolist())
+                ],
+            )
+            session.bulk_insert_mappings(
+                db.ProblemPair,
+                [
+                    {'first_problem_id': first_problem_id, 'second_problem_id': second_problem_id, 'solvers': count}
+                    for first_problem_id, second_problem_id, count in zip(
+                        first.tolist(), second.tolist(), pair_solvers.tolist()
+                    )
+                ],
+            )
+        logger.info("Rebuilt co-occurrence counts of %s problems and %s pairs", problems.size, first.size)
+
+
+class InMemoryCooccurrence(INeighbourStorage):
+    """Counts of a fixed set of interactions kept in memory, which is how models are evaluated on past data only."""
+
+    def __init__(self, interactions: Interactions):
+        problems, solvers, first, second, pair_solvers = count_pairs(interactions)
+        self._solvers = dict(zip(problems.tolist(), solvers.tolist()))
+        # Every pair is stored in both directions, sorted by the first problem
+        sources, targets = np.r_[first, second], np.r_[second, first]
+        order = np.argsort(sources, kind='stable')
+        self._sources, self._targets = sources[order], targets[order]
+        self._pair_solvers = np.r_[pair_solvers, pair_solvers][order]
+
+    def get_versions(self, problem_ids: List[int]) -> Dict[int, int]:
+        return {}
+
+    def get_neighbours(
+        self, problem_ids: List[int], similarity: Similarity, limit: int
+    ) -> Dict[int, Tuple[int, np.ndarray, np.ndarray]]:
+        result = {}
+        for problem_id in problem_ids:
+            start, end = np.searchsorted(self._sources, [problem_id, problem_id + 1])
+            neighbours = self._targets[start:end]
+            other_solvers = np.array([self._solvers.get(other, 0) for other in neighbours.tolist()], dtype=np.int64)
+            result[problem_id] = (
+                0,
+                *_top_neighbours(
+                    self._solvers.get(problem_id, 0),
+                    neighbours,
+                    self._pair_solvers[start:end],
+                    other_solvers,
+                    similarity,
+                    limit,
+                ),
+            )
+        return result
+
+
+class CooccurrenceRecommender(IRecommender):
+    """Item-to-item recommender over co-occurrence counts, usually a CooccurrenceStorage.
+
+    Neighbour lists are computed lazily and cached together with the problem version they were computed for,
+    so only problems whose counts changed since the last request are recomputed.
+    """
+
+    def __init__(self, storage: INeighbourStorage, similarity: Similarity, neighbours: int):
+        self._storage = storage
+        self._similarity = similarity
+        self._neighbours = neighbours
+        self._cache: Dict[int, Tuple[int, np.ndarray, np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+    def recommend(self, interactions: Interactions, k: int) -> List[int]:
+        solved = np.unique(interactions.problem_ids)
+        if solved.size == 0:
+            return []
+        neighbours = self.get_neighbours(solved.tolist())
+        candidates = np.concatenate([problems for _, problems, _ in neighbours.values()] + [np.empty(0, np.int64)])
+        scores = np.concatenate([scores for _, _, scores in neighbours.values()] + [np.empty(0)])
+        candidate_ids, index = np.unique(candidates, return_inverse=True)
+        totals = np.bincount(index, weights=scores, minlength=candidate_ids.size)
+        totals[np.isin(candidate_ids, solved)] = -np.inf
+        top = np.argsort(-totals, kind='stable')[:k]
+        return [int(problem_id) for problem_id in candidate_ids[top[np.isfinite(totals[top])]]]
+
+    def get_neighbours(self, problem_ids: List[int]) -> Dict[int, Tuple[int, np.ndarray, np.ndarray]]:
+        versions = self._storage.get_versions(problem_ids)
+        with self._lock:
+            cached = {problem_id: self._cache.get(problem_id) for problem_id in problem_ids}
+        stale = [
+            problem_id
+            for problem_id, entry in cached.items()
+            if entry is None or entry[0] != versions.get(problem_id, 0)
+        ]
+        NEIGHBOUR_CACHE.inc('hit', amount=len(cached) - len(stale))
+        NEIGHBOUR_CACHE.inc('miss', amount=len(stale))
+        if stale:
+            fresh = self._storage.get_neighbours(stale, self._similarity, self._neighbours)
+            with self._lock:
+                self._cache.update(fresh)
+            cached.update(fresh)
+        return {problem_id: entry for problem_id, entry in cached.items() if entry is not None}
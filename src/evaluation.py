@@ -0,0 +1,206 @@
+import json
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from src.config import DBSettings
+from src.cooccurrence import CooccurrenceRecommender, CooccurrenceSettings, InMemoryCooccurrence
+from src.recommenders import ComplexityRecommender, IRecommender, ModelRecommender
+from src.storage import Interactions, ProblemStorage
+from src.training import MANIFEST_FILE, fit_item_similarity
+
+_NO_PROBLEM = -1
+
+
+class Holdout(NamedTuple):
+    train: Interactions
+    test: Interactions
+    authors: np.ndarray
+    catalogue_size: int
+    # All interactions up to the cutoff submit, the only ones models may be trained on
+    history: Interactions
+    cutoff: int
+
+
+class ModelReport(NamedTuple):
+    model: str
+    users: int
+    map_at_k: float
+    recall_at_k: float
+    coverage: float
+    latency_mean_ms: float
+    latency_p50_ms: float
+    latency_p95_ms: float
+    latency_p99_ms: float
+    wall_time_s: float
+
+
+def time_based_holdout(
+    interactions: Interactions, holdout_fraction: float, min_train_problems: int, max_users: Optional[int]
+) -> Holdout:
+    """Holds out the latest holdout_fraction of unique interactions.
+
+    Submit ids grow with time, so everything after the cutoff submit is the test set. Only authors with at least
+    min_train_problems problems before the cutoff and something after it are evaluated.
+    """
+    cutoff = int(np.quantile(interactions.submit_ids, 1 - holdout_fraction)) if len(interactions) else 0
+    is_test = interactions.submit_ids > cutoff
+    train, test = interactions.take(~is_test), interactions.take(is_test)
+
+    train_authors, train_counts = np.unique(train.author_ids, return_counts=True)
+    authors = np.intersect1d(train_authors[train_counts >= min_train_problems], test.author_ids)
+    if max_users is not None and authors.size > max_users:
+        # A fixed multiplicative hash picks the same pseudo-random subset on every run
+        authors = np.sort(authors[np.argsort((authors * 2654435761) % 2**32, kind='stable')[:max_users]])
+
+    return Holdout(
+        train=train.take(np.isin(train.author_ids, authors)),
+        test=test.take(np.isin(test.author_ids, authors)),
+        authors=authors,
+        catalogue_size=int(np.unique(interactions.problem_ids).size),
+        history=train,
+        cutoff=cutoff,
+    )
+
+
+RecommenderFactory = Callable[[], IRecommender]
+
+
+def prepare_recommender(spec: str, holdout: Holdout, workdir: Path) -> RecommenderFactory:
+    """Builds a picklable factory of the recommender described by a spec.
+
+    Specs are 'complexity', 'complexity:<csv>', 'cooccurrence', 'turicreate' and 'turicreate:<path>'. Models which
+    learn from submits only see the holdout history: co-occurrence counts are computed from it in memory and
+    'turicreate' trains an item similarity model on it in workdir. A saved turicreate model is only accepted when
+    its manifest shows it was trained on submits before the cutoff.
+    """
+    kind, _, argument = spec.partition(':')
+    if kind == 'complexity':
+        return partial(_load_complexity, argument)
+    if kind == 'cooccurrence':
+        settings = CooccurrenceSettings()
+        return partial(
+            CooccurrenceRecommender, InMemoryCooccurrence(holdout.history), settings.similarity, settings.neighbours
+        )
+    if kind == 'turicreate':
+        if argument:
+            _check_trained_before(Path(argument), holdout.cutoff)
+            return partial(_load_turicreate, argument)
+        model_path = workdir / 'model'
+        fit_item_similarity(holdout.history).save(str(model_path))
+        return partial(_load_turicreate, str(model_path))
+    raise ValueError(f"Unknown model spec: {spec}")
+
+
+def _check_trained_before(model_path: Path, cutoff: int) -> None:
+    manifest_path = model_path.parent / MANIFEST_FILE
+    if not manifest_path.exists():
+        raise ValueError(f"{model_path} has no {MANIFEST_FILE}, so it may have been trained on the test period")
+    max_submit_id = json.loads(manifest_path.read_text())['data']['max_submit_id']
+    if max_submit_id is not None and max_submit_id > cutoff:
+        raise ValueError(f"{model_path} was trained on submits up to {max_submit_id}, after the cutoff {cutoff}")
+
+
+def _load_complexity(path: str) -> IRecommender:
+    if path:
+        return ComplexityRecommender.from_csv(Path(path))
+    return ComplexityRecommender.from_storage(ProblemStorage())
+
+
+def _load_turicreate(path: str) -> IRecommender:
+    import turicreate as tc
+
+    return ModelRecommender(tc.load_model(path))
+
+
+_recommender: Optional[IRecommender] = None
+
+
+def _init_worker(factory: RecommenderFactory) -> None:
+    global _recommender
+    DBSettings(need_create_database=False).setup_db()
+    _recommender = factory()
+
+
+def _recommend_batch(batch: List[Interactions], k: int) -> Tuple[np.ndarray, np.ndarray]:
+    assert _recommender is not None
+    recommendations = np.full((len(batch), k), _NO_PROBLEM, dtype=np.int64)
+    latencies = np.empty(len(batch), dtype=np.float64)
+    for i, interactions in enumerate(batch):
+        started_at = time.perf_counter()
+        recommended = _recommender.recommend(interactions, k)[:k]
+        latencies[i] = time.perf_counter() - started_at
+        recommendations[i, : len(recommended)] = recommended
+    return recommendations, latencies
+
+
+def split_by_author(interactions: Interactions, authors: np.ndarray) -> List[Interactions]:
+    """Splits interactions into one Interactions per author, in the order of the sorted authors array."""
+    order = np.argsort(interactions.author_ids, kind='stable')
+    sorted_interactions = interactions.take(order)
+    bounds = np.searchsorted(sorted_interactions.author_ids, authors, side='right')
+    starts = np.r_[0, bounds[:-1]]
+    return [sorted_interactions.take(slice(start, end)) for start, end in zip(starts, bounds)]
+
+
+def recommend_all(
+    factory: RecommenderFactory, per_author: List[Interactions], k: int, batch_size: int, workers: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    batches = [per_author[i : i + batch_size] for i in range(0, len(per_author), batch_size)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(factory,)) as executor:
+        results = list(executor.map(_recommend_batch, batches, [k] * len(batches)))
+    if not results:
+        return np.empty((0, k), dtype=np.int64), np.empty(0)
+    recommendations, latencies = zip(*results)
+    return np.concatenate(recommendations), np.concatenate(latencies)
+
+
+def score(recommendations: np.ndarray, holdout: Holdout, k: int) -> Dict[str, float]:
+    """Computes MAP@k, recall@k and catalogue coverage for recommendations aligned with holdout.authors."""
+    users = holdout.authors.size
+    test_users = np.searchsorted(holdout.authors, holdout.test.author_ids)
+    relevant = np.bincount(test_users, minlength=users)
+
+    test_keys = (test_users << 32) | holdout.test.problem_ids
+    recommended_keys = (np.arange(users)[:, None] << 32) | np.where(recommendations >= 0, recommendations, 0)
+    hits = np.isin(recommended_keys, test_keys) & (recommendations != _NO_PROBLEM)
+
+    ranks = np.arange(1, k + 1)
+    precisions = np.cumsum(hits, axis=1) / ranks
+    average_precision = (precisions * hits).sum(axis=1) / np.maximum(np.minimum(relevant, k), 1)
+    recall = hits.sum(axis=1) / np.maximum(relevant, 1)
+    recommended_problems = np.unique(recommendations[recommendations != _NO_PROBLEM])
+    return {
+        'map_at_k': float(average_precision.mean()) if users else 0.0,
+        'recall_at_k': float(recall.mean()) if users else 0.0,
+        'coverage': recommended_problems.size / holdout.catalogue_size if holdout.catalogue_size else 0.0,
+    }
+
+
+def evaluate(spec: str, holdout: Holdout, k: int, batch_size: int, workers: int) -> ModelReport:
+    per_author = split_by_author(holdout.train, holdout.authors)
+    with tempfile.TemporaryDirectory() as workdir:
+        factory = prepare_recommender(spec, holdout, Path(workdir))
+        started_at = time.perf_counter()
+        recommendations, latencies = recommend_all(factory, per_author, k, batch_size, workers)
+        wall_time = time.perf_counter() - started_at
+    metrics = score(recommendations, holdout, k)
+    latencies_ms = latencies * 1000 if latencies.size else np.zeros(1)
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    return ModelReport(
+        model=spec,
+        users=int(holdout.authors.size),
+        map_at_k=metrics['map_at_k'],
+        recall_at_k=metrics['recall_at_k'],
+        coverage=metrics['coverage'],
+        latency_mean_ms=float(latencies_ms.mean()),
+        latency_p50_ms=float(p50),
+        latency_p95_ms=float(p95),
+        latency_p99_ms=float(p99),
+        wall_time_s=wall_time,
+    )
@@ -1,16 +1,24 @@
 import abc
 import logging
-import time
-from typing import Any, List, Optional
+from typing import List, Optional, Tuple
 
 import telebot
-import turicreate as tc
 
-from src.loader import TimusAPIClient, Verdict
-from src.storage import DBSubmit, DBUser, SubmitStorage, UserStorage
+from src.metrics import REGISTRY, Trace
+from src.popularity import PopularityStorage, ProblemPopularity
+from src.recommenders import IRecommender
+from src.search import SearchUnavailable
+from src.storage import Interactions, ProblemStorage, SubmitStorage, UserStorage
+from src.sync import SubmitSyncer
+from src.warmup import ModelHolder
 
 logger = logging.getLogger(__name__)
 
+RECOMMENDATIONS = REGISTRY.counter(
+    'timus_recommender_recommendations_total', 'Answered /recommend requests.', labels=('recommender',)
+)
+MODEL_FAILURES = REGISTRY.counter('timus_recommender_model_failures_total', 'Model errors answered by the fallback.')
+
 
 class IBotHandler(abc.ABC):
     @abc.abstractmethod
@@ -31,13 +39,11 @@ class StartHandler(IBotHandler):
         self,
         bot: telebot.TeleBot,
         user_storage: UserStorage,
-        submit_storage: SubmitStorage,
-        timus_client: TimusAPIClient,
+        submit_syncer: SubmitSyncer,
     ):
         self._bot = bot
         self._user_storage = user_storage
-        self._submit_storage = submit_storage
-        self._timus_client = timus_client
+        self._submit_syncer = submit_syncer
 
     def __call__(self, message: telebot.types.Message) -> None:
         msg = self._bot.reply_to(
@@ -55,7 +61,7 @@ class StartHandler(IBotHandler):
             self._bot.send_message(message.from_user.id, 'Какое-то палево, напиши @tinsane')
         else:
             self._bot.send_message(message.from_user.id, 'Молодец, возьми с полки пирожок.')
-            fetch_submits(user, self._submit_storage, self._timus_client)
+            self._submit_syncer.sync(user)
 
 
 class RecommendHandler(IBotHandler):
@@ -64,66 +70,116 @@ class RecommendHandler(IBotHandler):
         bot: telebot.TeleBot,
         user_storage: UserStorage,
         submit_storage: SubmitStorage,
-        timus_client: TimusAPIClient,
-        model: Any,
+        submit_syncer: SubmitSyncer,
+        model: ModelHolder,
+        fallback: IRecommender,
+        cold_start_threshold: int,
+        recommendations_count: int,
     ):
         self._bot = bot
         self._user_storage = user_storage
         self._submit_storage = submit_storage
-        self._timus_client = timus_client
+        self._submit_syncer = submit_syncer
         self._model = model
+        self._fallback = fallback
+        self._cold_start_threshold = cold_start_threshold
+        self._recommendations_count = recommendations_count
 
     def __call__(self, message: telebot.types.Message) -> None:
-        logger.info("Started at: %s", time.time())
-        user = self._user_storage.get_user(int(message.from_user.id))
-        fetch_submits(user, self._submit_storage, self._timus_client)
-        ac_submits = [
-            submit
-            for submit in self._submit_storage.get_all_by_author(user.timus_id)
-            if submit.verdict == Verdict.ACCEPTED
-        ]
-        logger.info("Loaded submissions at: %s", time.time())
-        sub_df = to_unique_submits_df(ac_submits)
-        # TODO : fails with zero submits :(
-        # print(model.recommend(users=[248409]))  # noqa=E800
-        recommendation = self._model.recommend_from_interactions(sub_df)
-        logger.info("Computed recommendations at: %s", time.time())
-        self._bot.send_message(
-            message.from_user.id,
-            "Попробуй решить эти задачи:\n%s" % '\n'.join(map(str, recommendation['problemid'])),
-        )
+        trace = Trace('recommend')
+        with trace.span('user_lookup'):
+            user = self._user_storage.get_user(int(message.from_user.id))
+        with trace.span('timus_sync'):
+            self._submit_syncer.sync(user)
+        with trace.span('db_read'):
+            interactions = self._submit_storage.get_accepted_interactions(user.timus_id)
+        with trace.span('scoring'):
+            recommender, recommendation = self._recommend(interactions)
+        RECOMMENDATIONS.inc(recommender if recommendation else 'none')
+        with trace.span('telegram_send'):
+            if not recommendation:
+                self._bot.send_message(message.from_user.id, 'Пока нечего посоветовать, загляни попозже.')
+            else:
+                self._bot.send_message(
+                    message.from_user.id,
+                    "Попробуй решить эти задачи:\n%s" % '\n'.join(map(str, recommendation)),
+                )
+        trace.finish(user=user.timus_id, recommender=recommender)
+
+    def _recommend(self, interactions: Interactions) -> Tuple[str, List[int]]:
+        model: Optional[IRecommender] = self._model.get_or_none()
+        if model is not None and len(interactions) >= self._cold_start_threshold:
+            try:
+                return 'model', model.recommend(interactions, self._recommendations_count)
+            except Exception:
+                MODEL_FAILURES.inc()
+                logger.exception("Model failed, falling back")
+        return 'fallback', self._fallback.recommend(interactions, self._recommendations_count)
+
+
+class SearchHandler(IBotHandler):
+    def __init__(self, bot: telebot.TeleBot, problem_storage: ProblemStorage, limit: int):
+        self._bot = bot
+        self._problem_storage = problem_storage
+        self._limit = limit
 
+    def __call__(self, message: telebot.types.Message) -> None:
+        trace = Trace('search')
+        query = (message.text or '').partition(' ')[2].strip()
+        if not query:
+            self._bot.reply_to(message, 'Напиши, что искать. Например: /search дерево отрезков')
+            return
+        with trace.span('search'):
+            try:
+                results = self._problem_storage.search(query, self._limit)
+            except SearchUnavailable:
+                logger.warning("Search is unavailable on this database")
+                self._bot.reply_to(message, 'Поиск сейчас недоступен.')
+                return
+        with trace.span('telegram_send'):
+            if not results:
+                self._bot.reply_to(message, 'Ничего не нашлось.')
+            else:
+                self._bot.reply_to(message, '\n'.join(f'{result.number}. {result.title}' for result in results))
+        trace.finish(results=len(results))
+
+
+class TrendingHandler(IBotHandler):
+    def __init__(
+        self,
+        bot: telebot.TeleBot,
+        popularity_storage: PopularityStorage,
+        problem_storage: ProblemStorage,
+        days: int,
+        limit: int,
+    ):
+        self._bot = bot
+        self._popularity_storage = popularity_storage
+        self._problem_storage = problem_storage
+        self._days = days
+        self._limit = limit
 
-def fetch_submits(user: DBUser, submit_storage: SubmitStorage, client: TimusAPIClient) -> None:
-    last_submit = submit_storage.get_last_or_none(user.timus_id)
-    fetch_to = last_submit.submit_id if last_submit is not None else 0
-    from_submit_id: Optional[int] = None
-    count = 100
-    submits = []
-    while True:
-        current_submits = client.get_submits(author_id=user.timus_id, count=count, from_submit_id=from_submit_id)
-        finished_fetching = False
-        for submit in current_submits:
-            if submit.submit_id == fetch_to:
-                finished_fetching = True
-                break
-            submits.append(submit)
-        if finished_fetching:
-            break
-        from_submit_id = submits[-1].submit_id - 1
-    submit_storage.batch_create(submits)
-
-
-def to_unique_submits_df(submits: List[DBSubmit]) -> tc.SFrame:
-    problems = {}
-    for submit in submits[::-1]:
-        problems[submit.problem_id] = (submit.submit_id, submit.timus_user_id)
-    sub_col = []
-    prob_col = []
-    auth_col = []
-    for problem in problems:
-        sub_id, author_id = problems[problem]
-        sub_col.append(sub_id)
-        prob_col.append(problem)
-        auth_col.append(author_id)
-    return tc.SFrame({'submitid': sub_col, 'authorid': auth_col, 'problemid': prob_col})
+    def __call__(self, message: telebot.types.Message) -> None:
+        trace = Trace('trending')
+        with trace.span('db_read'):
+            trending = self._popularity_storage.trending(self._days, self._limit)
+            problem_ids = [problem_id for problem_id, _ in trending]
+            titles = self._problem_storage.get_titles(problem_ids)
+            popularity = self._popularity_storage.get(problem_ids)
+        with trace.span('telegram_send'):
+            if not trending:
+                self._bot.reply_to(message, 'За последние дни никто ничего не решил.')
+            else:
+                lines = [
+                    f'{problem_id}. {titles.get(problem_id, "")} — решили {solvers}'
+                    + _format_medians(popularity.get(problem_id))
+                    for problem_id, solvers in trending
+                ]
+                self._bot.reply_to(message, f'Популярное за {self._days} дн.:\n' + '\n'.join(lines))
+        trace.finish(results=len(trending))
+
+
+def _format_medians(popularity: Optional[ProblemPopularity]) -> str:
+    if popularity is None or popularity.median_runtime_ms is None or popularity.median_memory_kb is None:
+        return ''
+    return f', медиана {popularity.median_runtime_ms:.0f} мс, {popularity.median_memory_kb:.0f} КБ'
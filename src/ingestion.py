@@ -0,0 +1,288 @@
+import logging
+import queue
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Protocol, Sequence, Union
+
+import sqlalchemy as sa
+from pydantic import BaseModel, BaseSettings
+from sqlalchemy import orm as so
+
+import db
+from src.loader import TimusAPISubmit
+from src.metrics import REGISTRY
+from src.storage import SubmitStorage
+
+logger = logging.getLogger(__name__)
+
+_POLL_INTERVAL = 1.0
+
+INGESTED_SUBMITS = REGISTRY.counter(
+    'timus_recommender_ingested_submits_total', 'Submits committed by the ingestion writer.', labels=('space',)
+)
+INGESTION_COMMIT_SECONDS = REGISTRY.histogram(
+    'timus_recommender_ingestion_commit_seconds', 'Duration of ingestion writer transactions.'
+)
+
+
+class IngestionSettings(BaseSettings):
+    # A transaction is committed once it has commit_size submits or its oldest batch waited max_latency seconds
+    commit_size: int = 5_000
+    max_latency: float = 2.0
+    # Producers block once this many batches wait for the writer
+    queue_size: int = 32
+    # A new run of the main space is split by submit id into this many ranges, each fetched by its own producer
+    workers: int = 1
+
+    class Config:
+        env_prefix = 'TIMUS_INGESTION_'
+
+
+class SubmitBatch(NamedTuple):
+    space: int
+    submits: List[TimusAPISubmit]
+    # The producer has reached its stop point, its part of the run is complete once this batch is committed
+    done: bool = False
+    # The IngestionShard the batch belongs to, None when the space is loaded by a single producer
+    shard: Optional[int] = None
+
+
+class ProducerFailed(NamedTuple):
+    space: int
+    error: str
+    shard: Optional[int] = None
+
+
+Message = Union[SubmitBatch, ProducerFailed]
+
+
+class Producer(NamedTuple):
+    space: int
+    shard: Optional[int] = None
+
+
+class MessageQueue(Protocol):
+    """queue.Queue or multiprocessing.Queue, whichever the producers run on."""
+
+    def get(self, block: bool = True, timeout: Optional[float] = None) -> Message: ...
+
+
+class DBIngestionShard(BaseModel):
+    id: int
+    space: int
+    low: int
+    high: int
+    next_from: Optional[int]
+
+    class Config:
+        frozen = True
+        orm_mode = True
+
+
+class DBIngestionCursor(BaseModel):
+    space: int
+    stop_at: Optional[int]
+    next_from: Optional[int]
+    run_top: Optional[int]
+
+    class Config:
+        frozen = True
+
+
+class IngestionCursorStorage:
+    def get_or_create(self, space: int) -> DBIngestionCursor:
+        """Returns the cursor of the space; a space loaded before cursors existed stops at its newest submit."""
+        with db.create_session() as session:
+            cursor = session.query(db.IngestionCursor).filter(db.IngestionCursor.space == space).one_or_none()
+            if cursor is None:
+                last = session.query(sa.func.max(db.Submit.timus_submit_id)).filter(db.Submit.space == space).scalar()
+                cursor = db.IngestionCursor(space=space, stop_at=last, next_from=None, run_top=None)
+                session.add(cursor)
+                session.flush()
+            return DBIngestionCursor(
+                space=space, stop_at=cursor.stop_at, next_from=cursor.next_from, run_top=cursor.run_top
+            )
+
+    def get_shards(self, space: int) -> List[DBIngestionShard]:
+        """Shards of the unfinished sharded run of the space, newest first."""
+        with db.create_session() as session:
+            shards = (
+                session.query(db.IngestionShard)
+                .filter(db.IngestionShard.space == space)
+                .order_by(db.IngestionShard.high.desc())
+            )
+            return [DBIngestionShard.from_orm(shard) for shard in shards]
+
+    def create_shards(self, space: int, top: int, count: int) -> List[DBIngestionShard]:
+        """Starts a run of the space up to top, split into count submit id ranges of equal width."""
+        with db.create_session() as session:
+            cursor = session.query(db.IngestionCursor).filter(db.IngestionCursor.space == space).one()
+            low = cursor.stop_at or 0
+            if top <= low:
+                return []
+            bounds = sorted({low + (top - low) * index // count for index in range(count + 1)})
+            shards = [
+                db.IngestionShard(space=space, low=shard_low, high=shard_high, next_from=None)
+                for shard_low, shard_high in zip(bounds, bounds[1:])
+            ]
+            session.add_all(shards)
+            cursor.run_top = top
+            session.flush()
+            return [DBIngestionShard.from_orm(shard) for shard in reversed(shards)]
+
+    def advance(self, session: so.Session, batch: SubmitBatch) -> None:
+        """Moves the cursor of the batch's space past it in the transaction which stores the batch."""
+        cursor = session.query(db.IngestionCursor).filter(db.IngestionCursor.space == batch.space).one()
+        if batch.shard is not None:
+            if not self._advance_shard(session, batch):
+                return
+        elif batch.submits:
+            submit_ids = [submit.submit_id for submit in batch.submits]
+            cursor.run_top = max([cursor.run_top or 0] + submit_ids)
+            cursor.next_from = min(submit_ids) - 1
+        if batch.done:
+            if cursor.run_top is not None:
+                cursor.stop_at = max(cursor.stop_at or 0, cursor.run_top)
+            cursor.next_from = None
+            cursor.run_top = None
+        session.flush()
+
+    def _advance_shard(self, session: so.Session, batch: SubmitBatch) -> bool:
+        """Moves the shard past the batch and tells whether the batch completes the whole run of the space."""
+        shard = session.query(db.IngestionShard).filter(db.IngestionShard.id == batch.shard).one()
+        if batch.submits:
+            shard.next_from = min(submit.submit_id for submit in batch.submits) - 1
+        if not batch.done:
+            session.flush()
+            return False
+        session.delete(shard)
+        session.flush()
+        remaining: int = session.query(db.IngestionShard).filter(db.IngestionShard.space == batch.space).count()
+        return remaining == 0
+
+
+class IngestionResult(NamedTuple):
+    saved: Dict[int, int]
+    failed: Dict[int, str]
+
+
+class IngestionWriter:
+    """The only writer of submits during ingestion.
+
+    Producers put SubmitBatch messages on a bounded queue, which blocks them when the writer falls behind.
+    Batches are merged into transactions of up to commit_size submits, each committed at most max_latency seconds
+    after its first batch arrived.
+
+    The cursor of every space, or the shard of a run split between several producers, is updated in the same
+    transaction as its submits. A crashed run continues exactly after the last committed batch, and storing is
+    idempotent anyway because known submits are skipped.
+    """
+
+    def __init__(
+        self,
+        storage: SubmitStorage,
+        settings: IngestionSettings,
+        cursors: Optional[IngestionCursorStorage] = None,
+        on_commit: Optional[Callable[[Dict[int, int]], Any]] = None,
+    ):
+        self._storage = storage
+        self._settings = settings
+        self._cursors = cursors or IngestionCursorStorage()
+        self._on_commit = on_commit
+
+    def run(
+        self, messages: MessageQueue, producers: Sequence[Producer], alive: Optional[Callable[[], bool]] = None
+    ) -> IngestionResult:
+        """Consumes messages until every producer has sent its last batch or failed.
+
+        alive tells whether any producer is still running, so producers which died without a word do not make the
+        writer wait forever.
+        """
+        state = _RunState(producers)
+        gone = False
+        while state.unfinished:
+            message = self._receive(messages, state.deadline)
+            if message is not None:
+                state.add(message, self._settings.max_latency)
+            elif alive is not None and not alive():
+                # Whatever the producers put before exiting is readable by now, so a second miss means nothing more
+                # is coming
+                if gone:
+                    break
+                gone = True
+            if self._should_commit(state):
+                self._flush(state)
+        self._flush(state)
+        return state.result()
+
+    def _receive(self, messages: MessageQueue, deadline: Optional[float]) -> Optional[Message]:
+        timeout = _POLL_INTERVAL if deadline is None else min(max(deadline - time.monotonic(), 0), _POLL_INTERVAL)
+        try:
+            return messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _should_commit(self, state: '_RunState') -> bool:
+        if not state.pending:
+            return False
+        return (
+            not state.unfinished
+            or state.pending_submits >= self._settings.commit_size
+            or (state.deadline is not None and time.monotonic() >= state.deadline)
+        )
+
+    def _flush(self, state: '_RunState') -> None:
+        if state.pending:
+            for space, count in self._commit(state.take()).items():
+                state.saved[space] = state.saved.get(space, 0) + count
+
+    def _commit(self, batches: List[SubmitBatch]) -> Dict[int, int]:
+        started_at = time.perf_counter()
+        saved: Dict[int, int] = {}
+        with db.create_session() as session:
+            for batch in batches:
+                created = self._storage.create_in_session(session, batch.submits, batch.space)
+                self._cursors.advance(session, batch)
+                saved[batch.space] = saved.get(batch.space, 0) + len(created)
+        duration = time.perf_counter() - started_at
+        INGESTION_COMMIT_SECONDS.observe(duration)
+        for space, count in saved.items():
+            INGESTED_SUBMITS.inc(str(space), amount=count)
+        logger.info("Committed %s batches with %s new submits in %.2fs", len(batches), sum(saved.values()), duration)
+        if self._on_commit is not None:
+            self._on_commit(saved)
+        return saved
+
+
+class _RunState:
+    """What a run of IngestionWriter still waits for, has saved, and has to commit next."""
+
+    def __init__(self, producers: Sequence[Producer]):
+        self.unfinished = set(producers)
+        self.saved: Dict[int, int] = {}
+        self.failed: Dict[int, str] = {}
+        self.pending: List[SubmitBatch] = []
+        self.pending_submits = 0
+        self.deadline: Optional[float] = None
+
+    def add(self, message: Message, max_latency: float) -> None:
+        if isinstance(message, ProducerFailed):
+            logger.error("Producer of space %s failed: %s", message.space, message.error)
+            self.failed[message.space] = message.error
+            self.unfinished.discard(Producer(message.space, message.shard))
+            return
+        self.pending.append(message)
+        self.pending_submits += len(message.submits)
+        if self.deadline is None:
+            self.deadline = time.monotonic() + max_latency
+        if message.done:
+            self.unfinished.discard(Producer(message.space, message.shard))
+
+    def take(self) -> List[SubmitBatch]:
+        pending = self.pending
+        self.pending, self.pending_submits, self.deadline = [], 0, None
+        return pending
+
+    def result(self) -> IngestionResult:
+        for producer in self.unfinished:
+            self.failed.setdefault(producer.space, 'producer exited without finishing')
+        return IngestionResult(self.saved, self.failed)
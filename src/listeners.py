@@ -0,0 +1,14 @@
+from typing import List
+
+from src.cooccurrence import CooccurrenceSettings, CooccurrenceStorage
+from src.popularity import PopularitySettings, PopularityStorage
+from src.storage import ISubmitListener
+
+
+def make_submit_listeners() -> List[ISubmitListener]:
+    listeners: List[ISubmitListener] = []
+    if CooccurrenceSettings().enabled:
+        listeners.append(CooccurrenceStorage())
+    if PopularitySettings().enabled:
+        listeners.append(PopularityStorage())
+    return listeners
@@ -1,14 +1,20 @@
 import datetime
 import enum
+import importlib.util
+import re
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
 from itertools import islice
-from typing import Any, Callable, Iterator, List, Optional, cast
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, TypeVar, Union, cast
 
 import requests
 import yarl
-from bs4 import BeautifulSoup
-from pydantic import BaseModel, BaseSettings
+from bs4 import BeautifulSoup, SoupStrainer
+from pydantic import BaseModel, BaseSettings, validator
 from requests.adapters import HTTPAdapter
 
+from src.search import strip_statement
+
 
 class Url(yarl.URL):
     @classmethod
@@ -23,9 +29,15 @@ class TimusClientSettings(BaseSettings):
     url: Url = Url('https://timus.online')
 
     max_retries: int = 3
+    spaces: List[int] = [1]
+    # None picks lxml when it is installed and the pure-Python html.parser otherwise
+    html_parser: Optional[str] = None
+    fetch_workers: int = 4
+    parse_workers: Optional[int] = None
 
     problem_set_path: str = 'problemset.aspx'
-    problem_path: str = 'print.aspx'
+    # The printable page has no difficulty, problem.aspx has the same statement elements and the difficulty
+    problem_path: str = 'problem.aspx'
     submits_path: str = 'textstatus.aspx'
 
     @property
@@ -56,6 +68,9 @@ class TimusAPIProblem(BaseModel):
     title: str
     limits: str
     text: str
+    # The statement without markup, what the search index stores
+    search_text: str
+    difficulty: Optional[int] = None
 
     class Config:
         frozen = True
@@ -68,6 +83,12 @@ class ProblemModel(BaseModel):
     solutions: int
     limits: str
     text: str
+    # Loaders pass the one extracted while parsing, so storing a problem never parses its statement again
+    search_text: str = ''
+
+    @validator('search_text', always=True)
+    def _strip_text(cls, search_text: str, values: Dict[str, Any]) -> str:
+        return search_text or strip_statement(values.get('text', ''))
 
 
 class Verdict(str, enum.Enum):
@@ -114,9 +135,53 @@ class TimusAPISubmit(BaseModel):
         frozen = True
 
 
+_T = TypeVar('_T')
+_R = TypeVar('_R')
+
+_DIFFICULTY = re.compile(r'(?:Difficulty|Сложность):\s*(\d+)'.encode())
+_STATEMENT_CLASSES = {'problem_title', 'problem_limits'}
+
+
+def default_html_parser() -> str:
+    return 'lxml' if importlib.util.find_spec('lxml') is not None else 'html.parser'
+
+
+def _is_statement_part(attrs: Dict[str, Any]) -> bool:
+    classes = attrs.get('class') or ()
+    if isinstance(classes, str):
+        classes = classes.split()
+    return attrs.get('id') == 'problem_text' or not _STATEMENT_CLASSES.isdisjoint(classes)
+
+
+def _statement_filter() -> Any:
+    try:
+        from bs4 import ElementFilter
+    except ImportError:
+        # Before beautifulsoup4 4.13 a name function of SoupStrainer gets the raw attributes of every tag
+        return SoupStrainer(lambda name, attrs: _is_statement_part(attrs))  # type: ignore[arg-type]
+
+    class StatementFilter(ElementFilter):
+        def allow_tag_creation(self, nsprefix: Optional[str], name: str, attrs: Any) -> bool:
+            return _is_statement_part(attrs or {})
+
+        def allow_string_creation(self, string: str) -> bool:
+            # Only called for strings outside of the kept elements
+            return False
+
+    return StatementFilter()
+
+
 class TimusParser:
+    """Builds trees only for the elements which are read, the rest of a page is skipped while parsing."""
+
+    _problemset = SoupStrainer(class_='problemset')
+    _statement = _statement_filter()
+
+    def __init__(self, html_parser: Optional[str] = None):
+        self._html_parser = html_parser or default_html_parser()
+
     def parse_problems(self, content: bytes) -> List[TimusAPIProblemInfo]:
-        soup = BeautifulSoup(content, 'html.parser')
+        soup = BeautifulSoup(content, self._html_parser, parse_only=self._problemset)
         table = soup.find(**{'class': 'problemset'})
         problems = []
         for table_content in islice(table.find_all(**{'class': 'content'}), 1, None):
@@ -125,12 +190,21 @@ class TimusParser:
         return problems
 
     def parse_problem(self, content: bytes) -> TimusAPIProblem:
-        soup = BeautifulSoup(content, 'html.parser')
+        soup = BeautifulSoup(content, self._html_parser, parse_only=self._statement)
         title = soup.find(**{'class': 'problem_title'}).text
         number, title = [x.strip() for x in title.split('.', maxsplit=1)]
         limits = '\n'.join(soup.find(**{'class': 'problem_limits'}).get_text('<br>').split('<br>'))
-        text = soup.find(id='problem_text').prettify()
-        return TimusAPIProblem(number=number, title=title, limits=limits, text=text)
+        statement = soup.find(id='problem_text')
+        # The difficulty is a plain line of the page, a regular expression finds it without a tree
+        difficulty = _DIFFICULTY.search(content)
+        return TimusAPIProblem(
+            number=number,
+            title=title,
+            limits=limits,
+            text=str(statement),
+            search_text=statement.get_text(' ', strip=True),
+            difficulty=int(difficulty.group(1)) if difficulty is not None else None,
+        )
 
     def parse_submits(self, content: str) -> List[TimusAPISubmit]:
         submits = []
@@ -170,18 +244,38 @@ class TimusAPIClient:
         return TimusAPIClient(
             settings=settings,
             session=session,
-            parser=TimusParser(),
+            parser=TimusParser(settings.html_parser),
         )
 
-    def get_problems(self) -> List[TimusAPIProblemInfo]:
-        response = self._session.get(url=self._settings.problem_set_url, params={'page': 'all'})
+    def get_problems(self, space: int = 1) -> List[TimusAPIProblemInfo]:
+        params: Dict[str, Union[int, str]] = {'space': space, 'page': 'all'}
+        response = self._session.get(url=self._settings.problem_set_url, params=params)
         response.raise_for_status()
         return self._parser.parse_problems(response.content)
 
-    def get_problem(self, number: int) -> TimusAPIProblem:
-        response = self._session.get(url=self._settings.problem_url, params={'num': number})
+    def get_problem(self, number: int, space: int = 1) -> TimusAPIProblem:
+        return self._parser.parse_problem(self.fetch_problem(number, space))
+
+    def fetch_problem(self, number: int, space: int = 1) -> bytes:
+        response = self._session.get(url=self._settings.problem_url, params={'space': space, 'num': number})
         response.raise_for_status()
-        return self._parser.parse_problem(response.content)
+        return response.content
+
+    def iter_problems(
+        self, numbers: Sequence[int], space: int = 1, parse_executor: Optional[Executor] = None
+    ) -> Iterator[TimusAPIProblem]:
+        """Yields the problems in the order of numbers, fetching pages on threads and parsing them on parse_executor.
+
+        Both stages keep a bounded number of pages in flight, so the network and the parsing overlap and parsing
+        is spread over several cores when parse_executor is a process pool.
+        """
+        window = 2 * self._settings.fetch_workers
+        with ThreadPoolExecutor(max_workers=self._settings.fetch_workers) as fetch_executor:
+            pages = _bounded_map(fetch_executor, lambda number: self.fetch_problem(number, space), numbers, window)
+            if parse_executor is None:
+                yield from map(self._parser.parse_problem, pages)
+            else:
+                yield from _bounded_map(parse_executor, self._parser.parse_problem, pages, window)
 
     def get_submits(
         self,
@@ -205,3 +299,14 @@ class TimusAPIClient:
         response.raise_for_status()
 
         return self._parser.parse_submits(response.text)
+
+
+def _bounded_map(executor: Executor, function: Callable[[_T], _R], items: Iterable[_T], window: int) -> Iterator[_R]:
+    """Like executor.map, but submits only window items ahead of the consumer instead of all of them at once."""
+    pending: Deque['Future[_R]'] = deque()
+    for item in items:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
@@ -0,0 +1,272 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from pydantic import BaseSettings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class MetricsSettings(BaseSettings):
+    host: str = '127.0.0.1'
+    port: Optional[int] = None
+    file: Optional[Path] = None
+    flush_interval: float = 15.0
+
+    class Config:
+        env_prefix = 'TIMUS_METRICS_'
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self._documentation = documentation
+        self._labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, *labels: str) -> float:
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f'# HELP {self.name} {self._documentation}', f'# TYPE {self.name} counter']
+        for labels, value in values:
+            lines.append(f'{self.name}{_format_labels(self._labels, labels)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    """Cumulative histogram with fixed buckets, observing a value costs a binary search and a lock."""
+
+    def __init__(
+        self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self._documentation = documentation
+        self._labels = tuple(labels)
+        self._buckets = tuple(sorted(buckets))
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            counts = self._counts.get(labels)
+            if counts is None:
+                counts = self._counts[labels] = [0] * (len(self._buckets) + 1)
+                self._sums[labels] = 0.0
+            counts[index] += 1
+            self._sums[labels] += value
+
+    def count(self, *labels: str) -> int:
+        with self._lock:
+            return sum(self._counts.get(labels, ()))
+
+    def render(self) -> List[str]:
+        with self._lock:
+            snapshot = sorted((labels, list(counts), self._sums[labels]) for labels, counts in self._counts.items())
+        lines = [f'# HELP {self.name} {self._documentation}', f'# TYPE {self.name} histogram']
+        for labels, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self._buckets + (float('inf'),), counts):
+                cumulative += count
+                bucket_labels = _format_labels(self._labels, labels, f'le="{_format_value(bound)}"')
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self._labels, labels)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self._labels, labels)} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Counter(name, documentation, labels)
+            metric: Counter = self._metrics[name]
+            return metric
+
+    def histogram(
+        self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Histogram(name, documentation, labels, buckets)
+            metric: Histogram = self._metrics[name]
+            return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+        return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'timus_recommender_stage_seconds', 'Duration of request handling stages.', labels=('operation', 'stage')
+)
+STAGE_ERRORS = REGISTRY.counter(
+    'timus_recommender_stage_errors_total', 'Stages which raised an exception.', labels=('operation', 'stage')
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    'timus_recommender_request_seconds', 'Duration of whole requests.', labels=('operation',)
+)
+
+
+class Trace:
+    """Times the stages of a single request.
+
+    Every stage is observed in STAGE_SECONDS as soon as it finishes and finish() logs all of them in one line,
+    so a slow request can be found in the logs and the distribution is available as a histogram.
+    """
+
+    def __init__(self, operation: str):
+        self._operation = operation
+        self._started_at = time.perf_counter()
+        self._stages: List[Tuple[str, float]] = []
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            STAGE_ERRORS.inc(self._operation, stage)
+            raise
+        finally:
+            duration = time.perf_counter() - started_at
+            STAGE_SECONDS.observe(duration, self._operation, stage)
+            self._stages.append((stage, duration))
+
+    @property
+    def stages(self) -> List[Tuple[str, float]]:
+        return list(self._stages)
+
+    def finish(self, **fields: Any) -> float:
+        duration = time.perf_counter() - self._started_at
+        REQUEST_SECONDS.observe(duration, self._operation)
+        stages = ' '.join(f'{stage}={stage_duration * 1000:.1f}ms' for stage, stage_duration in self._stages)
+        extra = ''.join(f' {name}={value}' for name, value in fields.items())
+        logger.info("%s took %.1fms: %s%s", self._operation, duration * 1000, stages, extra)
+        return duration
+
+
+class MetricsServer:
+    """Serves the registry in the Prometheus text format on GET /metrics."""
+
+    def __init__(self, registry: Registry, host: str, port: int):
+        self._registry = registry
+        self._server = ThreadingHTTPServer((host, port), self._make_request_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics-server', daemon=True)
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        host, port = self._server.server_address[:2]
+        return str(host), int(port)
+
+    def start(self) -> None:
+        self._thread.start()
+        logger.info("Metrics are served on %s:%s/metrics", *self.address)
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _make_request_handler(self) -> Any:
+        registry = self._registry
+
+        class _RequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:  # noqa: N802
+                if self.path != '/metrics':
+                    self.send_error(HTTPStatus.NOT_FOUND)
+                    return
+                body = registry.render().encode()
+                self.send_response(HTTPStatus.OK)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+                logger.debug("Metrics request: %s", format % args)
+
+        return _RequestHandler
+
+
+class MetricsFileWriter:
+    """Periodically writes the registry to a file, e.g. for the node_exporter textfile collector."""
+
+    def __init__(self, registry: Registry, path: Path, interval: float):
+        self._registry = registry
+        self._path = path
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='metrics-writer', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+        self.flush()
+
+    def flush(self) -> None:
+        # Written next to the target and renamed, so readers never see a half-written file
+        temporary = self._path.with_name(self._path.name + '.tmp')
+        temporary.write_text(self._registry.render())
+        os.replace(temporary, self._path)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self._interval):
+            try:
+                self.flush()
+            except OSError:
+                logger.exception("Metrics could not be written to %s", self._path)
+
+
+def start_exporters(settings: MetricsSettings, registry: Registry = REGISTRY) -> None:
+    if settings.port is not None:
+        MetricsServer(registry, settings.host, settings.port).start()
+    if settings.file is not None:
+        MetricsFileWriter(registry, settings.file, settings.flush_interval).start()
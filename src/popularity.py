@@ -0,0 +1,330 @@
+import datetime
+import logging
+from typing import Callable, Counter, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import sqlalchemy as sa
+from pydantic import BaseModel, BaseSettings
+from sqlalchemy import orm as so
+
+import db
+from src.loader import Verdict
+from src.recommenders import IRecommender
+from src.storage import AuthorSolutions, Interactions, ISubmitListener
+
+logger = logging.getLogger(__name__)
+
+WINDOWS = (7, 30)
+# Daily buckets are only kept for the longest window
+RETENTION_DAYS = max(WINDOWS)
+# Geometric bucket bounds, about 19% apart, for runtimes in ms and memory in KB
+RESOURCE_BUCKETS = np.unique(np.round(np.geomspace(1, 1 << 22, 90)).astype(np.int64))
+_HISTOGRAM_SIZE = RESOURCE_BUCKETS.size + 1
+_KEYS_PER_QUERY = 400
+
+Clock = Callable[[], datetime.date]
+
+
+class PopularitySettings(BaseSettings):
+    enabled: bool = False
+    trending_days: int = 7
+    trending_count: int = 10
+    fallback_days: int = 30
+
+    class Config:
+        env_prefix = 'TIMUS_POPULARITY_'
+
+
+class ProblemPopularity(BaseModel):
+    problem_id: int
+    accepted: int
+    solvers: int
+    solvers_7d: int
+    solvers_30d: int
+    median_runtime_ms: Optional[float]
+    median_memory_kb: Optional[float]
+
+    class Config:
+        frozen = True
+
+
+def _today() -> datetime.date:
+    return datetime.datetime.now(datetime.timezone.utc).date()
+
+
+def _day(date: datetime.datetime) -> datetime.date:
+    if date.tzinfo is not None:
+        date = date.astimezone(datetime.timezone.utc)
+    return date.date()
+
+
+def histogram(values: Iterable[int], weights: Optional[Iterable[int]] = None) -> np.ndarray:
+    buckets = np.searchsorted(RESOURCE_BUCKETS, np.fromiter(values, dtype=np.int64), side='right')
+    counts_weights = None if weights is None else np.fromiter(weights, dtype=np.int64)
+    return np.bincount(buckets, weights=counts_weights, minlength=_HISTOGRAM_SIZE).astype(np.int64)
+
+
+def histogram_median(counts: np.ndarray) -> Optional[float]:
+    """Median of the histogram, interpolated linearly inside the bucket it falls into."""
+    total = int(counts.sum())
+    if total == 0:
+        return None
+    cumulative = np.cumsum(counts)
+    bucket = int(np.searchsorted(cumulative, total / 2))
+    lower = float(RESOURCE_BUCKETS[bucket - 1]) if bucket > 0 else 0.0
+    upper = float(RESOURCE_BUCKETS[min(bucket, RESOURCE_BUCKETS.size - 1)])
+    before = float(cumulative[bucket - 1]) if bucket > 0 else 0.0
+    return lower + (total / 2 - before) / float(counts[bucket]) * (upper - lower)
+
+
+def _decode(data: bytes) -> np.ndarray:
+    return np.frombuffer(data, dtype='<i8').astype(np.int64)
+
+
+def _encode(counts: np.ndarray) -> bytes:
+    return counts.astype('<i8').tobytes()
+
+
+def _count_solvers(
+    accepted: List[db.Submit], solutions: Dict[int, AuthorSolutions], cutoff: datetime.date
+) -> Tuple[Counter[int], Counter[Tuple[int, datetime.date]]]:
+    """New solvers per problem and changes of the daily solvers, counted by the day of the first solution.
+
+    This is what rebuild computes: a backfilled solution older than the stored first one moves its solver from
+    the later day to the earlier one.
+    """
+    first_days: Dict[Tuple[int, int], datetime.date] = {}
+    for submit in accepted:
+        key = (submit.timus_user_id, submit.timus_problem_id)
+        day = _day(submit.date)
+        if key not in first_days or day < first_days[key]:
+            first_days[key] = day
+    solvers: Counter[int] = Counter()
+    daily: Counter[Tuple[int, datetime.date]] = Counter()
+    for (author_id, problem_id), day in first_days.items():
+        solved_before = solutions[author_id].solved_before.get(problem_id)
+        if solved_before is None:
+            solvers[problem_id] += 1
+            daily[problem_id, day] += 1
+        elif day < _day(solved_before):
+            daily[problem_id, _day(solved_before)] -= 1
+            daily[problem_id, day] += 1
+    return solvers, Counter({key: count for key, count in daily.items() if key[1] > cutoff})
+
+
+class PopularityStorage(ISubmitListener):
+    """Accepted submits, solvers and resource histograms of every problem of the main space.
+
+    Like CooccurrenceStorage, the aggregates are updated in the transaction which inserts new submits, so reads
+    never scan submits. Solvers are also counted per day for the last RETENTION_DAYS days, which is what the
+    rolling windows and trending problems are summed from.
+    """
+
+    def __init__(self, clock: Clock = _today):
+        self._clock = clock
+
+    def on_submits_created(
+        self, session: so.Session, submits: List[db.Submit], solutions: Dict[int, AuthorSolutions]
+    ) -> None:
+        accepted = [
+            submit for submit in submits if submit.verdict == Verdict.ACCEPTED.value and submit.space == db.MAIN_SPACE
+        ]
+        if not accepted:
+            return
+        cutoff = self._clock() - datetime.timedelta(days=RETENTION_DAYS)
+        solvers, daily = _count_solvers(accepted, solutions, cutoff)
+
+        by_problem: Dict[int, List[db.Submit]] = {}
+        for submit in accepted:
+            by_problem.setdefault(submit.timus_problem_id, []).append(submit)
+        problem_ids = sorted(by_problem)
+        empty = _encode(np.zeros(_HISTOGRAM_SIZE, dtype=np.int64))
+        db.increment(
+            session,
+            db.ProblemStats,
+            keys=('timus_problem_id',),
+            counters=('accepted', 'solvers'),
+            rows=[
+                {
+                    'timus_problem_id': problem_id,
+                    'accepted': len(by_problem[problem_id]),
+                    'solvers': solvers.get(problem_id, 0),
+                    'runtime_histogram': empty,
+                    'memory_histogram': empty,
+                }
+                for problem_id in problem_ids
+            ],
+        )
+        # The increment has locked the rows until commit, so the histograms are not overwritten by other writers
+        for problem_id, row in self._get_stats(session, problem_ids, for_update=True).items():
+            problem_submits = by_problem[problem_id]
+            row.runtime_histogram = _encode(
+                _decode(row.runtime_histogram) + histogram(submit.runtime_ms for submit in problem_submits)
+            )
+            row.memory_histogram = _encode(
+                _decode(row.memory_histogram) + histogram(submit.memory_kb for submit in problem_submits)
+            )
+
+        db.increment(
+            session,
+            db.ProblemDailySolvers,
+            keys=('timus_problem_id', 'day'),
+            counters=('solvers',),
+            rows=[
+                {'timus_problem_id': problem_id, 'day': day, 'solvers': count}
+                for (problem_id, day), count in sorted(daily.items())
+                if count
+            ],
+        )
+        session.query(db.ProblemDailySolvers).filter(
+            sa.or_(db.ProblemDailySolvers.day <= cutoff, db.ProblemDailySolvers.solvers <= 0)
+        ).delete(synchronize_session=False)
+        session.flush()
+
+    def _get_stats(
+        self, session: so.Session, problem_ids: List[int], for_update: bool = False
+    ) -> Dict[int, db.ProblemStats]:
+        rows = {}
+        for start in range(0, len(problem_ids), _KEYS_PER_QUERY):
+            query = session.query(db.ProblemStats).filter(
+                db.ProblemStats.timus_problem_id.in_(problem_ids[start : start + _KEYS_PER_QUERY])
+            )
+            if for_update:
+                query = query.with_for_update().populate_existing()
+            rows.update({row.timus_problem_id: row for row in query})
+        return rows
+
+    def get(self, problem_ids: List[int]) -> Dict[int, ProblemPopularity]:
+        """Aggregates of the problems which have accepted submits, problems without them are left out."""
+        today = self._clock()
+        with db.create_session() as session:
+            rows = self._get_stats(session, problem_ids)
+            windows: Dict[int, Counter[int]] = {problem_id: Counter() for problem_id in rows}
+            daily = session.query(
+                db.ProblemDailySolvers.timus_problem_id, db.ProblemDailySolvers.day, db.ProblemDailySolvers.solvers
+            ).filter(
+                db.ProblemDailySolvers.timus_problem_id.in_(list(rows)),
+                db.ProblemDailySolvers.day > today - datetime.timedelta(days=RETENTION_DAYS),
+            )
+            for problem_id, day, count in daily:
+                for window in WINDOWS:
+                    if day > today - datetime.timedelta(days=window):
+                        windows[problem_id][window] += count
+            return {
+                problem_id: ProblemPopularity(
+                    problem_id=problem_id,
+                    accepted=row.accepted,
+                    solvers=row.solvers,
+                    solvers_7d=windows[problem_id][7],
+                    solvers_30d=windows[problem_id][30],
+                    median_runtime_ms=histogram_median(_decode(row.runtime_histogram)),
+                    median_memory_kb=histogram_median(_decode(row.memory_histogram)),
+                )
+                for problem_id, row in rows.items()
+            }
+
+    def trending(self, days: int, limit: int) -> List[Tuple[int, int]]:
+        """Problems with the most new solvers over the last days (at most RETENTION_DAYS), most solved first."""
+        since = self._clock() - datetime.timedelta(days=min(days, RETENTION_DAYS))
+        with db.create_session() as session:
+            total = sa.func.sum(db.ProblemDailySolvers.solvers)
+            query = (
+                session.query(db.ProblemDailySolvers.timus_problem_id, total)
+                .filter(db.ProblemDailySolvers.day > since)
+                .group_by(db.ProblemDailySolvers.timus_problem_id)
+                .order_by(total.desc(), db.ProblemDailySolvers.timus_problem_id)
+                .limit(limit)
+            )
+            return [(problem_id, int(count)) for problem_id, count in query]
+
+    def rebuild(self) -> int:
+        """Replaces all aggregates with the ones computed from accepted submits and returns the number of problems."""
+        accepted_filter = (db.Submit.space == db.MAIN_SPACE, db.Submit.verdict == Verdict.ACCEPTED.value)
+        cutoff = self._clock() - datetime.timedelta(days=RETENTION_DAYS)
+        with db.create_session() as session:
+            counts = session.query(
+                db.Submit.timus_problem_id, sa.func.count(), sa.func.count(db.Submit.timus_user_id.distinct())
+            ).filter(*accepted_filter)
+            stats = {
+                problem_id: (accepted, solvers)
+                for problem_id, accepted, solvers in counts.group_by(db.Submit.timus_problem_id)
+            }
+            histograms = {}
+            for column in (db.Submit.runtime_ms, db.Submit.memory_kb):
+                values: Dict[int, Tuple[List[int], List[int]]] = {}
+                # Equal values are grouped by the database, so only distinct values per problem are transferred
+                grouped = (
+                    session.query(db.Submit.timus_problem_id, column, sa.func.count())
+                    .filter(*accepted_filter)
+                    .group_by(db.Submit.timus_problem_id, column)
+                )
+                for problem_id, value, count in grouped:
+                    problem_values = values.setdefault(problem_id, ([], []))
+                    problem_values[0].append(value)
+                    problem_values[1].append(count)
+                histograms[column.key] = {problem_id: histogram(*pair) for problem_id, pair in values.items()}
+
+            first_solutions = (
+                session.query(
+                    db.Submit.timus_user_id, db.Submit.timus_problem_id, sa.func.min(db.Submit.date).label('first')
+                )
+                .filter(*accepted_filter)
+                .group_by(db.Submit.timus_user_id, db.Submit.timus_problem_id)
+                .subquery()
+            )
+            daily: Counter[Tuple[int, datetime.date]] = Counter()
+            recent = session.query(first_solutions.c.timus_problem_id, first_solutions.c.first).filter(
+                first_solutions.c.first >= datetime.datetime.combine(cutoff, datetime.time(), datetime.timezone.utc)
+            )
+            for problem_id, first in recent:
+                day = _day(first)
+                if day > cutoff:
+                    daily[problem_id, day] += 1
+
+            session.query(db.ProblemStats).delete()
+            session.query(db.ProblemDailySolvers).delete()
+            session.bulk_insert_mappings(
+                db.ProblemStats,
+                [
+                    {
+                        'timus_problem_id': problem_id,
+                        'accepted': accepted,
+                        'solvers': solvers,
+                        'runtime_histogram': _encode(histograms['runtime_ms'][problem_id]),
+                        'memory_histogram': _encode(histograms['memory_kb'][problem_id]),
+                    }
+                    for problem_id, (accepted, solvers) in stats.items()
+                ],
+            )
+            session.bulk_insert_mappings(
+                db.ProblemDailySolvers,
+                [
+                    {'timus_problem_id': problem_id, 'day': day, 'solvers': count}
+                    for (problem_id, day), count in daily.items()
+                ],
+            )
+        logger.info("Rebuilt popularity of %s problems", len(stats))
+        return len(stats)
+
+
+class PopularityRecommender(IRecommender):
+    """Recommends the problems most people solved over the last days, then tops the list up from base.
+
+    Meant as a fallback for new users: trending problems say more about what is worth solving next than the
+    static difficulty order alone, which stays as the base for quiet periods.
+    """
+
+    def __init__(self, storage: PopularityStorage, days: int, base: IRecommender):
+        self._storage = storage
+        self._days = days
+        self._base = base
+
+    def recommend(self, interactions: Interactions, k: int) -> List[int]:
+        solved = set(interactions.problem_ids.tolist())
+        trending = self._storage.trending(self._days, k + len(solved))
+        recommended = [problem_id for problem_id, _ in trending if problem_id not in solved][:k]
+        if len(recommended) < k:
+            chosen = set(recommended)
+            base = self._base.recommend(interactions, k + len(recommended))
+            recommended += [problem_id for problem_id in base if problem_id not in chosen][: k - len(recommended)]
+        return recommended
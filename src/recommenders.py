@@ -0,0 +1,115 @@
+import abc
+import csv
+from itertools import islice
+from pathlib import Path
+from typing import Any, List, Mapping, Optional, Sequence, Union
+
+import numpy as np
+
+from src.storage import DBSubmit, Interactions, ProblemStorage
+
+
+class IRecommender(abc.ABC):
+    @abc.abstractmethod
+    def recommend(self, interactions: Interactions, k: int) -> List[int]:
+        """Recommends up to k problems to an author given their unique accepted (submit, author, problem) triples."""
+
+
+class ModelRecommender(IRecommender):
+    def __init__(self, model: Any):
+        self._model = model
+
+    def recommend(self, interactions: Interactions, k: int) -> List[int]:
+        recommendation = self._model.recommend_from_interactions(to_sframe(interactions), k=k)
+        return [int(problem_id) for problem_id in recommendation['problemid']]
+
+
+class ComplexityRecommender(IRecommender):
+    """Recommends the easiest problems the user has not solved yet.
+
+    Problems of equal difficulty go in the order of solvers, most solved first, when their solvers are known.
+    """
+
+    def __init__(self, problems: np.ndarray, difficulties: np.ndarray, solvers: Optional[np.ndarray] = None):
+        problems = np.asarray(problems, dtype=np.int64)
+        difficulties = np.asarray(difficulties)
+        if solvers is None:
+            order = np.argsort(difficulties, kind='stable')
+        else:
+            order = np.lexsort((-np.asarray(solvers, dtype=np.int64), difficulties))
+        self._problems = problems[order]
+        self._difficulties = difficulties[order]
+        # Dense lookup table from a problem number to its position in the sorted array, -1 for unknown problems
+        self._offset = int(problems.min()) if problems.size else 0
+        size = int(problems.max()) - self._offset + 1 if problems.size else 0
+        self._positions = np.full(size, -1, dtype=np.int64)
+        self._positions[self._problems - self._offset] = np.arange(self._problems.size)
+
+    @classmethod
+    def from_csv(cls, path: Path) -> 'ComplexityRecommender':
+        with path.open() as f:
+            rows = [(int(problem), int(difficulty)) for problem, difficulty in islice(csv.reader(f), 1, None)]
+        return cls.from_pairs(rows)
+
+    @classmethod
+    def from_storage(cls, storage: ProblemStorage) -> 'ComplexityRecommender':
+        return cls.from_pairs(storage.get_difficulties())
+
+    @classmethod
+    def from_pairs(cls, pairs: Sequence[Sequence[int]]) -> 'ComplexityRecommender':
+        table = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+        return cls(problems=table[:, 0], difficulties=table[:, 1])
+
+    def __len__(self) -> int:
+        return int(self._problems.size)
+
+    @property
+    def problems(self) -> List[int]:
+        return self._problems.tolist()  # type: ignore
+
+    def with_solvers(self, solvers: Mapping[int, int]) -> 'ComplexityRecommender':
+        """The same recommender with difficulty ties broken by the solvers of the problems, unknown ones count 0."""
+        counts = np.fromiter((solvers.get(problem, 0) for problem in self.problems), np.int64, self._problems.size)
+        return ComplexityRecommender(self._problems, self._difficulties, counts)
+
+    def recommend(self, interactions: Interactions, k: int) -> List[int]:
+        return self.recommend_problems(interactions.problem_ids, k)
+
+    def recommend_problems(self, solved: Union[Sequence[int], np.ndarray], k: int) -> List[int]:
+        solved_problems = np.asarray(solved, dtype=np.int64) - self._offset
+        solved_problems = solved_problems[(solved_problems >= 0) & (solved_problems < self._positions.size)]
+        positions = self._positions[solved_problems]
+        # At most len(positions) of the easiest problems are solved, so only that prefix has to be masked
+        head = self._problems[: k + positions.size]
+        mask = np.ones(head.size, dtype=bool)
+        mask[positions[(positions >= 0) & (positions < head.size)]] = False
+        return head[mask][:k].tolist()  # type: ignore
+
+
+def to_unique_interactions(submits: List[DBSubmit]) -> Interactions:
+    problems = {}
+    for submit in submits[::-1]:
+        problems[submit.problem_id] = (submit.submit_id, submit.timus_user_id)
+    sub_col = []
+    prob_col = []
+    auth_col = []
+    for problem in problems:
+        sub_id, author_id = problems[problem]
+        sub_col.append(sub_id)
+        prob_col.append(problem)
+        auth_col.append(author_id)
+    return Interactions(
+        np.array(sub_col, dtype=np.int64), np.array(auth_col, dtype=np.int64), np.array(prob_col, dtype=np.int64)
+    )
+
+
+def to_sframe(interactions: Interactions) -> Any:
+    import turicreate as tc
+
+    return tc.SFrame(
+        {
+            'submitid': tc.SArray(interactions.submit_ids),
+            'authorid': tc.SArray(interactions.author_ids),
+            'problemid': tc.SArray(interactions.problem_ids),
+        }
+    )
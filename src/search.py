@@ -0,0 +1,132 @@
+import abc
+import re
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import sqlalchemy as sa
+from bs4 import BeautifulSoup
+from sqlalchemy import orm as so
+
+import db
+
+_WORD = re.compile(r'\w+')
+
+
+class SearchResult(NamedTuple):
+    number: int
+    title: str
+    rank: float
+
+
+def strip_statement(html: str) -> str:
+    return BeautifulSoup(html, 'html.parser').get_text(' ', strip=True)
+
+
+def _execute(session: so.Session, statement: Any, params: Optional[Dict[str, Any]] = None) -> Any:
+    # Raw SQL has no mapper to find the engine by, so it is executed on the connection of the problem table
+    return session.execute(statement, params, bind_arguments={'mapper': db.Problem})
+
+
+def _words(query: str) -> List[str]:
+    return _WORD.findall(query.lower())
+
+
+class SearchUnavailable(Exception):
+    pass
+
+
+class ISearchIndex(abc.ABC):
+    @abc.abstractmethod
+    def index(self, session: so.Session, number: int, title: str, body: str) -> None:
+        pass
+
+    @abc.abstractmethod
+    def search(self, session: so.Session, query: str, limit: int) -> List[SearchResult]:
+        pass
+
+    def clear(self, session: so.Session) -> None:
+        _execute(session, sa.text(f'DELETE FROM {db.PROBLEM_SEARCH_TABLE}'))
+
+
+class SqliteSearchIndex(ISearchIndex):
+    """FTS5 index ranked by BM25, matches in the title weigh ten times more than in the statement."""
+
+    def index(self, session: so.Session, number: int, title: str, body: str) -> None:
+        _execute(session, sa.text(f'DELETE FROM {db.PROBLEM_SEARCH_TABLE} WHERE number = :number'), {'number': number})
+        _execute(
+            session,
+            sa.text(f'INSERT INTO {db.PROBLEM_SEARCH_TABLE} (number, title, body) VALUES (:number, :title, :body)'),
+            {'number': number, 'title': title, 'body': body},
+        )
+
+    def search(self, session: so.Session, query: str, limit: int) -> List[SearchResult]:
+        words = _words(query)
+        if not words:
+            return []
+        # Every word is quoted, so user input can never be parsed as FTS5 syntax
+        match = ' '.join(f'"{word}"*' for word in words)
+        rows = _execute(
+            session,
+            sa.text(
+                f'SELECT number, title, bm25({db.PROBLEM_SEARCH_TABLE}, 0, 10, 1) AS rank'
+                f' FROM {db.PROBLEM_SEARCH_TABLE} WHERE {db.PROBLEM_SEARCH_TABLE} MATCH :match'
+                ' ORDER BY rank LIMIT :limit'
+            ),
+            {'match': match, 'limit': limit},
+        )
+        return [SearchResult(int(number), title, -rank) for number, title, rank in rows]
+
+
+class PostgresSearchIndex(ISearchIndex):
+    """tsvector over the title (weight A) and the statement (weight B) with a GIN index."""
+
+    def index(self, session: so.Session, number: int, title: str, body: str) -> None:
+        _execute(
+            session,
+            sa.text(
+                f'INSERT INTO {db.PROBLEM_SEARCH_TABLE} (number, title, document) VALUES (:number, :title,'
+                " setweight(to_tsvector('simple', :title), 'A') || setweight(to_tsvector('simple', :body), 'B'))"
+                ' ON CONFLICT (number) DO UPDATE SET title = excluded.title, document = excluded.document'
+            ),
+            {'number': number, 'title': title, 'body': body},
+        )
+
+    def search(self, session: so.Session, query: str, limit: int) -> List[SearchResult]:
+        words = _words(query)
+        if not words:
+            return []
+        match = ' & '.join(f'{word}:*' for word in words)
+        rows = _execute(
+            session,
+            sa.text(
+                f"SELECT number, title, ts_rank_cd(document, to_tsquery('simple', :match)) AS rank"
+                f" FROM {db.PROBLEM_SEARCH_TABLE} WHERE document @@ to_tsquery('simple', :match)"
+                ' ORDER BY rank DESC LIMIT :limit'
+            ),
+            {'match': match, 'limit': limit},
+        )
+        return [SearchResult(int(number), title, float(rank)) for number, title, rank in rows]
+
+
+class NoSearchIndex(ISearchIndex):
+    """Stands in on backends without full-text search, so only searching itself fails on them."""
+
+    def __init__(self, dialect: str):
+        self._dialect = dialect
+
+    def index(self, session: so.Session, number: int, title: str, body: str) -> None:
+        pass
+
+    def search(self, session: so.Session, query: str, limit: int) -> List[SearchResult]:
+        raise SearchUnavailable(f"Full-text search is not supported on {self._dialect}")
+
+    def clear(self, session: so.Session) -> None:
+        pass
+
+
+def get_search_index(session: so.Session) -> ISearchIndex:
+    dialect = session.get_bind(db.Problem).dialect.name
+    if dialect == 'sqlite':
+        return SqliteSearchIndex()
+    if dialect == 'postgresql':
+        return PostgresSearchIndex()
+    return NoSearchIndex(dialect)
@@ -0,0 +1,330 @@
+import datetime
+import json
+import struct
+import time
+import zlib
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import sqlalchemy as sa
+from sqlalchemy import orm as so
+
+import db
+from db.migrations import MIGRATIONS
+from src.search import get_search_index
+
+MAGIC = b'TIMUSNAP'
+FORMAT_VERSION = 1
+TABLES = (db.TelegramUser.__table__, db.Problem.__table__, db.ProblemStatement.__table__, db.Submit.__table__)
+# Sync and ingestion progress and the aggregates over submits are not exported, an import has to start them over
+STATE_TABLES = (
+    db.UserSyncState.__table__,
+    db.IngestionCursor.__table__,
+    db.IngestionShard.__table__,
+    db.ProblemSolvers.__table__,
+    db.ProblemPair.__table__,
+    db.ProblemStats.__table__,
+    db.ProblemDailySolvers.__table__,
+)
+
+# Every chunk starts with the table index, the number of rows, the compressed size and the CRC32 of the compressed
+# payload. A chunk with table index END closes the file, so a truncated snapshot is detected.
+_CHUNK_HEADER = struct.Struct('<BIII')
+_LENGTH = struct.Struct('<I')
+_END = 255
+_EPOCH = datetime.datetime(1970, 1, 1)
+_UTC_EPOCH = _EPOCH.replace(tzinfo=datetime.timezone.utc)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+
+ProgressCallback = Callable[[str, int], None]
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def _kind(column: sa.Column) -> str:
+    if isinstance(column.type, sa.Boolean):
+        return 'bool'
+    if isinstance(column.type, sa.Integer):
+        return 'int'
+    if isinstance(column.type, sa.DateTime):
+        return 'datetime'
+    if isinstance(column.type, (sa.Text, sa.String)):
+        return 'text'
+    if isinstance(column.type, sa.LargeBinary):
+        return 'bytes'
+    raise SnapshotError(f"Column {column} of type {column.type} can not be stored in a snapshot")
+
+
+def _to_microseconds(value: datetime.datetime) -> int:
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return (value - _EPOCH) // _MICROSECOND
+
+
+def _encode_column(values: Sequence[Any], kind: str) -> bytes:
+    mask = np.fromiter((value is None for value in values), dtype=np.uint8, count=len(values))
+    if kind in ('text', 'bytes'):
+        encoded = [b'' if value is None else value.encode() if kind == 'text' else value for value in values]
+        lengths = np.fromiter(map(len, encoded), dtype='<u4', count=len(encoded))
+        return mask.tobytes() + lengths.tobytes() + b''.join(encoded)
+    if kind == 'datetime':
+        values = [None if value is None else _to_microseconds(value) for value in values]
+    dtype = '<i1' if kind == 'bool' else '<i8'
+    return mask.tobytes() + np.fromiter((value or 0 for value in values), dtype=dtype, count=len(values)).tobytes()
+
+
+def _decode_column(payload: memoryview, offset: int, rows: int, kind: str) -> Tuple[List[Any], int]:
+    mask = np.frombuffer(payload, dtype=np.uint8, count=rows, offset=offset).astype(bool)
+    offset += rows
+    if kind in ('text', 'bytes'):
+        lengths = np.frombuffer(payload, dtype='<u4', count=rows, offset=offset)
+        offset += 4 * rows
+        ends = offset + np.cumsum(lengths, dtype=np.int64)
+        starts = ends - lengths
+        values: List[Any] = [bytes(payload[start:end]) for start, end in zip(starts.tolist(), ends.tolist())]
+        if kind == 'text':
+            values = [value.decode() for value in values]
+        offset = int(ends[-1]) if rows else offset
+    else:
+        dtype = np.dtype('<i1' if kind == 'bool' else '<i8')
+        data = np.frombuffer(payload, dtype=dtype, count=rows, offset=offset)
+        offset += dtype.itemsize * rows
+        if kind == 'bool':
+            values = [bool(value) for value in data.tolist()]
+        elif kind == 'datetime':
+            values = [_UTC_EPOCH + value * _MICROSECOND for value in data.tolist()]
+        else:
+            values = data.tolist()
+    if mask.any():
+        values = [None if is_null else value for value, is_null in zip(values, mask.tolist())]
+    return values, offset
+
+
+def _iter_table(connection: sa.engine.Connection, table: sa.Table, chunk_size: int) -> Iterator[List[Tuple[Any, ...]]]:
+    """Keyset pagination over the primary key, so memory does not depend on the table size."""
+    (key,) = table.primary_key.columns
+    last: Optional[int] = None
+    while True:
+        query = sa.select(*table.columns).order_by(key).limit(chunk_size)
+        if last is not None:
+            query = query.where(key > last)
+        rows = [tuple(row) for row in connection.execute(query)]
+        if not rows:
+            return
+        yield rows
+        last = rows[-1][list(table.columns).index(key)]
+
+
+def _write_chunk(f: BinaryIO, table_index: int, rows: int, payload: bytes) -> None:
+    f.write(_CHUNK_HEADER.pack(table_index, rows, len(payload), zlib.crc32(payload)))
+    f.write(payload)
+
+
+def export_snapshot(
+    path: Path, chunk_size: int, compression_level: int = 6, on_chunk: Optional[ProgressCallback] = None
+) -> Dict[str, int]:
+    """Writes all users, problems with statements and submits to path and returns the number of rows of every table.
+
+    Everything is read in one transaction, so the snapshot is consistent while submits keep being loaded.
+    """
+    engine = db.metadata.bind
+    with engine.connect() as connection, path.open('wb') as f:
+        if connection.dialect.name == 'postgresql':
+            # Under the default read committed level every statement would see the rows committed before it
+            connection = connection.execution_options(isolation_level='REPEATABLE READ')
+        with connection.begin():
+            if connection.dialect.name == 'sqlite':
+                # pysqlite only opens a transaction before DML, the reads would see every commit in between
+                connection.exec_driver_sql('BEGIN')
+            return _write_tables(connection, f, chunk_size, compression_level, on_chunk)
+
+
+def _write_tables(
+    connection: sa.engine.Connection,
+    f: BinaryIO,
+    chunk_size: int,
+    compression_level: int,
+    on_chunk: Optional[ProgressCallback],
+) -> Dict[str, int]:
+    header = {
+        'format_version': FORMAT_VERSION,
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'migrations': [name for name, _ in MIGRATIONS],
+        'tables': [
+            {
+                'name': table.name,
+                'columns': [[column.name, _kind(column)] for column in table.columns],
+                'rows': connection.execute(sa.select(sa.func.count()).select_from(table)).scalar(),
+            }
+            for table in TABLES
+        ],
+    }
+    encoded_header = json.dumps(header).encode()
+    f.write(MAGIC + _LENGTH.pack(len(encoded_header)) + encoded_header)
+
+    counts = {}
+    chunks = 0
+    for table_index, table in enumerate(TABLES):
+        kinds = [_kind(column) for column in table.columns]
+        counts[table.name] = 0
+        for rows in _iter_table(connection, table, chunk_size):
+            columns = zip(*rows)
+            payload = b''.join(_encode_column(values, kind) for values, kind in zip(columns, kinds))
+            _write_chunk(f, table_index, len(rows), zlib.compress(payload, compression_level))
+            chunks += 1
+            counts[table.name] += len(rows)
+            if on_chunk is not None:
+                on_chunk(table.name, len(rows))
+    _write_chunk(f, _END, chunks, b'')
+    return counts
+
+
+def read_header(f: BinaryIO) -> Dict[str, Any]:
+    if f.read(len(MAGIC)) != MAGIC:
+        raise SnapshotError("Not a snapshot file")
+    (length,) = _LENGTH.unpack(f.read(_LENGTH.size))
+    header: Dict[str, Any] = json.loads(f.read(length))
+    if header['format_version'] != FORMAT_VERSION:
+        raise SnapshotError(f"Unsupported snapshot format version {header['format_version']}")
+    unknown = set(header['migrations']) - {name for name, _ in MIGRATIONS}
+    if unknown:
+        raise SnapshotError(f"Snapshot was made by a newer schema, unknown migrations: {sorted(unknown)}")
+    return header
+
+
+def _iter_chunks(f: BinaryIO) -> Iterator[Tuple[int, int, bytes]]:
+    chunks = 0
+    while True:
+        raw_header = f.read(_CHUNK_HEADER.size)
+        if len(raw_header) < _CHUNK_HEADER.size:
+            raise SnapshotError("Snapshot is truncated")
+        table_index, rows, size, checksum = _CHUNK_HEADER.unpack(raw_header)
+        payload = f.read(size)
+        if len(payload) < size:
+            raise SnapshotError("Snapshot is truncated")
+        if zlib.crc32(payload) != checksum:
+            raise SnapshotError(f"Checksum mismatch in chunk {chunks}")
+        if table_index == _END:
+            if rows != chunks:
+                raise SnapshotError(f"Snapshot has {chunks} chunks, expected {rows}")
+            return
+        yield table_index, rows, zlib.decompress(payload)
+        chunks += 1
+
+
+def _prepare_tables(connection: sa.engine.Connection, replace: bool) -> None:
+    # Referencing tables go first, so the rows are deleted before the rows they point to
+    for table in STATE_TABLES + tuple(reversed(TABLES)):
+        if connection.execute(sa.select(sa.func.count()).select_from(table)).scalar():
+            if not replace:
+                raise SnapshotError(f"Table {table.name} is not empty")
+            connection.execute(table.delete())
+    if replace:
+        with so.Session(bind=connection) as session:
+            get_search_index(session).clear(session)
+    for table in TABLES:
+        # Rows go in much faster without secondary indexes, they are built once at the end
+        for index in table.indexes:
+            index.drop(connection)
+
+
+def _finish_tables(connection: sa.engine.Connection) -> None:
+    for table in TABLES:
+        for index in table.indexes:
+            index.create(connection)
+        if connection.dialect.name == 'postgresql':
+            (key,) = table.primary_key.columns
+            connection.execute(
+                sa.text(
+                    f"SELECT setval(pg_get_serial_sequence('{table.name}', '{key.name}'),"
+                    f" coalesce(max({key.name}), 1)) FROM {table.name}"
+                )
+            )
+
+
+def import_snapshot(path: Path, replace: bool = False, on_chunk: Optional[ProgressCallback] = None) -> Dict[str, int]:
+    """Loads a snapshot into the database in a single transaction and returns the number of rows of every table.
+
+    With replace the exported tables are overwritten and the sync state, ingestion cursors, aggregates and search
+    index are cleared, they have to be rebuilt from the imported submits afterwards.
+    """
+    engine = db.metadata.bind
+    with path.open('rb') as f, engine.connect() as connection:
+        header = read_header(f)
+        tables = {table.name: table for table in TABLES}
+        layouts = []
+        for table_header in header['tables']:
+            table = tables.get(table_header['name'])
+            if table is None:
+                raise SnapshotError(f"Unknown table {table_header['name']}")
+            keys = {column.name: column.key for column in table.columns}
+            missing = [name for name, _ in table_header['columns'] if name not in keys]
+            if missing:
+                raise SnapshotError(f"Table {table.name} has no columns {missing}")
+            layouts.append((table, [(keys[name], kind) for name, kind in table_header['columns']]))
+
+        synchronous = None
+        if connection.dialect.name == 'sqlite':
+            # The import is all or nothing anyway, so there is no point in syncing every page of it.
+            # SQLite only accepts the pragma outside of a transaction.
+            synchronous = connection.execute(sa.text('PRAGMA synchronous')).scalar()
+            connection.execute(sa.text('PRAGMA synchronous = OFF'))
+        try:
+            with connection.begin():
+                if synchronous is not None:
+                    # pysqlite only opens a transaction before DML, the dropped indexes have to be rolled back too
+                    connection.exec_driver_sql('BEGIN')
+                counts = _load_chunks(connection, f, layouts, replace, on_chunk)
+        finally:
+            if synchronous is not None:
+                connection.execute(sa.text(f'PRAGMA synchronous = {int(synchronous)}'))
+    return counts
+
+
+def _load_chunks(
+    connection: sa.engine.Connection,
+    f: BinaryIO,
+    layouts: List[Tuple[sa.Table, List[Tuple[str, str]]]],
+    replace: bool,
+    on_chunk: Optional[ProgressCallback],
+) -> Dict[str, int]:
+    counts = {table.name: 0 for table in TABLES}
+    _prepare_tables(connection, replace)
+    for table_index, rows, payload in _iter_chunks(f):
+        table, columns = layouts[table_index]
+        view = memoryview(payload)
+        offset = 0
+        values = []
+        for _, kind in columns:
+            column_values, offset = _decode_column(view, offset, rows, kind)
+            values.append(column_values)
+        keys = [key for key, _ in columns]
+        connection.execute(table.insert(), [dict(zip(keys, row)) for row in zip(*values)])
+        counts[table.name] += rows
+        if on_chunk is not None:
+            on_chunk(table.name, rows)
+    _finish_tables(connection)
+    return counts
+
+
+class Throughput:
+    """Counts rows per table for progress reporting."""
+
+    def __init__(self) -> None:
+        self._started_at = time.perf_counter()
+        self.rows: Dict[str, int] = {}
+
+    def __call__(self, table: str, rows: int) -> None:
+        self.rows[table] = self.rows.get(table, 0) + rows
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started_at
+
+    def report(self) -> str:
+        total = sum(self.rows.values())
+        tables = ', '.join(f'{table}={rows}' for table, rows in self.rows.items())
+        return f'{total} rows ({tables}) in {self.elapsed:.1f}s, {total / max(self.elapsed, 1e-9):.0f} rows/s'
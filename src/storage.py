@@ -1,10 +1,35 @@
+import abc
 import datetime
-from typing import List, Optional
+import hashlib
+from itertools import chain
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
 
+import numpy as np
+import sqlalchemy as sa
 from pydantic import BaseModel
+from sqlalchemy import orm as so
 
 import db
-from src.loader import ProblemModel, TimusAPISubmit
+from src.loader import ProblemModel, TimusAPISubmit, Verdict
+from src.search import SearchResult, get_search_index, strip_statement
+
+
+class Interactions(NamedTuple):
+    submit_ids: np.ndarray
+    author_ids: np.ndarray
+    problem_ids: np.ndarray
+
+    def __len__(self) -> int:
+        return int(self.submit_ids.size)
+
+    def take(self, index: Union[np.ndarray, slice]) -> 'Interactions':
+        return Interactions(self.submit_ids[index], self.author_ids[index], self.problem_ids[index])
+
+    def fingerprint(self) -> str:
+        digest = hashlib.sha256()
+        for column in self:
+            digest.update(np.ascontiguousarray(column).tobytes())
+        return digest.hexdigest()
 
 
 class DBUser(BaseModel):
@@ -18,6 +43,7 @@ class DBUser(BaseModel):
 
 class DBSubmit(BaseModel):
     id: int
+    space: int
     submit_id: int
     timus_user_id: int
     problem_id: int
@@ -32,12 +58,36 @@ class DBSubmit(BaseModel):
         frozen = True
 
 
+class SubmitRow(NamedTuple):
+    """Lightweight counterpart of DBSubmit for reads which go over many submits."""
+
+    id: int
+    space: int
+    submit_id: int
+    timus_user_id: int
+    problem_id: int
+    date: datetime.datetime
+    language: str
+    verdict: str
+    test: int
+    runtime_ms: int
+    memory_kb: int
+
+
 class DBProblem(BaseModel):
     id: int
+    space: int
     number: int
     title: str
     difficulty: int
     solutions: int
+
+    class Config:
+        frozen = True
+
+
+class DBProblemStatement(BaseModel):
+    number: int
     limits: str
     text: str
 
@@ -45,6 +95,18 @@ class DBProblem(BaseModel):
         frozen = True
 
 
+class DBSyncState(BaseModel):
+    timus_user_id: int
+    high_watermark: int
+    last_synced_at: Optional[datetime.datetime]
+    backfill_complete: bool
+    backfill_from: Optional[int]
+    backfill_to: int
+
+    class Config:
+        frozen = True
+
+
 class UserStorage:
     def create_or_update(self, user_id: int, timus_id: int) -> DBUser:
         with db.create_session() as session:
@@ -67,36 +129,196 @@ class UserStorage:
         return DBUser(telegram_id=user.user_id, id=user.id, timus_id=user.timus_id)
 
 
+class AuthorSolutions(NamedTuple):
+    # Problems the author had solved before, with the date of their earliest accepted submit
+    solved_before: Dict[int, datetime.datetime]
+    # Accepted submits of the batch which are the author's first for their problem, in submit order
+    new_solutions: List[db.Submit]
+
+
+class ISubmitListener(abc.ABC):
+    @abc.abstractmethod
+    def on_submits_created(
+        self, session: so.Session, submits: List[db.Submit], solutions: Dict[int, AuthorSolutions]
+    ) -> None:
+        """Called inside the transaction which inserts the submits, after they are flushed.
+
+        solutions is find_new_solutions of the submits, computed once for all listeners.
+        """
+
+
+def find_new_solutions(
+    session: so.Session, submits: List[db.Submit], space: int = db.MAIN_SPACE
+) -> Dict[int, AuthorSolutions]:
+    """Finds accepted submits of the space which are the first accepted submit of their author for their problem.
+
+    Returns a mapping from every author with accepted submits among the submits to the problems they had solved
+    before and their new solutions. The submits must already be flushed.
+    """
+    accepted = sorted(
+        (submit for submit in submits if submit.verdict == Verdict.ACCEPTED.value and submit.space == space),
+        key=lambda s: s.timus_submit_id,
+    )
+    if not accepted:
+        return {}
+    result: Dict[int, AuthorSolutions] = {submit.timus_user_id: AuthorSolutions({}, []) for submit in accepted}
+    previous = session.query(db.Submit.timus_user_id, db.Submit.timus_problem_id, sa.func.min(db.Submit.date)).filter(
+        db.Submit.timus_user_id.in_(result),
+        db.Submit.space == space,
+        db.Submit.verdict == Verdict.ACCEPTED.value,
+        db.Submit.id.notin_([submit.id for submit in accepted]),
+    )
+    for author_id, problem_id, first_date in previous.group_by(db.Submit.timus_user_id, db.Submit.timus_problem_id):
+        result[author_id].solved_before[problem_id] = first_date
+
+    solved = {author_id: set(author.solved_before) for author_id, author in result.items()}
+    for submit in accepted:
+        known = solved[submit.timus_user_id]
+        if submit.timus_problem_id in known:
+            continue
+        known.add(submit.timus_problem_id)
+        result[submit.timus_user_id].new_solutions.append(submit)
+    return result
+
+
+_SUBMIT_ROW_COLUMNS = (
+    db.Submit.id,
+    db.Submit.space,
+    db.Submit.timus_submit_id,
+    db.Submit.timus_user_id,
+    db.Submit.timus_problem_id,
+    db.Submit.date,
+    db.Submit.language,
+    db.Submit.verdict,
+    db.Submit.test,
+    db.Submit.runtime_ms,
+    db.Submit.memory_kb,
+)
+
+
 class SubmitStorage:
-    def batch_create(self, submits: List[TimusAPISubmit]) -> List[DBSubmit]:
+    def __init__(self, listeners: Sequence[ISubmitListener] = ()):
+        self._listeners = listeners
+
+    def batch_create(self, submits: List[TimusAPISubmit], space: int = db.MAIN_SPACE) -> List[DBSubmit]:
         with db.create_session() as session:
-            timus_submit_ids = {submit.submit_id for submit in submits}
+            return [self._convert_db_to_model(submit) for submit in self.create_in_session(session, submits, space)]
 
-            already_created = {
-                submit.timus_submit_id
-                for submit in session.query(db.Submit).filter(db.Submit.timus_submit_id.in_(timus_submit_ids)).all()
-            }
-            db_submits = [
-                self._convert_api_model_to_db(submit) for submit in submits if submit.submit_id not in already_created
-            ]
-            session.add_all(db_submits)
-            session.flush()
-            return [self._convert_db_to_model(submit) for submit in db_submits]
+    def create_in_session(
+        self, session: so.Session, submits: List[TimusAPISubmit], space: int = db.MAIN_SPACE
+    ) -> List[db.Submit]:
+        """Inserts the submits which are not stored yet within the caller's transaction and notifies listeners."""
+        timus_submit_ids = {submit.submit_id for submit in submits}
+
+        already_created = {
+            timus_submit_id
+            for (timus_submit_id,) in session.query(db.Submit.timus_submit_id).filter(
+                db.Submit.timus_submit_id.in_(timus_submit_ids)
+            )
+        }
+        db_submits = [
+            self._convert_api_model_to_db(submit, space)
+            for submit in submits
+            if submit.submit_id not in already_created
+        ]
+        session.add_all(db_submits)
+        session.flush()
+        if self._listeners:
+            solutions = find_new_solutions(session, db_submits)
+            for listener in self._listeners:
+                listener.on_submits_created(session, db_submits, solutions)
+        return db_submits
 
-    def get_all_by_author(self, timus_user_id: int) -> List[DBSubmit]:
+    def get_all_by_author(self, timus_user_id: int, space: int = db.MAIN_SPACE) -> List[DBSubmit]:
         with db.create_session() as session:
-            submits = session.query(db.Submit).filter(db.Submit.timus_user_id == timus_user_id).all()
+            submits = (
+                session.query(db.Submit)
+                .filter(db.Submit.timus_user_id == timus_user_id, db.Submit.space == space)
+                .all()
+            )
             return [self._convert_db_to_model(submit) for submit in submits]
 
-    def get_all(self) -> List[DBSubmit]:
+    def get_accepted_interactions(self, timus_user_id: int, space: int = db.MAIN_SPACE) -> Interactions:
+        """Returns the first accepted submit of every problem the user solved, ordered by submit id.
+
+        Deduplication happens in the database and rows go straight into int64 columns, so no per-submit model
+        objects are created.
+        """
         with db.create_session() as session:
-            return [self._convert_db_to_model(submit) for submit in session.query(db.Submit).all()]
+            rows = (
+                session.query(sa.func.min(db.Submit.timus_submit_id), db.Submit.timus_problem_id)
+                .filter(
+                    db.Submit.timus_user_id == timus_user_id,
+                    db.Submit.space == space,
+                    db.Submit.verdict == Verdict.ACCEPTED.value,
+                )
+                .group_by(db.Submit.timus_problem_id)
+                .order_by(sa.func.min(db.Submit.timus_submit_id))
+                .all()
+            )
+        columns = np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=2 * len(rows)).reshape(-1, 2)
+        return Interactions(
+            submit_ids=columns[:, 0],
+            author_ids=np.full(len(rows), timus_user_id, dtype=np.int64),
+            problem_ids=columns[:, 1],
+        )
+
+    def get_all(self) -> List[DBSubmit]:
+        return [DBSubmit(**row._asdict()) for chunk in self.iter_all() for row in chunk]
+
+    def iter_all(self, chunk_size: int = 10_000, space: Optional[int] = None) -> Iterator[List[SubmitRow]]:
+        """Yields submits of the space, or of all spaces, in submit order, chunk by chunk, without building ORM
+        objects or models.
+        """
+        for chunk in self.iter_rows(chunk_size, space):
+            yield [SubmitRow._make(row) for row in chunk]
+
+    def iter_rows(self, chunk_size: int = 10_000, space: Optional[int] = None) -> Iterator[List[Tuple[Any, ...]]]:
+        """Same as iter_all, but yields raw tuples in the order of SubmitRow fields."""
+        filters = () if space is None else (db.Submit.space == space,)
+        return self._iter_keyset(_SUBMIT_ROW_COLUMNS, filters, chunk_size)
+
+    def iter_accepted_interactions(
+        self, chunk_size: int, space: int = db.MAIN_SPACE
+    ) -> Iterator[List[Tuple[int, int, int]]]:
+        """Yields (submit id, author id, problem id) of accepted submits in submit order, chunk by chunk."""
+        return self._iter_keyset(
+            (db.Submit.timus_submit_id, db.Submit.timus_user_id, db.Submit.timus_problem_id),
+            (db.Submit.space == space, db.Submit.verdict == Verdict.ACCEPTED.value),
+            chunk_size,
+        )
+
+    def _iter_keyset(
+        self, columns: Sequence[Any], filters: Sequence[Any], chunk_size: int
+    ) -> Iterator[List[Tuple[Any, ...]]]:
+        """Keyset pagination over timus_submit_id.
+
+        Every chunk is a separate short query which seeks to the last seen id through the unique index, so memory
+        does not depend on the table size and no transaction stays open while the caller processes a chunk.
+        """
+        last_submit_id = -1
+        position = [column.key for column in columns].index('timus_submit_id')
+        while True:
+            with db.create_session() as session:
+                chunk = [
+                    tuple(row)
+                    for row in session.query(*columns)
+                    .filter(*filters, db.Submit.timus_submit_id > last_submit_id)
+                    .order_by(db.Submit.timus_submit_id)
+                    .limit(chunk_size)
+                ]
+            if not chunk:
+                return
+            yield chunk
+            last_submit_id = chunk[-1][position]
 
     def get_last_or_none(
-        self, timus_user_id: Optional[int] = None, verdict: Optional[str] = None
+        self, timus_user_id: Optional[int] = None, verdict: Optional[str] = None, space: int = db.MAIN_SPACE
     ) -> Optional[DBSubmit]:
         with db.create_session() as session:
-            submit_query = session.query(db.Submit).order_by(db.Submit.timus_submit_id.desc())
+            submit_query = (
+                session.query(db.Submit).filter(db.Submit.space == space).order_by(db.Submit.timus_submit_id.desc())
+            )
             if timus_user_id is not None:
                 submit_query = submit_query.filter(db.Submit.timus_user_id == timus_user_id)
             if verdict is not None:
@@ -106,8 +328,9 @@ class SubmitStorage:
                 return None
             return self._convert_db_to_model(submit)
 
-    def _convert_api_model_to_db(self, model: TimusAPISubmit) -> db.Submit:
+    def _convert_api_model_to_db(self, model: TimusAPISubmit, space: int) -> db.Submit:
         return db.Submit(
+            space=space,
             timus_submit_id=model.submit_id,
             timus_user_id=model.author_id,
             timus_problem_id=model.problem,
@@ -122,6 +345,7 @@ class SubmitStorage:
     def _convert_db_to_model(self, submit: db.Submit) -> DBSubmit:
         return DBSubmit(
             id=submit.id,
+            space=submit.space,
             submit_id=submit.timus_submit_id,
             timus_user_id=submit.timus_user_id,
             problem_id=submit.timus_problem_id,
@@ -134,39 +358,200 @@ class SubmitStorage:
         )
 
 
+class SyncStateStorage:
+    def get_or_none(self, timus_user_id: int) -> Optional[DBSyncState]:
+        with db.create_session() as session:
+            state = (
+                session.query(db.UserSyncState).filter(db.UserSyncState.timus_user_id == timus_user_id).one_or_none()
+            )
+            if state is None:
+                return None
+            return self._convert_db_to_model(state)
+
+    def save(self, state: DBSyncState) -> DBSyncState:
+        with db.create_session() as session:
+            db_state = (
+                session.query(db.UserSyncState)
+                .filter(db.UserSyncState.timus_user_id == state.timus_user_id)
+                .one_or_none()
+            )
+            if db_state is None:
+                db_state = db.UserSyncState(timus_user_id=state.timus_user_id)
+                session.add(db_state)
+            db_state.high_watermark = state.high_watermark
+            db_state.last_synced_at = state.last_synced_at
+            db_state.backfill_complete = state.backfill_complete
+            db_state.backfill_from = state.backfill_from
+            db_state.backfill_to = state.backfill_to
+            session.flush()
+            return self._convert_db_to_model(db_state)
+
+    def update_watermark(self, timus_user_id: int, high_watermark: int, last_synced_at: datetime.datetime) -> None:
+        with db.create_session() as session:
+            db_state = self._get_db_state(session, timus_user_id)
+            db_state.high_watermark = max(db_state.high_watermark, high_watermark)
+            db_state.last_synced_at = last_synced_at
+
+    def update_backfill(self, state: DBSyncState, backfill_from: Optional[int], backfill_complete: bool) -> bool:
+        """Moves the unfinished backfill of state forward unless its stored range has changed since state was read.
+
+        A sync saves a new range when it leaves a new gap, so False means the backfill has to continue from the
+        stored state instead.
+        """
+        stored_from = db.UserSyncState.backfill_from
+        with db.create_session() as session:
+            updated: int = (
+                session.query(db.UserSyncState)
+                .filter(
+                    db.UserSyncState.timus_user_id == state.timus_user_id,
+                    sa.not_(db.UserSyncState.backfill_complete),
+                    db.UserSyncState.backfill_to == state.backfill_to,
+                    stored_from.is_(None) if state.backfill_from is None else stored_from == state.backfill_from,
+                )
+                .update(
+                    {'backfill_from': backfill_from, 'backfill_complete': backfill_complete},
+                    synchronize_session=False,
+                )
+            )
+            return updated == 1
+
+    def _get_db_state(self, session: so.Session, timus_user_id: int) -> db.UserSyncState:
+        state: db.UserSyncState = (
+            session.query(db.UserSyncState).filter(db.UserSyncState.timus_user_id == timus_user_id).one()
+        )
+        return state
+
+    def _convert_db_to_model(self, state: db.UserSyncState) -> DBSyncState:
+        return DBSyncState(
+            timus_user_id=state.timus_user_id,
+            high_watermark=state.high_watermark,
+            last_synced_at=state.last_synced_at,
+            backfill_complete=state.backfill_complete,
+            backfill_from=state.backfill_from,
+            backfill_to=state.backfill_to,
+        )
+
+
 class ProblemStorage:
-    def create_or_update(self, problem: ProblemModel) -> DBProblem:
+    def create_or_update(self, problem: ProblemModel, space: int = db.MAIN_SPACE) -> DBProblem:
         with db.create_session() as session:
-            db_problem = session.query(db.Problem).filter(db.Problem.number == problem.number).one_or_none()
+            db_problem = (
+                session.query(db.Problem)
+                .filter(db.Problem.space == space, db.Problem.number == problem.number)
+                .one_or_none()
+            )
             if db_problem is None:
-                db_problem = db.Problem(
-                    number=problem.number,
-                    title=problem.title,
-                    difficulty=problem.difficulty,
-                    solutions=problem.solutions,
-                    limits=problem.limits,
-                    text=problem.text,
-                )
+                db_problem = db.Problem(space=space, number=problem.number)
                 session.add(db_problem)
-                session.flush()
+            searchable_changed = self._update(db_problem, problem)
+            session.flush()
+            # Only the main space is searchable, numbers of other spaces would clash with it
+            if searchable_changed and space == db.MAIN_SPACE:
+                get_search_index(session).index(session, problem.number, problem.title, problem.search_text)
 
             return self._convert_db_to_model(db_problem)
 
-    def get_by_number_or_none(self, number: int) -> Optional[DBProblem]:
+    def _update(self, db_problem: db.Problem, problem: ProblemModel) -> bool:
+        """Copies the problem into the row and tells whether its title or statement changed."""
+        limits, text = db.compress_statement(problem.limits), db.compress_statement(problem.text)
+        searchable_changed: bool = db_problem.title != problem.title
+        db_problem.title = problem.title
+        db_problem.difficulty = problem.difficulty
+        db_problem.solutions = problem.solutions
+        if db_problem.statement is None:
+            db_problem.statement = db.ProblemStatement(limits=limits, text=text)
+            return True
+        if db_problem.statement.limits != limits:
+            db_problem.statement.limits = limits
+        if db_problem.statement.text != text:
+            db_problem.statement.text = text
+            searchable_changed = True
+        return searchable_changed
+
+    def get_by_number_or_none(self, number: int, space: int = db.MAIN_SPACE) -> Optional[DBProblem]:
         with db.create_session() as session:
-            db_problem = session.query(db.Problem).filter(db.Problem.number == number).one_or_none()
+            db_problem = (
+                session.query(db.Problem).filter(db.Problem.space == space, db.Problem.number == number).one_or_none()
+            )
             if db_problem is None:
                 return None
 
             return self._convert_db_to_model(db_problem)
 
+    def get_statement_or_none(self, number: int, space: int = db.MAIN_SPACE) -> Optional[DBProblemStatement]:
+        with db.create_session() as session:
+            row = (
+                session.query(db.Problem.number, db.ProblemStatement.limits, db.ProblemStatement.text)
+                .join(db.Problem.statement)
+                .filter(db.Problem.space == space, db.Problem.number == number)
+                .one_or_none()
+            )
+            if row is None:
+                return None
+
+            number, limits, text = row
+            return DBProblemStatement(
+                number=number, limits=db.decompress_statement(limits), text=db.decompress_statement(text)
+            )
+
+    def get_all(self, space: int = db.MAIN_SPACE) -> List[DBProblem]:
+        """Metadata of every problem of the space, the easiest first; statements are not read at all."""
+        with db.create_session() as session:
+            query = (
+                session.query(db.Problem)
+                .filter(db.Problem.space == space)
+                .order_by(db.Problem.difficulty, db.Problem.number)
+            )
+            return [self._convert_db_to_model(db_problem) for db_problem in query]
+
+    def search(self, query: str, limit: int) -> List[SearchResult]:
+        with db.create_session() as session:
+            return get_search_index(session).search(session, query, limit)
+
+    def rebuild_search_index(self) -> int:
+        with db.create_session() as session:
+            search_index = get_search_index(session)
+            search_index.clear(session)
+            problems = (
+                session.query(db.Problem.number, db.Problem.title, db.ProblemStatement.text)
+                .join(db.Problem.statement)
+                .filter(db.Problem.space == db.MAIN_SPACE)
+                .all()
+            )
+            for number, title, text in problems:
+                search_index.index(session, number, title, strip_statement(db.decompress_statement(text)))
+            return len(problems)
+
+    def get_statements(self, space: int = db.MAIN_SPACE) -> List[Tuple[int, str, str, int]]:
+        """Returns (number, title, statement html, solutions) of every problem of the space."""
+        with db.create_session() as session:
+            query = (
+                session.query(db.Problem.number, db.Problem.title, db.ProblemStatement.text, db.Problem.solutions)
+                .join(db.Problem.statement)
+                .filter(db.Problem.space == space)
+            )
+            return [
+                (number, title, db.decompress_statement(text), solutions) for number, title, text, solutions in query
+            ]
+
+    def get_titles(self, numbers: List[int], space: int = db.MAIN_SPACE) -> Dict[int, str]:
+        with db.create_session() as session:
+            query = session.query(db.Problem.number, db.Problem.title).filter(
+                db.Problem.space == space, db.Problem.number.in_(numbers)
+            )
+            return {number: title for number, title in query}
+
+    def get_difficulties(self, space: int = db.MAIN_SPACE) -> List[Tuple[int, int]]:
+        with db.create_session() as session:
+            query = session.query(db.Problem.number, db.Problem.difficulty).filter(db.Problem.space == space)
+            return [(number, difficulty) for number, difficulty in query]
+
     def _convert_db_to_model(self, problem: db.Problem) -> DBProblem:
         return DBProblem(
             id=problem.id,
+            space=problem.space,
             number=problem.number,
             title=problem.title,
             difficulty=problem.difficulty,
             solutions=problem.solutions,
-            limits=problem.limits,
-            text=problem.text,
         )
@@ -0,0 +1,196 @@
+import datetime
+import logging
+import queue
+import threading
+import time
+from typing import List, Optional, Set
+
+from pydantic import BaseSettings
+
+from src.loader import TimusAPIClient, TimusAPISubmit
+from src.storage import DBSyncState, DBUser, SubmitStorage, SyncStateStorage
+
+logger = logging.getLogger(__name__)
+
+
+class SyncSettings(BaseSettings):
+    initial_page_size: int = 20
+    max_page_size: int = 1000
+    first_sync_max_pages: int = 3
+    sync_max_pages: int = 10
+    backfill_page_size: int = 1000
+    backfill_interval: float = 0.5
+
+    class Config:
+        env_prefix = 'TIMUS_SYNC_'
+
+
+class Backfiller:
+    """Fetches the older part of users' histories in a background thread, one page at a time."""
+
+    def __init__(
+        self,
+        settings: SyncSettings,
+        submit_storage: SubmitStorage,
+        sync_state_storage: SyncStateStorage,
+        client: TimusAPIClient,
+    ):
+        self._settings = settings
+        self._submit_storage = submit_storage
+        self._sync_state_storage = sync_state_storage
+        self._client = client
+        self._queue: 'queue.Queue[int]' = queue.Queue()
+        self._scheduled: Set[int] = set()
+        self._rescheduled: Set[int] = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='backfill', daemon=True)
+        self._thread.start()
+
+    def schedule(self, timus_user_id: int) -> None:
+        with self._lock:
+            if timus_user_id in self._scheduled:
+                # The queued or running backfill may have read the state before the new gap was saved
+                self._rescheduled.add(timus_user_id)
+                return
+            self._scheduled.add(timus_user_id)
+        self._queue.put(timus_user_id)
+
+    def wait(self) -> None:
+        self._queue.join()
+
+    def _run(self) -> None:
+        while True:
+            timus_user_id = self._queue.get()
+            try:
+                self.backfill(timus_user_id)
+            except Exception:
+                logger.exception("Backfill of user %s failed", timus_user_id)
+            finally:
+                self._finish(timus_user_id)
+                self._queue.task_done()
+
+    def _finish(self, timus_user_id: int) -> None:
+        with self._lock:
+            if timus_user_id not in self._rescheduled:
+                self._scheduled.discard(timus_user_id)
+                return
+            self._rescheduled.discard(timus_user_id)
+        self._queue.put(timus_user_id)
+
+    def backfill(self, timus_user_id: int) -> None:
+        state = self._sync_state_storage.get_or_none(timus_user_id)
+        pages = 0
+        while state is not None and not state.backfill_complete:
+            page = self._client.get_submits(
+                author_id=timus_user_id, count=self._settings.backfill_page_size, from_submit_id=state.backfill_from
+            )
+            submits = [submit for submit in page if submit.submit_id > state.backfill_to]
+            self._submit_storage.batch_create(submits)
+            pages += 1
+            complete = len(submits) < len(page) or len(page) < self._settings.backfill_page_size
+            backfill_from = state.backfill_from if complete else page[-1].submit_id - 1
+            if not self._sync_state_storage.update_backfill(state, backfill_from, backfill_complete=complete):
+                logger.info("Sync state of user %s changed during backfill, continuing from the new one", timus_user_id)
+                state = self._sync_state_storage.get_or_none(timus_user_id)
+                continue
+            if complete:
+                logger.info("Backfill of user %s finished after %s pages", timus_user_id, pages)
+                return
+            state = state.copy(update={'backfill_from': backfill_from})
+            time.sleep(self._settings.backfill_interval)
+
+
+class SubmitSyncer:
+    def __init__(
+        self,
+        settings: SyncSettings,
+        submit_storage: SubmitStorage,
+        sync_state_storage: SyncStateStorage,
+        client: TimusAPIClient,
+        backfiller: Backfiller,
+    ):
+        self._settings = settings
+        self._submit_storage = submit_storage
+        self._sync_state_storage = sync_state_storage
+        self._client = client
+        self._backfiller = backfiller
+
+    def sync(self, user: DBUser) -> None:
+        """Fetches submits newer than the user's high watermark.
+
+        The number of requests is bounded, so the first sync of a user with a long history only stores its newest
+        part and leaves the rest to the backfiller.
+        """
+        state = self._get_state(user.timus_id)
+        max_pages = self._settings.first_sync_max_pages if state is None else self._settings.sync_max_pages
+        high_watermark = state.high_watermark if state is not None else 0
+
+        submits: List[TimusAPISubmit] = []
+        page_size = self._settings.initial_page_size
+        from_submit_id: Optional[int] = None
+        caught_up = False
+        for _ in range(max_pages):
+            page = self._client.get_submits(author_id=user.timus_id, count=page_size, from_submit_id=from_submit_id)
+            new_submits = [submit for submit in page if submit.submit_id > high_watermark]
+            submits.extend(new_submits)
+            # Comparing with the watermark instead of looking for the exact submit keeps working
+            # if the last known submit disappears from the status page
+            if len(new_submits) < len(page) or len(page) < page_size:
+                caught_up = True
+                break
+            from_submit_id = page[-1].submit_id - 1
+            page_size = min(page_size * 2, self._settings.max_page_size)
+
+        self._submit_storage.batch_create(submits)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        new_high_watermark = max([high_watermark] + [submit.submit_id for submit in submits])
+
+        if state is not None and caught_up:
+            self._sync_state_storage.update_watermark(
+                user.timus_id, high_watermark=new_high_watermark, last_synced_at=now
+            )
+        else:
+            # Either the first sync or too many new submits: everything between the oldest fetched submit
+            # and the previously synced history is left to the backfiller
+            gap_from = submits[-1].submit_id - 1 if submits else None
+            if state is None or state.backfill_complete:
+                backfill_to = high_watermark
+            else:
+                # The unfinished backfill still ends at the old watermark, the new gap is just fetched first
+                backfill_to = state.backfill_to
+            self._sync_state_storage.save(
+                DBSyncState(
+                    timus_user_id=user.timus_id,
+                    high_watermark=new_high_watermark,
+                    last_synced_at=now,
+                    backfill_complete=caught_up,
+                    backfill_from=None if caught_up else gap_from,
+                    backfill_to=backfill_to,
+                )
+            )
+
+        logger.info("Synced %s submits of user %s, caught up: %s", len(submits), user.timus_id, caught_up)
+        if not caught_up or (state is not None and not state.backfill_complete):
+            self._backfiller.schedule(user.timus_id)
+
+    def _get_state(self, timus_user_id: int) -> Optional[DBSyncState]:
+        state = self._sync_state_storage.get_or_none(timus_user_id)
+        if state is not None:
+            return state
+        last_submit = self._submit_storage.get_last_or_none(timus_user_id)
+        if last_submit is None:
+            return None
+        # Users synced before sync states were introduced always have their whole history fetched
+        return self._sync_state_storage.save(
+            DBSyncState(
+                timus_user_id=timus_user_id,
+                high_watermark=last_submit.submit_id,
+                last_synced_at=None,
+                backfill_complete=True,
+                backfill_from=None,
+                backfill_to=0,
+            )
+        )
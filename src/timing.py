@@ -0,0 +1,39 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+logger = logging.getLogger(__name__)
+
+
+class PhaseTimer:
+    def __init__(self, name: str):
+        self._name = name
+        self._started_at = time.perf_counter()
+        self._durations: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - started_at
+            with self._lock:
+                self._durations[name] = duration
+            logger.info("%s: phase '%s' took %.3fs", self._name, name, duration)
+
+    @property
+    def durations(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._durations)
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started_at
+
+    def report(self) -> str:
+        phases = ', '.join(f'{name}={duration:.3f}s' for name, duration in self.durations.items())
+        return f'{self._name}: {phases} (elapsed {self.elapsed:.3f}s)'
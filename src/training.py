@@ -0,0 +1,166 @@
+import datetime
+import json
+import resource
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.recommenders import to_sframe
+from src.storage import Interactions, SubmitStorage
+from src.timing import PhaseTimer
+
+MANIFEST_FILE = 'manifest.json'
+MODEL_DIR = 'model'
+
+
+class MemoryBudgetExceeded(Exception):
+    pass
+
+
+def load_unique_interactions(
+    storage: SubmitStorage, chunk_size: int, memory_budget_mb: Optional[float] = None
+) -> Tuple[Interactions, int]:
+    """Reads the first accepted submit of every (author, problem) pair, also returns the number of accepted submits.
+
+    Chunks are deduplicated as soon as they outgrow the interactions already kept, so memory follows the number of
+    unique interactions rather than of accepted submits, and reading stops once peak memory exceeds the budget.
+    """
+    parts: List[Interactions] = []
+    kept = pending = read = 0
+    for chunk in storage.iter_accepted_interactions(chunk_size):
+        table = np.array(chunk, dtype=np.int64).reshape(-1, 3)
+        parts.append(Interactions(table[:, 0].copy(), table[:, 1].copy(), table[:, 2].copy()))
+        read += len(chunk)
+        pending += len(chunk)
+        if pending > max(kept, chunk_size):
+            parts = [deduplicate(_concatenate(parts))]
+            kept, pending = len(parts[0]), 0
+        check_memory_budget(memory_budget_mb)
+    return deduplicate(_concatenate(parts)), read
+
+
+def _concatenate(parts: List[Interactions]) -> Interactions:
+    if not parts:
+        return Interactions(*(np.empty(0, dtype=np.int64) for _ in range(3)))
+    return Interactions(*(np.concatenate(columns) for columns in zip(*parts)))
+
+
+def deduplicate(interactions: Interactions) -> Interactions:
+    """Keeps the first accepted submit of every (author, problem) pair, in submit order."""
+    order = np.argsort(interactions.submit_ids, kind='stable')
+    keys = (interactions.author_ids[order] << 32) | interactions.problem_ids[order]
+    _, first = np.unique(keys, return_index=True)
+    return interactions.take(np.sort(order[first]))
+
+
+def filter_active_authors(interactions: Interactions, min_problems: int) -> Interactions:
+    """Keeps authors who solved more than min_problems problems, as in the original notebook."""
+    authors, counts = np.unique(interactions.author_ids, return_counts=True)
+    return interactions.take(np.isin(interactions.author_ids, authors[counts > min_problems]))
+
+
+def split_by_authors(
+    interactions: Interactions, test_fraction: float, holdout_per_author: int, seed: int
+) -> Tuple[Interactions, Interactions]:
+    """Holds out the latest holdout_per_author problems of a random test_fraction of authors."""
+    authors = np.unique(interactions.author_ids)
+    rng = np.random.default_rng(seed)
+    test_authors = rng.choice(authors, size=int(test_fraction * authors.size), replace=False)
+
+    # Rank of every interaction among its author's interactions, the latest one first
+    order = np.lexsort((-interactions.submit_ids, interactions.author_ids))
+    sorted_authors = interactions.author_ids[order]
+    group_starts = np.flatnonzero(np.r_[True, sorted_authors[1:] != sorted_authors[:-1]])
+    group_sizes = np.diff(np.r_[group_starts, sorted_authors.size])
+    ranks = np.empty(sorted_authors.size, dtype=np.int64)
+    ranks[order] = np.arange(sorted_authors.size) - np.repeat(group_starts, group_sizes)
+
+    test_mask = np.isin(interactions.author_ids, test_authors) & (ranks < holdout_per_author)
+    return interactions.take(~test_mask), interactions.take(test_mask)
+
+
+def peak_memory_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def check_memory_budget(memory_budget_mb: Optional[float]) -> None:
+    if memory_budget_mb is not None and peak_memory_mb() > memory_budget_mb:
+        raise MemoryBudgetExceeded(
+            f"Peak memory of {peak_memory_mb():.0f} MB exceeds the budget of {memory_budget_mb:.0f} MB"
+        )
+
+
+def fit_item_similarity(interactions: Interactions) -> Any:
+    import turicreate as tc
+
+    return tc.item_similarity_recommender.create(to_sframe(interactions), user_id='authorid', item_id='problemid')
+
+
+def train(
+    *,
+    storage: SubmitStorage,
+    output: Path,
+    chunk_size: int,
+    min_problems: int,
+    test_fraction: float,
+    holdout_per_author: int,
+    seed: int,
+    timer: PhaseTimer,
+    memory_budget_mb: Optional[float] = None,
+) -> Dict[str, Any]:
+    """Trains an item similarity model on the submits stored in the DB and writes it next to its manifest.
+
+    Returns the manifest. Raises MemoryBudgetExceeded as soon as a phase pushes peak memory over the budget.
+    """
+    with timer.phase('read'):
+        interactions, read_count = load_unique_interactions(storage, chunk_size, memory_budget_mb)
+    unique_count = len(interactions)
+    with timer.phase('filter'):
+        interactions = filter_active_authors(interactions, min_problems)
+    with timer.phase('split'):
+        train_interactions, test_interactions = split_by_authors(interactions, test_fraction, holdout_per_author, seed)
+
+    with timer.phase('import turicreate'):
+        import turicreate as tc
+    with timer.phase('train'):
+        model = fit_item_similarity(train_interactions)
+    check_memory_budget(memory_budget_mb)
+
+    created_at = datetime.datetime.now(datetime.timezone.utc)
+    version = created_at.strftime('%Y%m%dT%H%M%SZ')
+    model_dir = output / version
+    with timer.phase('save'):
+        model_dir.mkdir(parents=True, exist_ok=False)
+        model.save(str(model_dir / MODEL_DIR))
+
+    manifest = {
+        'version': version,
+        'created_at': created_at.isoformat(),
+        'model': 'item_similarity_recommender',
+        'turicreate_version': tc.__version__,
+        'params': {
+            'chunk_size': chunk_size,
+            'min_problems': min_problems,
+            'test_fraction': test_fraction,
+            'holdout_per_author': holdout_per_author,
+            'seed': seed,
+            'memory_budget_mb': memory_budget_mb,
+        },
+        'data': {
+            'accepted_submits': read_count,
+            'unique_interactions': unique_count,
+            'filtered_interactions': len(interactions),
+            'train_interactions': len(train_interactions),
+            'test_interactions': len(test_interactions),
+            'authors': int(np.unique(train_interactions.author_ids).size),
+            'problems': int(np.unique(train_interactions.problem_ids).size),
+            'max_submit_id': int(interactions.submit_ids.max()) if len(interactions) else None,
+            'fingerprint': train_interactions.fingerprint(),
+        },
+        'timings': timer.durations,
+        'peak_memory_mb': peak_memory_mb(),
+    }
+    (model_dir / MANIFEST_FILE).write_text(json.dumps(manifest, indent=2))
+    return manifest
@@ -0,0 +1,46 @@
+import logging
+import threading
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ModelHolder:
+    """Keeps a model which may still be loading in a background thread."""
+
+    def __init__(self) -> None:
+        self._model: Optional[Any] = None
+        self._ready = threading.Event()
+
+    def set(self, model: Any) -> None:
+        self._model = model
+        self._ready.set()
+
+    def get_or_none(self) -> Optional[Any]:
+        if not self._ready.is_set():
+            return None
+        return self._model
+
+    @property
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def warm_up_in_background(
+        self, load: Callable[[], Any], on_ready: Optional[Callable[[], None]] = None
+    ) -> threading.Thread:
+        def _warm_up() -> None:
+            try:
+                model = load()
+            except Exception:
+                logger.exception("Model warm-up failed")
+                return
+            self.set(model)
+            if on_ready is not None:
+                on_ready()
+
+        thread = threading.Thread(target=_warm_up, name='model-warm-up', daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,146 @@
+import hmac
+import json
+import logging
+import queue
+import threading
+from email.message import Message
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BufferedIOBase
+from typing import Any, Callable, Optional, Tuple
+
+import telebot
+
+from src.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+REJECTED_UPDATES = REGISTRY.counter('timus_recommender_webhook_rejected_total', 'Updates rejected by a full queue.')
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    """Receives Telegram updates over HTTP and hands them to a fixed pool of worker threads.
+
+    Updates wait in a bounded queue. When it is full the server answers 503, so Telegram retries the
+    delivery later instead of the bot piling up work it cannot keep up with. Requests without the secret token
+    given to set_webhook are answered 403.
+    """
+
+    def __init__(
+        self,
+        process_update: Callable[[telebot.types.Update], None],
+        *,
+        host: str,
+        port: int,
+        path: str,
+        secret_token: str,
+        queue_size: int,
+        workers: int,
+    ):
+        self._process_update = process_update
+        self._path = path
+        self._secret_token = secret_token
+        self._queue: 'queue.Queue[Optional[telebot.types.Update]]' = queue.Queue(maxsize=queue_size)
+        self._server = ThreadingHTTPServer((host, port), self._make_request_handler())
+        self._server.daemon_threads = True
+        self._workers = [
+            threading.Thread(target=self._work, name=f'webhook-worker-{i}', daemon=True) for i in range(workers)
+        ]
+        self._server_thread = threading.Thread(target=self._server.serve_forever, name='webhook-server', daemon=True)
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        host, port = self._server.server_address[:2]
+        return str(host), int(port)
+
+    def start(self) -> None:
+        for worker in self._workers:
+            worker.start()
+        self._server_thread.start()
+        logger.info("Webhook server is listening on %s:%s%s", *self.address, self._path)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stops accepting updates and waits until the already queued ones are processed."""
+        self._server.shutdown()
+        self._server.server_close()
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
+        logger.info("Webhook server stopped")
+
+    def _enqueue(self, update: telebot.types.Update) -> bool:
+        try:
+            self._queue.put_nowait(update)
+        except queue.Full:
+            REJECTED_UPDATES.inc()
+            logger.warning("Webhook queue is full, rejecting update %s", update.update_id)
+            return False
+        return True
+
+    def _work(self) -> None:
+        while True:
+            update = self._queue.get()
+            if update is None:
+                return
+            try:
+                self._process_update(update)
+            except Exception:
+                logger.exception("Update %s could not be processed", update.update_id)
+
+    def _handle_post(self, path: str, headers: Message, body: BufferedIOBase) -> HTTPStatus:
+        if path != self._path:
+            return HTTPStatus.NOT_FOUND
+        if not hmac.compare_digest(headers.get(SECRET_TOKEN_HEADER, ''), self._secret_token):
+            return HTTPStatus.FORBIDDEN
+        data = body.read(int(headers.get('Content-Length', 0)))
+        try:
+            update = telebot.types.Update.de_json(json.loads(data))
+        except (ValueError, KeyError, TypeError):
+            return HTTPStatus.BAD_REQUEST
+        return HTTPStatus.OK if self._enqueue(update) else HTTPStatus.SERVICE_UNAVAILABLE
+
+    def _make_request_handler(self) -> Any:
+        server = self
+
+        class _RequestHandler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:  # noqa: N802
+                self._respond(server._handle_post(self.path, self.headers, self.rfile))
+
+            def _respond(self, status: HTTPStatus) -> None:
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+                logger.debug(format, *args)
+
+        return _RequestHandler
+
+
+def stop_bot_workers(bot: telebot.TeleBot, timeout: Optional[float] = None) -> None:
+    """Waits until the handlers already queued in a threaded bot's worker pool finish, then stops the pool."""
+    if not bot.threaded:
+        return
+    pool = bot.worker_pool
+    # The pool's queue is FIFO, so once every worker has reached a barrier task all earlier tasks are done
+    barrier = threading.Barrier(pool.num_threads + 1)
+    for _ in range(pool.num_threads):
+        pool.put(_pass_barrier, barrier)
+    try:
+        barrier.wait(timeout)
+    except threading.BrokenBarrierError:
+        logger.warning("Bot workers did not finish queued updates in %s seconds", timeout)
+    for worker in pool.workers:
+        worker.stop()
+    for worker in pool.workers:
+        worker.join(timeout)
+
+
+def _pass_barrier(barrier: threading.Barrier) -> None:
+    try:
+        barrier.wait()
+    except threading.BrokenBarrierError:
+        pass
@@ -0,0 +1,36 @@
+import json
+from pathlib import Path
+from typing import Optional
+
+import typer
+
+from tests.benchmarks.suite import compare, run_suite
+
+
+def main(
+    submits: int = typer.Option(100_000),
+    authors: int = typer.Option(10_000),
+    parse_rows: int = typer.Option(1000),
+    repeat: int = typer.Option(5),
+    seed: int = typer.Option(0),
+    output: Path = typer.Option(Path('bench_output.json')),
+    baseline: Optional[Path] = typer.Option(None),
+    tolerance: float = typer.Option(0.2),
+) -> None:
+    report = run_suite(submits=submits, authors=authors, parse_rows=parse_rows, repeat=repeat, seed=seed)
+    for name, result in report['results'].items():
+        rate = f", {result['items_per_s']:.0f} items/s" if 'items_per_s' in result else ''
+        typer.echo(f"{name}: median {result['median_s'] * 1000:.3f}ms{rate}")
+    output.write_text(json.dumps(report, indent=2))
+    typer.echo(f"Saved to {output}")
+
+    if baseline is not None:
+        regressions = compare(report, json.loads(baseline.read_text()), tolerance)
+        for regression in regressions:
+            typer.secho(regression, fg=typer.colors.RED, err=True)
+        if regressions:
+            raise typer.Exit(code=1)
+
+
+if __name__ == '__main__':
+    typer.run(main)
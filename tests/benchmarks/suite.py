@@ -0,0 +1,148 @@
+import datetime
+import platform
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from db import metadata
+from src.config import DBSettings
+from src.handlers import RecommendHandler
+from src.loader import TimusParser, Verdict
+from src.recommenders import ComplexityRecommender, to_unique_interactions
+from src.storage import SubmitStorage, SyncStateStorage, UserStorage
+from src.sync import Backfiller, SubmitSyncer, SyncSettings
+from src.warmup import ModelHolder
+from tests.benchmarks.synthetic import FIRST_PROBLEM, SyntheticDataset
+
+FORMAT_VERSION = 1
+
+
+def measure(function: Callable[[], Any], repeat: int, items: Optional[int] = None) -> Dict[str, float]:
+    durations = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - started_at)
+    result = {
+        'repeat': repeat,
+        'min_s': min(durations),
+        'median_s': statistics.median(durations),
+        'mean_s': statistics.mean(durations),
+    }
+    if items is not None:
+        result['items'] = items
+        result['items_per_s'] = items / result['median_s'] if result['median_s'] else float('inf')
+    return result
+
+
+class _OfflineClient:
+    """Timus client stand-in which reports no new submits, so a sync costs a single cheap round trip."""
+
+    def get_submits(self, **kwargs: Any) -> List[Any]:
+        return []
+
+
+class _RecordingBot:
+    def __init__(self) -> None:
+        self.messages: List[str] = []
+
+    def send_message(self, chat_id: int, text: str, **kwargs: Any) -> None:
+        self.messages.append(text)
+
+
+class _Message:
+    class from_user:  # noqa: N801
+        id = 1
+
+
+def run_suite(*, submits: int, authors: int, parse_rows: int, repeat: int, seed: int) -> Dict[str, Any]:
+    dataset = SyntheticDataset(submits=submits, authors=authors, seed=seed)
+    parser = TimusParser()
+    results: Dict[str, Dict[str, float]] = {}
+
+    status_page = dataset.status_page(parse_rows)
+    results['parse_submits'] = measure(lambda: parser.parse_submits(status_page), repeat, items=parse_rows)
+    problemset_page = dataset.problemset_page()
+    results['parse_problems'] = measure(lambda: parser.parse_problems(problemset_page), repeat, items=dataset.problems)
+    problem_pages = [dataset.problem_page(FIRST_PROBLEM + i) for i in range(min(parse_rows, dataset.problems))]
+    results['parse_problem'] = measure(
+        lambda: [parser.parse_problem(page) for page in problem_pages], repeat, items=len(problem_pages)
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        DBSettings(url=f'sqlite:///{Path(directory) / "bench.sqlite"}').setup_db()
+        storage = SubmitStorage()
+
+        def _insert() -> None:
+            for chunk in dataset.iter_submits(chunk_size=1000):
+                storage.batch_create(chunk)
+
+        results['batch_create'] = measure(_insert, 1, items=submits)
+
+        results['iter_rows'] = measure(lambda: sum(len(chunk) for chunk in storage.iter_rows()), 1, items=submits)
+
+        author = dataset.heaviest_author
+        author_submits = storage.get_all_by_author(author)
+        results['get_all_by_author'] = measure(
+            lambda: storage.get_all_by_author(author), repeat, items=len(author_submits)
+        )
+
+        accepted = [submit for submit in author_submits if submit.verdict == Verdict.ACCEPTED]
+        results['to_unique_interactions'] = measure(
+            lambda: to_unique_interactions(accepted), repeat, items=len(accepted)
+        )
+
+        results['get_accepted_interactions'] = measure(
+            lambda: storage.get_accepted_interactions(author), repeat, items=len(accepted)
+        )
+
+        UserStorage().create_or_update(user_id=1, timus_id=author)
+        sync_settings = SyncSettings()
+        client: Any = _OfflineClient()
+        sync_state_storage = SyncStateStorage()
+        backfiller = Backfiller(sync_settings, storage, sync_state_storage, client)
+        bot: Any = _RecordingBot()
+        model = ModelHolder()
+        fallback = ComplexityRecommender(
+            np.arange(FIRST_PROBLEM, FIRST_PROBLEM + dataset.problems), np.arange(dataset.problems)
+        )
+        model.set(fallback)
+        handler = RecommendHandler(
+            bot,
+            user_storage=UserStorage(),
+            submit_storage=storage,
+            submit_syncer=SubmitSyncer(sync_settings, storage, sync_state_storage, client, backfiller),
+            model=model,
+            fallback=fallback,
+            cold_start_threshold=5,
+            recommendations_count=10,
+        )
+        message: Any = _Message()
+        results['recommend_handler'] = measure(lambda: handler(message), repeat, items=1)
+        metadata.bind.dispose()
+
+    return {
+        'format_version': FORMAT_VERSION,
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'params': {'submits': submits, 'authors': authors, 'parse_rows': parse_rows, 'repeat': repeat, 'seed': seed},
+        'results': results,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Returns descriptions of the benchmarks whose median got slower than the baseline by more than tolerance."""
+    regressions = []
+    for name, result in current['results'].items():
+        previous = baseline['results'].get(name)
+        if previous is None or not previous['median_s']:
+            continue
+        ratio = result['median_s'] / previous['median_s']
+        if ratio > 1 + tolerance:
+            regressions.append(f"{name}: {previous['median_s']:.6f}s -> {result['median_s']:.6f}s ({ratio:.2f}x)")
+    return regressions
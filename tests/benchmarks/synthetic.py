@@ -0,0 +1,153 @@
+import datetime
+from typing import Dict, Iterator, List
+
+import numpy as np
+
+from src.loader import TimusAPISubmit, Verdict
+
+VERDICTS = [
+    (Verdict.ACCEPTED, 0.42),
+    (Verdict.WRONG_ANSWER, 0.30),
+    (Verdict.TIME_LIMIT_EXCEEDED, 0.10),
+    (Verdict.COMPILATION_ERROR, 0.07),
+    (Verdict.RUNTIME_ERROR_ACCESS_VIOLATION, 0.06),
+    (Verdict.MEMORY_LIMIT_EXCEEDED, 0.05),
+]
+LANGUAGES = ['G++ 9.2 x64', 'Visual C++ 2019', 'Python 3.8 x64', 'Java 1.8', 'FreePascal 3.0', 'C# .NET Core 3.1']
+FIRST_PROBLEM = 1000
+FIRST_SUBMIT_ID = 5_000_000
+START_DATE = datetime.datetime(2010, 1, 1, tzinfo=datetime.timezone.utc)
+STATEMENT_WORDS = ['graph', 'tree', 'string', 'number', 'matrix', 'path', 'game', 'prime', 'segment', 'query']
+
+
+def _power_law_weights(size: int, exponent: float) -> np.ndarray:
+    weights = 1 / np.arange(1, size + 1) ** exponent
+    return weights / weights.sum()
+
+
+class SyntheticDataset:
+    """Deterministic Timus-like submit history.
+
+    Both authors and problems follow a power law: a few authors send most of the submits and easy problems are
+    tried far more often than hard ones. Columns are generated chunk by chunk, so the size of the history is only
+    limited by the time spent consuming it.
+    """
+
+    def __init__(
+        self,
+        *,
+        submits: int,
+        authors: int,
+        problems: int = 1100,
+        seed: int = 0,
+        author_exponent: float = 1.1,
+        problem_exponent: float = 0.9,
+    ):
+        self.submits = submits
+        self.authors = authors
+        self.problems = problems
+        self.seed = seed
+        self._author_weights = _power_law_weights(authors, author_exponent)
+        self._problem_weights = _power_law_weights(problems, problem_exponent)
+        # Author and problem ranks are shuffled so that popularity does not correlate with ids
+        rng = np.random.default_rng(seed)
+        self._author_ids = rng.permutation(authors) + 1
+        self._problem_ids = rng.permutation(problems) + FIRST_PROBLEM
+
+    @property
+    def heaviest_author(self) -> int:
+        return int(self._author_ids[0])
+
+    def iter_columns(self, chunk_size: int) -> Iterator[Dict[str, np.ndarray]]:
+        """Yields chunks of submit columns, the newest submit first, like textstatus.aspx pages."""
+        verdict_values = np.array([verdict.value for verdict, _ in VERDICTS])
+        verdict_weights = np.array([weight for _, weight in VERDICTS])
+        languages = np.array(LANGUAGES)
+        for chunk_index, start in enumerate(range(0, self.submits, chunk_size)):
+            size = min(chunk_size, self.submits - start)
+            rng = np.random.default_rng([self.seed, chunk_index])
+            submit_ids = FIRST_SUBMIT_ID + self.submits - start - np.arange(size)
+            yield {
+                'submit_id': submit_ids,
+                'date': submit_ids - FIRST_SUBMIT_ID,
+                'author_id': self._author_ids[rng.choice(self.authors, size=size, p=self._author_weights)],
+                'problem': self._problem_ids[rng.choice(self.problems, size=size, p=self._problem_weights)],
+                'language': languages[rng.integers(languages.size, size=size)],
+                'verdict': verdict_values[rng.choice(verdict_values.size, size=size, p=verdict_weights)],
+                'test': rng.integers(1, 50, size=size),
+                'runtime_ms': np.minimum(rng.lognormal(4, 1.2, size=size), 15000).astype(np.int64),
+                'memory_kb': np.minimum(rng.lognormal(7, 1.5, size=size), 262144).astype(np.int64),
+            }
+
+    def iter_submits(self, chunk_size: int) -> Iterator[List[TimusAPISubmit]]:
+        for columns in self.iter_columns(chunk_size):
+            yield [
+                TimusAPISubmit(
+                    submit_id=submit_id,
+                    date=START_DATE + datetime.timedelta(minutes=int(minutes)),
+                    author_id=author_id,
+                    problem=problem,
+                    language=language,
+                    verdict=verdict,
+                    test=test,
+                    runtime_ms=runtime_ms,
+                    memory_kb=memory_kb,
+                )
+                for submit_id, minutes, author_id, problem, language, verdict, test, runtime_ms, memory_kb in zip(
+                    *(column.tolist() for column in columns.values())
+                )
+            ]
+
+    def status_page(self, count: int) -> str:
+        """Renders the newest count submits the way textstatus.aspx does."""
+        lines = ['submit\tdate\tauthor\tname\tproblem\tlanguage\tverdict\ttest\truntime\tmemory']
+        for columns in self.iter_columns(count):
+            for submit_id, minutes, author_id, problem, language, verdict, test, runtime_ms, memory_kb in zip(
+                *(column.tolist() for column in columns.values())
+            ):
+                date = START_DATE + datetime.timedelta(minutes=minutes)
+                lines.append(
+                    f'{submit_id}\t{date:%Y-%m-%dT%H:%M:%S}\t{author_id}\tuser{author_id}\t{problem}\t{language}'
+                    f'\t{verdict}\t{test}\t{runtime_ms}\t{memory_kb}'
+                )
+            break
+        return '\r\n'.join(lines) + '\r\n'
+
+    def problemset_page(self) -> bytes:
+        """Renders problemset.aspx?page=all with one row per problem."""
+        rng = np.random.default_rng(self.seed)
+        rows = [
+            '<tr class="content"><td></td><td>ID</td><td>Title</td><td></td><td>Solved</td><td>Difficulty</td></tr>'
+        ]
+        for problem, solutions, difficulty in zip(
+            sorted(self._problem_ids.tolist()),
+            rng.integers(1, 100_000, size=self.problems).tolist(),
+            rng.integers(15, 2000, size=self.problems).tolist(),
+        ):
+            rows.append(
+                f'<tr class="content"><td></td><td>{problem}</td><td><a href="problem.aspx?num={problem}">'
+                f'Problem {problem}</a></td><td></td><td>{solutions}</td><td>{difficulty}</td></tr>'
+            )
+        return (
+            '<html><head><title>Problem set</title></head><body><table class="navbar"><tr><td>Timus</td></tr></table>'
+            f'<table class="problemset">{"".join(rows)}</table></body></html>'
+        ).encode()
+
+    def problem_page(self, number: int) -> bytes:
+        """Renders problem.aspx for a problem, with the page chrome and the difficulty around the statement."""
+        rng = np.random.default_rng(self.seed + number)
+        paragraphs = ''.join(
+            f'<p class="problem_par">{" ".join(rng.choice(STATEMENT_WORDS, size=60).tolist())}</p>' for _ in range(8)
+        )
+        return (
+            f'<html><head><title>{number}. Problem {number} @ Timus Online Judge</title></head><body>'
+            '<table class="navbar"><tr><td><a href="/">Timus</a></td></tr></table>'
+            f'<h2 class="problem_title">{number}. Problem {number}</h2>'
+            '<div class="problem_limits">Time limit: 1.0 second<br>Memory limit: 64 MB<br></div>'
+            f'<div id="problem_text">{paragraphs}<h3 class="problem_subtitle">Sample</h3>'
+            '<table class="sample"><tr><td><pre class="intable">1 2</pre></td></tr></table></div>'
+            '<div class="problem_source"><b>Problem Author: </b>Synthetic</div>'
+            f'<div class="problem_links"><span>Difficulty: {int(rng.integers(15, 2000))}</span>'
+            f' <a href="submit.aspx?num={number}">Submit solution</a></div>'
+            '<div class="copyright">&copy; Timus</div></body></html>'
+        ).encode()
@@ -0,0 +1,12 @@
+import pytest
+
+from src.config import DBSettings
+
+
+@pytest.fixture()
+def database():
+    DBSettings(url='sqlite://').setup_db()
+    yield
+    from db import metadata
+
+    metadata.drop_all()
@@ -0,0 +1,39 @@
+import json
+
+import numpy as np
+
+from src.loader import TimusParser
+from tests.benchmarks.suite import compare, run_suite
+from tests.benchmarks.synthetic import SyntheticDataset
+
+
+def test_synthetic_dataset_is_deterministic():
+    first = list(SyntheticDataset(submits=250, authors=20, seed=3).iter_columns(100))
+    second = list(SyntheticDataset(submits=250, authors=20, seed=3).iter_columns(100))
+
+    assert [len(chunk['submit_id']) for chunk in first] == [100, 100, 50]
+    for left, right in zip(first, second):
+        for name in left:
+            np.testing.assert_array_equal(left[name], right[name])
+
+
+def test_synthetic_pages_are_parsable():
+    dataset = SyntheticDataset(submits=100, authors=10)
+    parser = TimusParser()
+
+    submits = parser.parse_submits(dataset.status_page(30))
+    problems = parser.parse_problems(dataset.problemset_page())
+
+    assert [submit.submit_id for submit in submits] == [submit.submit_id for submit in next(dataset.iter_submits(30))]
+    assert len(problems) == dataset.problems
+
+
+def test_suite_runs_and_flags_regressions():
+    report = run_suite(submits=2000, authors=50, parse_rows=50, repeat=1, seed=0)
+    json.dumps(report)
+
+    assert compare(report, report, tolerance=0.2) == []
+    slower = {
+        'results': {name: {**result, 'median_s': result['median_s'] * 2} for name, result in report['results'].items()}
+    }
+    assert len(compare(slower, report, tolerance=0.2)) == len(report['results'])
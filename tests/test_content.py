@@ -0,0 +1,54 @@
+import numpy as np
+
+from src.content import ContentBlendRecommender, ContentNeighbours, build_content_index
+from src.recommenders import IRecommender
+from src.storage import Interactions
+from src.timing import PhaseTimer
+
+STATEMENTS = [
+    (1000, 'Sum', '<p>Find the sum of two integer numbers a and b.</p>', 100_000),
+    (1001, 'Sum of numbers', '<p>Find the sum of many integer numbers.</p>', 5),
+    (1002, 'Shortest path', '<p>Find the shortest path in a weighted graph between two vertices.</p>', 50_000),
+    (1003, 'Graph paths', '<p>Count shortest paths between vertices of a graph.</p>', 3),
+    (1004, 'Strings', '<p>Reverse every word of a string.</p>', 20_000),
+]
+
+
+class _FixedRecommender(IRecommender):
+    def __init__(self, problems):
+        self._problems = problems
+
+    def recommend(self, interactions, k):
+        return self._problems[:k]
+
+
+def _interactions(problem_ids):
+    problem_ids = np.array(problem_ids, dtype=np.int64)
+    return Interactions(np.arange(problem_ids.size), np.ones(problem_ids.size, dtype=np.int64), problem_ids)
+
+
+def test_content_neighbours_are_built_and_memory_mapped(tmp_path):
+    manifest = build_content_index(
+        STATEMENTS, tmp_path, components=4, neighbours=2, max_features=100, min_df=1, timer=PhaseTimer('test')
+    )
+    content = ContentNeighbours.load(tmp_path)
+
+    assert manifest['data']['problems'] == len(content) == 5
+    neighbours, scores = content.get(np.array([1002, 1000, 9999]))
+    assert isinstance(np.load(tmp_path / 'neighbours.npy', mmap_mode='r'), np.memmap)
+    assert neighbours[:, 0].tolist() == [1003, 1001]
+    assert np.all(np.diff(scores, axis=1) <= 0)
+    assert content.solutions(np.array([1001, 9999])).tolist() == [5, 0]
+
+
+def test_blend_reserves_slots_for_cold_neighbours(tmp_path):
+    build_content_index(
+        STATEMENTS, tmp_path, components=4, neighbours=2, max_features=100, min_df=1, timer=PhaseTimer('test')
+    )
+    recommender = ContentBlendRecommender(
+        _FixedRecommender([1004, 1002, 1001]), ContentNeighbours.load(tmp_path), cold_solutions=10, cold_slots=1
+    )
+
+    assert recommender.recommend(_interactions([1000]), k=3) == [1004, 1002, 1001]
+    assert recommender.recommend(_interactions([1002]), k=3) == [1004, 1002, 1003]
+    assert recommender.recommend(_interactions([1000, 1002]), k=5) == [1004, 1002, 1001, 1003]
@@ -0,0 +1,85 @@
+import datetime
+
+import numpy as np
+import pytest
+
+import db
+from src.cooccurrence import CooccurrenceRecommender, CooccurrenceStorage, Similarity, count_pairs
+from src.loader import TimusAPISubmit
+from src.storage import Interactions, SubmitStorage
+from src.training import load_unique_interactions
+
+
+def make_submit(submit_id, author_id, problem, verdict='Accepted'):
+    return TimusAPISubmit(
+        submit_id=submit_id,
+        date=datetime.datetime(2021, 1, 1),
+        author_id=author_id,
+        problem=problem,
+        language='C++',
+        verdict=verdict,
+        test=0,
+        runtime_ms=1,
+        memory_kb=1,
+    )
+
+
+def read_counts():
+    with db.create_session() as session:
+        solvers = {row.timus_problem_id: row.solvers for row in session.query(db.ProblemSolvers)}
+        pairs = {(row.first_problem_id, row.second_problem_id): row.solvers for row in session.query(db.ProblemPair)}
+    return solvers, pairs
+
+
+def test_count_pairs_merges_chunks_of_authors():
+    rng = np.random.default_rng(2)
+    rows = {(int(rng.integers(30)), 1000 + int(rng.integers(20))) for _ in range(300)}
+    author_ids, problem_ids = (np.array(column, dtype=np.int64) for column in zip(*sorted(rows)))
+    interactions = Interactions(np.arange(author_ids.size), author_ids, problem_ids)
+    expected = {}
+    for author_id in set(author_ids.tolist()):
+        solved = sorted(problem_ids[author_ids == author_id].tolist())
+        for i, first in enumerate(solved):
+            for second in solved[i + 1 :]:
+                expected[first, second] = expected.get((first, second), 0) + 1
+
+    problems, solvers, first, second, pair_solvers = count_pairs(interactions, pairs_per_chunk=50)
+
+    assert dict(zip(problems.tolist(), solvers.tolist())) == dict(zip(*np.unique(problem_ids, return_counts=True)))
+    assert dict(zip(zip(first.tolist(), second.tolist()), pair_solvers.tolist())) == expected
+
+
+@pytest.mark.usefixtures('database')
+def test_incremental_counts_match_rebuild():
+    rng = np.random.default_rng(0)
+    submits = [
+        make_submit(submit_id, int(rng.integers(5)), 1000 + int(rng.integers(8)), 'Accepted' if submit_id % 3 else 'WA')
+        for submit_id in range(1, 120)
+    ]
+    storage = CooccurrenceStorage()
+    submit_storage = SubmitStorage(listeners=[storage])
+    for start in range(0, len(submits), 7):
+        submit_storage.batch_create(submits[start : start + 7])
+    incremental = read_counts()
+
+    storage.rebuild(load_unique_interactions(SubmitStorage(), chunk_size=50)[0])
+
+    assert read_counts() == incremental
+
+
+@pytest.mark.usefixtures('database')
+def test_recommender_refreshes_only_changed_problems():
+    storage = CooccurrenceStorage()
+    submit_storage = SubmitStorage(listeners=[storage])
+    submit_storage.batch_create(
+        [make_submit(1, 1, 1000), make_submit(2, 1, 1001), make_submit(3, 2, 1000), make_submit(4, 2, 1002)]
+    )
+    recommender = CooccurrenceRecommender(storage, Similarity.JACCARD, neighbours=10)
+    user = Interactions(np.array([10]), np.array([3]), np.array([1000]))
+
+    assert recommender.recommend(user, k=5) == [1001, 1002]
+
+    submit_storage.batch_create([make_submit(5, 3, 1000), make_submit(6, 3, 1002)])
+
+    assert recommender.recommend(user, k=5) == [1002, 1001]
+    assert recommender.recommend(Interactions(np.array([]), np.array([]), np.array([])), k=5) == []
@@ -0,0 +1,94 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from src.evaluation import Holdout, evaluate, prepare_recommender, score, split_by_author, time_based_holdout
+from src.storage import Interactions
+
+COMPLEXITIES = Path(__file__).parent.parent / 'compexities.csv'
+
+
+def make_interactions(rows):
+    submit_ids, author_ids, problem_ids = (np.array(column, dtype=np.int64) for column in zip(*rows))
+    return Interactions(submit_ids, author_ids, problem_ids)
+
+
+def compute_apk(y_true, y_pred, k):
+    actual = set(y_true)
+    n_hit = 0
+    precision = 0
+    for i, p in enumerate(y_pred, 1):
+        if p in actual:
+            n_hit += 1
+            precision += n_hit / i
+    return precision / min(len(actual), k)
+
+
+def test_score_matches_reference_apk():
+    test = make_interactions([(10, 1, 1001), (11, 1, 1003), (12, 2, 1005)])
+    holdout = Holdout(train=test, test=test, authors=np.array([1, 2]), catalogue_size=10, history=test, cutoff=9)
+    recommendations = np.array([[1003, 1002, 1001], [1004, 1005, -1]])
+
+    metrics = score(recommendations, holdout, k=3)
+
+    expected = (compute_apk([1001, 1003], [1003, 1002, 1001], 3) + compute_apk([1005], [1004, 1005], 3)) / 2
+    assert metrics['map_at_k'] == pytest.approx(expected)
+    assert metrics['recall_at_k'] == pytest.approx(1.0)
+    assert metrics['coverage'] == pytest.approx(0.5)
+
+
+def test_time_based_holdout_is_deterministic():
+    rows = [(submit_id, submit_id % 5, 1000 + submit_id % 37) for submit_id in range(1, 200)]
+    interactions = make_interactions(rows)
+
+    first = time_based_holdout(interactions, holdout_fraction=0.2, min_train_problems=3, max_users=3)
+    second = time_based_holdout(interactions, holdout_fraction=0.2, min_train_problems=3, max_users=3)
+
+    assert first.authors.tolist() == second.authors.tolist()
+    assert first.authors.size == 3
+    assert first.train.submit_ids.max() < first.test.submit_ids.min()
+
+
+def test_split_by_author():
+    interactions = make_interactions([(1, 2, 1000), (2, 1, 1001), (3, 2, 1002)])
+
+    per_author = split_by_author(interactions, np.array([1, 2]))
+
+    assert [part.problem_ids.tolist() for part in per_author] == [[1001], [1000, 1002]]
+
+
+def test_evaluate_complexity_baseline_in_process_pool():
+    rows = [(submit_id, submit_id % 4, 1000 + submit_id // 4) for submit_id in range(200)]
+    holdout = time_based_holdout(make_interactions(rows), holdout_fraction=0.1, min_train_problems=1, max_users=None)
+
+    report = evaluate(f'complexity:{COMPLEXITIES}', holdout, k=10, batch_size=2, workers=2)
+
+    assert report.users == 4
+    assert 0 <= report.map_at_k <= 1
+    assert report.latency_p99_ms >= report.latency_p50_ms
+
+
+def test_cooccurrence_is_counted_from_history_only(tmp_path):
+    rows = [(1, 1, 1000), (2, 1, 1001), (3, 2, 1000), (4, 2, 1001), (5, 3, 1000), (6, 3, 1002), (7, 2, 1002)]
+    holdout = time_based_holdout(make_interactions(rows), holdout_fraction=0.3, min_train_problems=1, max_users=None)
+    assert holdout.cutoff == 5
+
+    recommender = prepare_recommender('cooccurrence', holdout, tmp_path)()
+
+    assert recommender.recommend(make_interactions([(10, 4, 1000)]), k=5) == [1001]
+
+
+def test_saved_model_must_be_trained_before_cutoff(tmp_path):
+    rows = [(submit_id, submit_id % 3, 1000 + submit_id) for submit_id in range(1, 101)]
+    holdout = time_based_holdout(make_interactions(rows), holdout_fraction=0.1, min_train_problems=1, max_users=None)
+    model_path = tmp_path / 'version' / 'model'
+    model_path.mkdir(parents=True)
+
+    with pytest.raises(ValueError, match='manifest'):
+        prepare_recommender(f'turicreate:{model_path}', holdout, tmp_path)
+
+    (model_path.parent / 'manifest.json').write_text(json.dumps({'data': {'max_submit_id': 100}}))
+    with pytest.raises(ValueError, match='after the cutoff'):
+        prepare_recommender(f'turicreate:{model_path}', holdout, tmp_path)
@@ -0,0 +1,158 @@
+import datetime
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+from src.handlers import RecommendHandler, TrendingHandler
+from src.loader import TimusAPISubmit
+from src.popularity import PopularityStorage
+from src.recommenders import ComplexityRecommender, IRecommender
+from src.storage import ProblemStorage, SubmitStorage, UserStorage
+from src.warmup import ModelHolder
+
+TELEGRAM_ID = 1
+AUTHOR_ID = 248409
+
+
+class FakeBot:
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, chat_id, text):
+        self.messages.append(text)
+
+    def reply_to(self, message, text):
+        self.messages.append(text)
+
+
+class FakeSyncer:
+    def sync(self, user):
+        pass
+
+
+class FixedRecommender(IRecommender):
+    def __init__(self, problems):
+        self._problems = problems
+
+    def recommend(self, interactions, k):
+        return self._problems[:k]
+
+
+class BrokenRecommender(IRecommender):
+    def recommend(self, interactions, k):
+        raise RuntimeError('model is broken')
+
+
+def make_handler(bot, model):
+    fallback = ComplexityRecommender.from_pairs([(1000, 1), (1001, 2), (1002, 3), (1003, 4)])
+    return RecommendHandler(
+        bot,
+        UserStorage(),
+        SubmitStorage(),
+        FakeSyncer(),
+        model,
+        fallback,
+        cold_start_threshold=2,
+        recommendations_count=2,
+    )
+
+
+def solve(*problems, listeners=()):
+    SubmitStorage(listeners=listeners).batch_create(
+        [
+            TimusAPISubmit(
+                submit_id=submit_id,
+                date=datetime.datetime(2021, 1, 1),
+                author_id=AUTHOR_ID,
+                problem=problem,
+                language='C++',
+                verdict='Accepted',
+                test=0,
+                runtime_ms=15,
+                memory_kb=100,
+            )
+            for submit_id, problem in enumerate(problems, start=1)
+        ]
+    )
+
+
+def ready(model):
+    holder = ModelHolder()
+    holder.set(model)
+    return holder
+
+
+@pytest.fixture()
+def message():
+    UserStorage().create_or_update(TELEGRAM_ID, AUTHOR_ID)
+    return SimpleNamespace(from_user=SimpleNamespace(id=TELEGRAM_ID))
+
+
+@pytest.mark.usefixtures('database')
+def test_cold_start_user_gets_fallback(message):
+    bot = FakeBot()
+    solve(1000)
+
+    make_handler(bot, ready(FixedRecommender([2000, 2001])))(message)
+
+    assert bot.messages[-1].splitlines()[1:] == ['1001', '1002']
+
+
+@pytest.mark.usefixtures('database')
+def test_warming_up_model_is_answered_by_fallback(message):
+    bot = FakeBot()
+    solve(1000, 1001)
+
+    make_handler(bot, ModelHolder())(message)
+
+    assert bot.messages[-1].splitlines()[1:] == ['1002', '1003']
+
+
+@pytest.mark.usefixtures('database')
+def test_failed_warm_up_leaves_the_fallback_answering(message, caplog):
+    bot = FakeBot()
+    solve(1000, 1001)
+    holder = ModelHolder()
+
+    def _load():
+        raise RuntimeError('model file is missing')
+
+    with caplog.at_level(logging.ERROR, logger='src.warmup'):
+        holder.warm_up_in_background(_load).join(timeout=5)
+    make_handler(bot, holder)(message)
+
+    assert bot.messages[-1].splitlines()[1:] == ['1002', '1003']
+    assert 'Model warm-up failed' in caplog.messages
+
+
+@pytest.mark.usefixtures('database')
+def test_ready_model_answers_known_user(message):
+    bot = FakeBot()
+    solve(1000, 1001)
+
+    make_handler(bot, ready(FixedRecommender([2000, 2001, 2002])))(message)
+
+    assert bot.messages[-1].splitlines()[1:] == ['2000', '2001']
+
+
+@pytest.mark.usefixtures('database')
+def test_model_failure_falls_back(message):
+    bot = FakeBot()
+    solve(1000, 1001)
+
+    make_handler(bot, ready(BrokenRecommender()))(message)
+
+    assert bot.messages[-1].splitlines()[1:] == ['1002', '1003']
+
+
+@pytest.mark.usefixtures('database')
+def test_trending_shows_solvers_and_medians(message):
+    bot = FakeBot()
+    popularity_storage = PopularityStorage(clock=lambda: datetime.date(2021, 1, 2))
+    solve(1000, 1000, 1001, listeners=[popularity_storage])
+
+    TrendingHandler(bot, popularity_storage, ProblemStorage(), days=7, limit=1)(message)
+
+    # Medians are interpolated inside histogram buckets, the exact runtime and memory are 15 ms and 100 KB
+    assert bot.messages[-1].splitlines()[1:] == ['1000.  — решили 1, медиана 14 мс, 94 КБ']
@@ -0,0 +1,168 @@
+import multiprocessing
+import queue
+import threading
+
+import pytest
+
+import db
+from src.ingestion import (
+    IngestionCursorStorage,
+    IngestionSettings,
+    IngestionWriter,
+    Producer,
+    ProducerFailed,
+    SubmitBatch,
+)
+from src.storage import SubmitStorage
+from tests.benchmarks.synthetic import SyntheticDataset
+
+
+def _batches(space, submits, batch_size):
+    return [SubmitBatch(space, submits[start : start + batch_size]) for start in range(0, len(submits), batch_size)]
+
+
+def _newest_first(submits=200, seed=0):
+    chunks = SyntheticDataset(submits=submits, authors=10, seed=seed).iter_submits(chunk_size=submits)
+    return sorted(next(chunks), key=lambda submit: -submit.submit_id)
+
+
+def _produce(messages, space, submits):
+    for batch in _batches(space, submits, 10):
+        messages.put(batch)
+    messages.put(SubmitBatch(space, [], done=True))
+
+
+@pytest.mark.usefixtures('database')
+def test_writer_merges_batches_of_several_producers_into_large_transactions():
+    main = _newest_first()
+    other = [submit.copy(update={'submit_id': submit.submit_id + 10_000}) for submit in _newest_first(seed=1)]
+    cursors = IngestionCursorStorage()
+    for space in (1, 2):
+        cursors.get_or_create(space)
+    messages: 'queue.Queue' = queue.Queue(maxsize=4)
+    producers = [
+        threading.Thread(target=_produce, args=(messages, space, submits)) for space, submits in ((1, main), (2, other))
+    ]
+    commits = []
+    writer = IngestionWriter(
+        SubmitStorage(), IngestionSettings(commit_size=150, max_latency=60), cursors, on_commit=commits.append
+    )
+
+    for producer in producers:
+        producer.start()
+    result = writer.run(messages, [Producer(1), Producer(2)])
+    for producer in producers:
+        producer.join()
+
+    assert result.saved == {1: 200, 2: 200} and result.failed == {}
+    assert len(commits) == 3
+    assert len(SubmitStorage().get_all()) == 400
+    assert cursors.get_or_create(1).stop_at == main[0].submit_id
+    assert cursors.get_or_create(2).next_from is None
+
+
+@pytest.mark.usefixtures('database')
+def test_failed_run_resumes_after_the_last_committed_batch():
+    submits = _newest_first()
+    cursors = IngestionCursorStorage()
+    cursors.get_or_create(1)
+    writer = IngestionWriter(SubmitStorage(), IngestionSettings(commit_size=1, max_latency=60), cursors)
+    messages: 'queue.Queue' = queue.Queue()
+    for batch in _batches(1, submits[:120], 40):
+        messages.put(batch)
+    messages.put(ProducerFailed(1, 'ConnectionError()'))
+
+    assert writer.run(messages, [Producer(1)]).failed == {1: 'ConnectionError()'}
+    cursor = cursors.get_or_create(1)
+    assert (cursor.stop_at, cursor.next_from) == (None, submits[119].submit_id - 1)
+
+    resumed = [submit for submit in submits if submit.submit_id <= cursor.next_from]
+    for batch in _batches(1, resumed, 40):
+        messages.put(batch)
+    messages.put(SubmitBatch(1, [], done=True))
+
+    assert writer.run(messages, [Producer(1)]).saved == {1: 80}
+    cursor = cursors.get_or_create(1)
+    assert (cursor.stop_at, cursor.next_from, cursor.run_top) == (submits[0].submit_id, None, None)
+
+
+@pytest.mark.usefixtures('database')
+def test_writer_commits_within_the_latency_bound():
+    submits = _newest_first(20)
+    committed = threading.Event()
+    messages: 'queue.Queue' = queue.Queue()
+    IngestionCursorStorage().get_or_create(1)
+    writer = IngestionWriter(
+        SubmitStorage(),
+        IngestionSettings(commit_size=1000, max_latency=0.05),
+        on_commit=lambda saved: committed.set(),
+    )
+
+    def _slow_producer():
+        messages.put(SubmitBatch(1, submits))
+        assert committed.wait(timeout=5)
+        messages.put(SubmitBatch(1, [], done=True))
+
+    producer = threading.Thread(target=_slow_producer)
+    producer.start()
+    assert writer.run(messages, [Producer(1)]).saved == {1: 20}
+    producer.join()
+    assert committed.is_set()
+
+
+@pytest.mark.usefixtures('database')
+def test_writer_stops_when_producer_processes_die():
+    context = multiprocessing.get_context('fork')
+    messages = context.Queue()
+    IngestionCursorStorage().get_or_create(1)
+    producer = context.Process(target=_produce, args=(messages, 1, _newest_first(30)))
+    producer.start()
+    producer.join()
+
+    result = IngestionWriter(SubmitStorage(), IngestionSettings()).run(
+        messages, [Producer(1), Producer(2)], alive=lambda: producer.is_alive()
+    )
+
+    assert result.saved == {1: 30}
+    assert result.failed == {2: 'producer exited without finishing'}
+    with db.create_session() as session:
+        assert session.query(db.IngestionCursor).filter_by(space=1).one().stop_at is not None
+
+
+def _produce_shard(messages, shard, submits):
+    in_range = [submit for submit in submits if shard.low < submit.submit_id <= (shard.next_from or shard.high)]
+    for start in range(0, len(in_range), 10):
+        messages.put(SubmitBatch(1, in_range[start : start + 10], shard=shard.id))
+    messages.put(SubmitBatch(1, [], done=True, shard=shard.id))
+
+
+@pytest.mark.usefixtures('database')
+def test_sharded_run_completes_once_every_shard_is_committed():
+    submits = _newest_first()
+    top = submits[0].submit_id
+    cursors = IngestionCursorStorage()
+    cursors.get_or_create(1)
+    writer = IngestionWriter(SubmitStorage(), IngestionSettings(commit_size=25, max_latency=60), cursors)
+    shards = cursors.create_shards(1, top, 3)
+    messages: 'queue.Queue' = queue.Queue()
+
+    _produce_shard(messages, shards[0], submits)
+    messages.put(ProducerFailed(1, 'ConnectionError()', shard=shards[1].id))
+    result = writer.run(messages, [Producer(1, shard.id) for shard in shards[:2]])
+
+    assert result.failed == {1: 'ConnectionError()'}
+    assert [shard.id for shard in cursors.get_shards(1)] == [shard.id for shard in shards[1:]]
+    assert cursors.get_or_create(1).stop_at is None
+
+    remaining = cursors.get_shards(1)
+    producers = [threading.Thread(target=_produce_shard, args=(messages, shard, submits)) for shard in remaining]
+    for producer in producers:
+        producer.start()
+    writer.run(messages, [Producer(1, shard.id) for shard in remaining])
+    for producer in producers:
+        producer.join()
+
+    assert len(SubmitStorage().get_all()) == 200
+    assert cursors.get_shards(1) == []
+    cursor = cursors.get_or_create(1)
+    assert (cursor.stop_at, cursor.next_from, cursor.run_top) == (top, None, None)
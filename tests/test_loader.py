@@ -0,0 +1,74 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import bs4
+import pytest
+
+from src import loader
+from src.loader import TimusAPIClient, TimusClientSettings, TimusParser
+from src.search import strip_statement
+from tests.benchmarks.synthetic import FIRST_PROBLEM, SyntheticDataset
+
+
+class _Response:
+    def __init__(self, content: bytes):
+        self.content = content
+
+    def raise_for_status(self) -> None:
+        pass
+
+
+class _Session:
+    def __init__(self, dataset: SyntheticDataset):
+        self._dataset = dataset
+
+    def get(self, url, params):
+        return _Response(self._dataset.problem_page(params['num']))
+
+
+@pytest.mark.parametrize('html_parser', [None, 'html.parser'])
+def test_parse_problem_reads_only_the_statement(html_parser):
+    page = SyntheticDataset(submits=10, authors=1).problem_page(FIRST_PROBLEM)
+
+    problem = TimusParser(html_parser).parse_problem(page)
+
+    assert (problem.number, problem.title) == (FIRST_PROBLEM, f'Problem {FIRST_PROBLEM}')
+    assert problem.limits == 'Time limit: 1.0 second\nMemory limit: 64 MB'
+    assert problem.text.startswith('<div id="problem_text"><p class="problem_par">')
+    assert 'navbar' not in problem.text and 'Difficulty' not in problem.text
+    assert 15 <= problem.difficulty < 2000
+    assert problem.search_text == strip_statement(problem.text)
+
+
+def _is_before_4_13():
+    return tuple(int(part) for part in bs4.__version__.split('.')[:2]) < (4, 13)
+
+
+def test_old_beautifulsoup_gets_a_soup_strainer(monkeypatch):
+    monkeypatch.delattr(bs4, 'ElementFilter', raising=False)
+
+    assert isinstance(loader._statement_filter(), bs4.SoupStrainer)
+
+
+@pytest.mark.skipif(not _is_before_4_13(), reason='SoupStrainer name functions get tags since beautifulsoup4 4.13')
+def test_parse_problem_with_soup_strainer_fallback(monkeypatch):
+    monkeypatch.delattr(bs4, 'ElementFilter', raising=False)
+    monkeypatch.setattr(TimusParser, '_statement', loader._statement_filter())
+    page = SyntheticDataset(submits=10, authors=1).problem_page(FIRST_PROBLEM)
+
+    problem = TimusParser('html.parser').parse_problem(page)
+
+    assert (problem.number, problem.limits) == (FIRST_PROBLEM, 'Time limit: 1.0 second\nMemory limit: 64 MB')
+    assert problem.text.startswith('<div id="problem_text"><p class="problem_par">')
+    assert 'navbar' not in problem.text and 'Difficulty' not in problem.text
+
+
+def test_iter_problems_keeps_order_across_processes():
+    dataset = SyntheticDataset(submits=10, authors=1, problems=30)
+    client = TimusAPIClient(TimusClientSettings(fetch_workers=3), _Session(dataset), TimusParser())
+    numbers = [FIRST_PROBLEM + i for i in reversed(range(30))]
+
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        problems = list(client.iter_problems(numbers, parse_executor=executor))
+
+    assert [problem.number for problem in problems] == numbers
+    assert problems == [client.get_problem(number) for number in numbers]
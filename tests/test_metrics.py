@@ -0,0 +1,58 @@
+import urllib.request
+
+import pytest
+
+from src.metrics import STAGE_ERRORS, STAGE_SECONDS, MetricsFileWriter, MetricsServer, Registry, Trace
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    histogram = registry.histogram('latency_seconds', 'Latency.', labels=('stage',), buckets=(0.1, 1))
+    histogram.observe(0.05, 'db')
+    histogram.observe(0.5, 'db')
+    histogram.observe(5, 'db')
+    registry.counter('errors_total', 'Errors.').inc()
+
+    assert registry.render().splitlines() == [
+        '# HELP errors_total Errors.',
+        '# TYPE errors_total counter',
+        'errors_total 1',
+        '# HELP latency_seconds Latency.',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{stage="db",le="0.1"} 1',
+        'latency_seconds_bucket{stage="db",le="1"} 2',
+        'latency_seconds_bucket{stage="db",le="+Inf"} 3',
+        'latency_seconds_sum{stage="db"} 5.55',
+        'latency_seconds_count{stage="db"} 3',
+    ]
+
+
+def test_trace_records_stages_and_errors():
+    trace = Trace('test')
+    with trace.span('ok'):
+        pass
+    with pytest.raises(ValueError):
+        with trace.span('broken'):
+            raise ValueError
+
+    assert [stage for stage, _ in trace.stages] == ['ok', 'broken']
+    assert STAGE_SECONDS.count('test', 'broken') >= 1
+    assert STAGE_ERRORS.get('test', 'broken') >= 1
+    assert STAGE_ERRORS.get('test', 'ok') == 0
+
+
+def test_metrics_are_exported(tmp_path):
+    registry = Registry()
+    registry.counter('requests_total', 'Requests.').inc(amount=3)
+    server = MetricsServer(registry, '127.0.0.1', 0)
+    server.start()
+    try:
+        host, port = server.address
+        with urllib.request.urlopen(f'http://{host}:{port}/metrics') as response:
+            assert 'requests_total 3' in response.read().decode()
+    finally:
+        server.stop()
+
+    path = tmp_path / 'bot.prom'
+    MetricsFileWriter(registry, path, interval=60).flush()
+    assert path.read_text() == registry.render()
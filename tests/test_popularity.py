@@ -0,0 +1,105 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from src.loader import TimusAPISubmit
+from src.popularity import PopularityRecommender, PopularityStorage, histogram, histogram_median
+from src.recommenders import ComplexityRecommender
+from src.storage import Interactions, SubmitStorage
+
+TODAY = datetime.date(2021, 3, 31)
+
+
+def make_submit(submit_id, author_id, problem, days_ago, verdict='Accepted'):
+    return TimusAPISubmit(
+        submit_id=submit_id,
+        date=datetime.datetime.combine(TODAY, datetime.time(12), datetime.timezone.utc)
+        - datetime.timedelta(days=days_ago),
+        author_id=author_id,
+        problem=problem,
+        language='C++',
+        verdict=verdict,
+        test=0,
+        runtime_ms=10 * submit_id,
+        memory_kb=100 + submit_id,
+    )
+
+
+def test_histogram_median_is_close_to_exact():
+    values = np.random.default_rng(0).lognormal(5, 1, size=10_000).astype(np.int64) + 1
+
+    assert histogram_median(histogram(values.tolist())) == pytest.approx(np.median(values), rel=0.1)
+    assert histogram_median(histogram([])) is None
+
+
+@pytest.mark.usefixtures('database')
+def test_incremental_aggregates_match_rebuild():
+    rng = np.random.default_rng(1)
+    submits = [
+        make_submit(
+            submit_id,
+            int(rng.integers(6)),
+            1000 + int(rng.integers(5)),
+            days_ago=(150 - submit_id) // 3,
+            verdict='Accepted' if submit_id % 3 else 'Wrong answer',
+        )
+        for submit_id in range(1, 150)
+    ]
+    storage = PopularityStorage(clock=lambda: TODAY)
+    submit_storage = SubmitStorage(listeners=[storage])
+    for start in range(0, len(submits), 11):
+        submit_storage.batch_create(submits[start : start + 11])
+    incremental = storage.get(list(range(1000, 1006))), storage.trending(7, 10), storage.trending(30, 10)
+
+    assert storage.rebuild() == 5
+    assert (storage.get(list(range(1000, 1006))), storage.trending(7, 10), storage.trending(30, 10)) == incremental
+
+    popularity = incremental[0][1000]
+    accepted = [submit for submit in submits if submit.problem == 1000 and submit.verdict == 'Accepted']
+    assert popularity.accepted == len(accepted)
+    assert popularity.solvers == len({submit.author_id for submit in accepted})
+    assert popularity.solvers_7d <= popularity.solvers_30d <= popularity.solvers
+    assert sum(solvers for _, solvers in incremental[2]) == sum(p.solvers_30d for p in incremental[0].values())
+
+
+@pytest.mark.usefixtures('database')
+def test_backfilled_older_solution_moves_solver_to_its_day():
+    storage = PopularityStorage(clock=lambda: TODAY)
+    submit_storage = SubmitStorage(listeners=[storage])
+    submit_storage.batch_create([make_submit(10, 1, 1000, days_ago=2), make_submit(11, 2, 1001, days_ago=2)])
+    submit_storage.batch_create([make_submit(1, 1, 1000, days_ago=20), make_submit(2, 2, 1001, days_ago=60)])
+    incremental = storage.get([1000, 1001]), storage.trending(7, 10), storage.trending(30, 10)
+
+    assert incremental[1] == []
+    assert incremental[2] == [(1000, 1)]
+    storage.rebuild()
+    assert (storage.get([1000, 1001]), storage.trending(7, 10), storage.trending(30, 10)) == incremental
+
+
+@pytest.mark.usefixtures('database')
+def test_popularity_recommender_skips_solved_and_tops_up():
+    storage = PopularityStorage(clock=lambda: TODAY)
+    SubmitStorage(listeners=[storage]).batch_create(
+        [make_submit(1, 1, 1001, 1), make_submit(2, 2, 1001, 1), make_submit(3, 2, 1002, 2)]
+    )
+    base = ComplexityRecommender.from_pairs([(1000, 1), (1001, 2), (1002, 3), (1003, 4)])
+    recommender = PopularityRecommender(storage, days=7, base=base)
+    solved = Interactions(np.array([1]), np.array([3]), np.array([1002]))
+
+    assert recommender.recommend(solved, 3) == [1001, 1000, 1003]
+
+
+@pytest.mark.usefixtures('database')
+def test_solvers_break_difficulty_ties_of_the_fallback():
+    storage = PopularityStorage(clock=lambda: TODAY)
+    SubmitStorage(listeners=[storage]).batch_create(
+        [make_submit(1, 1, 1003, 1), make_submit(2, 2, 1003, 1), make_submit(3, 1, 1002, 1)]
+    )
+    base = ComplexityRecommender.from_pairs([(1000, 1), (1001, 2), (1002, 2), (1003, 2)])
+
+    ranked = base.with_solvers({problem_id: row.solvers for problem_id, row in storage.get(base.problems).items()})
+
+    assert base.recommend_problems([], 4) == [1000, 1001, 1002, 1003]
+    assert ranked.recommend_problems([], 4) == [1000, 1003, 1002, 1001]
+    assert ranked.recommend_problems([1003], 2) == [1000, 1002]
@@ -0,0 +1,68 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from src.loader import Verdict
+from src.recommenders import ComplexityRecommender, to_unique_interactions
+from src.storage import SubmitStorage
+from tests.benchmarks.synthetic import SyntheticDataset
+
+
+@pytest.fixture()
+def recommender():
+    return ComplexityRecommender.from_pairs([(1000, 16), (1001, 15), (1002, 218), (1003, 380), (1004, 100)])
+
+
+def test_complexity_recommender_new_user(recommender):
+    assert recommender.recommend_problems([], k=3) == [1001, 1000, 1004]
+
+
+def test_complexity_recommender_skips_solved(recommender):
+    assert recommender.recommend_problems([1001, 1004, 1001], k=3) == [1000, 1002, 1003]
+
+
+def test_complexity_recommender_ignores_unknown_problems(recommender):
+    assert recommender.recommend_problems([1, 1000, 5000], k=2) == [1001, 1004]
+
+
+def test_complexity_recommender_everything_solved(recommender):
+    assert recommender.recommend_problems([1000, 1001, 1002, 1003, 1004], k=2) == []
+
+
+def test_complexity_recommender_empty():
+    assert ComplexityRecommender.from_pairs([]).recommend_problems([1000], k=5) == []
+
+
+def test_complexity_recommender_from_csv():
+    recommender = ComplexityRecommender.from_csv(Path(__file__).parent.parent / 'compexities.csv')
+
+    assert len(recommender) > 1000
+    assert recommender.recommend_problems([], k=2) == [1001, 1000]
+
+
+def test_accepted_interactions_keep_first_solution(database):
+    dataset = SyntheticDataset(submits=3000, authors=20, seed=1)
+    storage = SubmitStorage()
+    for chunk in dataset.iter_submits(chunk_size=1000):
+        storage.batch_create(chunk)
+    author = dataset.heaviest_author
+    first_solutions = {}
+    for submit in storage.get_all_by_author(author):
+        if submit.verdict == Verdict.ACCEPTED:
+            first_solutions[submit.problem_id] = min(
+                submit.submit_id, first_solutions.get(submit.problem_id, submit.submit_id)
+            )
+
+    interactions = storage.get_accepted_interactions(author)
+
+    assert len(interactions) == len(first_solutions) > 0
+    assert dict(zip(interactions.problem_ids.tolist(), interactions.submit_ids.tolist())) == first_solutions
+    assert np.all(np.diff(interactions.submit_ids) > 0)
+    assert set(interactions.author_ids.tolist()) == {author}
+    assert set(interactions.problem_ids.tolist()) == set(
+        to_unique_interactions(
+            [submit for submit in storage.get_all_by_author(author) if submit.verdict == Verdict.ACCEPTED]
+        ).problem_ids.tolist()
+    )
+    assert len(storage.get_accepted_interactions(author + 100_000)) == 0
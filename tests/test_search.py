@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+
+import pytest
+
+from src import storage as storage_module
+from src.loader import ProblemModel
+from src.search import NoSearchIndex, SearchUnavailable, get_search_index
+from src.storage import ProblemStorage
+
+
+def _problem(number, title, text):
+    return ProblemModel(
+        number=number,
+        title=title,
+        difficulty=100,
+        solutions=10,
+        limits='Time limit: 1.0 second',
+        text=f'<div id="problem_text">\n <div class="problem_par">\n  {text}\n </div>\n</div>',
+    )
+
+
+@pytest.fixture()
+def storage(database):
+    storage = ProblemStorage()
+    storage.create_or_update(_problem(1000, 'A+B Problem', 'Calculate <b>a + b</b>.'))
+    storage.create_or_update(_problem(1001, 'Reverse Root', 'Print square roots of the numbers in reverse order.'))
+    storage.create_or_update(_problem(1002, 'Phone Numbers', 'Find the shortest sequence of words for a number.'))
+    storage.create_or_update(_problem(1100, 'Дерево отрезков', 'Дано дерево. Ответьте на запросы.'))
+    return storage
+
+
+def test_search_ranks_title_matches_first(storage):
+    assert [result.number for result in storage.search('numbers', limit=10)] == [1002, 1001]
+
+
+def test_search_matches_stripped_statement_prefixes_and_cyrillic(storage):
+    assert [result.number for result in storage.search('calc', limit=10)] == [1000]
+    assert [result.number for result in storage.search('ДЕРЕВО', limit=10)] == [1100]
+    assert storage.search('div', limit=10) == []
+
+
+def test_search_ignores_query_syntax(storage):
+    assert storage.search('"reverse" (order* -', limit=10)[0].number == 1001
+    assert storage.search('!!!', limit=10) == []
+
+
+def test_rebuild_search_index(storage):
+    assert storage.rebuild_search_index() == 4
+    assert [result.number for result in storage.search('root', limit=1)] == [1001]
+
+
+def test_unsupported_backend_only_fails_on_search():
+    session = SimpleNamespace(get_bind=lambda mapper: SimpleNamespace(dialect=SimpleNamespace(name='mysql')))
+    search_index = get_search_index(session)
+
+    assert isinstance(search_index, NoSearchIndex)
+    search_index.index(session, 1000, 'A+B Problem', 'Calculate a + b.')
+    with pytest.raises(SearchUnavailable):
+        search_index.search(session, 'a', limit=10)
+
+
+def test_only_new_and_changed_problems_are_indexed(storage, monkeypatch):
+    indexed = []
+
+    class SpyIndex(NoSearchIndex):
+        def index(self, session, number, title, body):
+            indexed.append(number)
+
+    monkeypatch.setattr(storage_module, 'get_search_index', lambda session: SpyIndex('spy'))
+    storage.create_or_update(_problem(1000, 'A+B Problem', 'Calculate <b>a + b</b>.'))
+    storage.create_or_update(_problem(1003, 'Parity', 'Check the parity.'))
+    storage.create_or_update(_problem(1001, 'Reverse Root', 'Print square roots in reverse order.'))
+
+    assert indexed == [1003, 1001]
@@ -0,0 +1,89 @@
+import pytest
+
+import db
+from src.config import DBSettings
+from src.loader import ProblemModel
+from src.snapshot import SnapshotError, export_snapshot, import_snapshot
+from src.storage import ProblemStorage, SubmitStorage
+from tests.benchmarks.synthetic import SyntheticDataset
+
+
+def _fill() -> None:
+    storage = SubmitStorage()
+    for chunk in SyntheticDataset(submits=300, authors=10).iter_submits(chunk_size=100):
+        storage.batch_create(chunk)
+    (submit,) = next(SyntheticDataset(submits=1, authors=1).iter_submits(chunk_size=1))
+    storage.batch_create([submit.copy(update={'submit_id': 1})], space=2)
+    problem = ProblemModel(number=1000, title='A+B', difficulty=1, solutions=1, limits='', text='<p>sum</p>')
+    ProblemStorage().create_or_update(problem)
+    ProblemStorage().create_or_update(problem.copy(update={'title': 'Other'}), space=2)
+    with db.create_session() as session:
+        session.add(db.TelegramUser(user_id=1, timus_id=31337))
+
+
+def _reset() -> None:
+    db.metadata.drop_all()
+    DBSettings(url='sqlite://').setup_db()
+
+
+def test_snapshot_round_trip(database, tmp_path):
+    _fill()
+    before = SubmitStorage().get_all()
+    path = tmp_path / 'snapshot.bin'
+
+    exported = export_snapshot(path, chunk_size=64)
+    _reset()
+    imported = import_snapshot(path)
+
+    assert exported == imported == {'telegram_user': 1, 'problem': 2, 'problem_statement': 2, 'submit': 301}
+    assert SubmitStorage().get_all() == before
+    assert ProblemStorage().get_by_number_or_none(1000, space=2).title == 'Other'
+    assert ProblemStorage().get_statement_or_none(1000).text == '<p>sum</p>'
+    with db.create_session() as session:
+        assert session.query(db.TelegramUser).one().timus_id == 31337
+
+
+def test_snapshot_import_refuses_non_empty_database(database, tmp_path):
+    _fill()
+    path = tmp_path / 'snapshot.bin'
+    export_snapshot(path, chunk_size=64)
+
+    with pytest.raises(SnapshotError, match='not empty'):
+        import_snapshot(path)
+    assert import_snapshot(path, replace=True)['submit'] == 301
+
+
+def test_snapshot_replace_clears_state_and_search(database, tmp_path):
+    _fill()
+    path = tmp_path / 'snapshot.bin'
+    export_snapshot(path, chunk_size=64)
+    with db.create_session() as session:
+        session.add(db.UserSyncState(timus_user_id=31337, high_watermark=10, backfill_complete=True))
+        session.add(db.IngestionCursor(space=db.MAIN_SPACE, stop_at=10))
+    assert ProblemStorage().search('sum', 10)
+
+    import_snapshot(path, replace=True)
+
+    with db.create_session() as session:
+        assert session.query(db.UserSyncState).count() == 0
+        assert session.query(db.IngestionCursor).count() == 0
+    assert ProblemStorage().search('sum', 10) == []
+    assert ProblemStorage().rebuild_search_index() == 1
+
+
+def test_snapshot_detects_corruption(database, tmp_path):
+    _fill()
+    path = tmp_path / 'snapshot.bin'
+    export_snapshot(path, chunk_size=64)
+    data = bytearray(path.read_bytes())
+    data[-20] ^= 0xFF
+    path.write_bytes(bytes(data))
+    _reset()
+
+    with pytest.raises(SnapshotError, match='Checksum'):
+        import_snapshot(path)
+    assert SubmitStorage().get_all() == []
+
+    path.write_bytes(bytes(data[: len(data) // 2]))
+    with pytest.raises(SnapshotError):
+        import_snapshot(path)
@@ -0,0 +1,161 @@
+import threading
+
+import pytest
+import sqlalchemy as sa
+
+import db
+from src.config import DBSettings
+from src.loader import ProblemModel, Verdict
+from src.storage import DBSubmit, ProblemStorage, SubmitRow, SubmitStorage
+from tests.benchmarks.synthetic import SyntheticDataset
+
+
+def test_iter_all_streams_every_submit_in_order(database):
+    storage = SubmitStorage()
+    for chunk in SyntheticDataset(submits=250, authors=10).iter_submits(chunk_size=100):
+        storage.batch_create(chunk)
+
+    chunks = list(storage.iter_all(chunk_size=100))
+
+    assert [len(chunk) for chunk in chunks] == [100, 100, 50]
+    rows = [row for chunk in chunks for row in chunk]
+    assert all(isinstance(row, SubmitRow) for row in rows)
+    assert [row.submit_id for row in rows] == sorted(row.submit_id for row in rows)
+    assert [DBSubmit(**row._asdict()) for row in rows] == storage.get_all()
+    assert [tuple(row) for row in rows] == [row for chunk in storage.iter_rows(chunk_size=7) for row in chunk]
+
+
+def test_spaces_are_stored_and_read_separately(database):
+    storage = SubmitStorage()
+    main, other = SyntheticDataset(submits=100, authors=5, seed=1), SyntheticDataset(submits=30, authors=5, seed=2)
+    storage.batch_create(next(main.iter_submits(chunk_size=100)))
+    other_submits = [
+        submit.copy(update={'submit_id': submit.submit_id + 1000}) for submit in next(other.iter_submits(chunk_size=30))
+    ]
+    storage.batch_create(other_submits, space=2)
+
+    assert storage.get_last_or_none().submit_id == main.submits + 5_000_000
+    assert storage.get_last_or_none(space=2).submit_id == max(submit.submit_id for submit in other_submits)
+    assert {row.space for chunk in storage.iter_all(space=2) for row in chunk} == {2}
+    assert sum(len(chunk) for chunk in storage.iter_all()) == 130
+    assert sum(len(chunk) for chunk in storage.iter_accepted_interactions(chunk_size=1000, space=2)) == sum(
+        submit.verdict == Verdict.ACCEPTED for submit in other_submits
+    )
+    author = other_submits[0].author_id
+    assert {submit.space for submit in storage.get_all_by_author(author, space=2)} == {2}
+
+
+def test_problem_numbers_are_unique_per_space(database):
+    storage = ProblemStorage()
+    problem = ProblemModel(number=1, title='A', difficulty=1, solutions=1, limits='', text='<p>a</p>')
+
+    storage.create_or_update(problem)
+    storage.create_or_update(problem.copy(update={'title': 'B'}), space=2)
+
+    assert storage.get_by_number_or_none(1).title == 'A'
+    assert storage.get_by_number_or_none(1, space=2).title == 'B'
+    assert storage.get_difficulties() == [(1, 1)]
+    assert [result.title for result in storage.search('a', limit=10)] == ['A']
+
+
+def test_refreshed_problem_updates_existing_row(database):
+    storage = ProblemStorage()
+    problem = ProblemModel(number=1, title='A', difficulty=10, solutions=1, limits='1 s', text='<p>apples</p>')
+    storage.create_or_update(problem)
+
+    storage.create_or_update(
+        problem.copy(update={'difficulty': 20, 'solutions': 5, 'text': '<p>pears</p>', 'search_text': 'pears'})
+    )
+
+    assert storage.get_difficulties() == [(1, 20)]
+    assert storage.get_by_number_or_none(1).solutions == 5
+    assert storage.get_statement_or_none(1).text == '<p>pears</p>'
+    assert storage.search('apples', limit=10) == []
+    assert [result.number for result in storage.search('pears', limit=10)] == [1]
+
+
+def test_statements_are_stored_apart_from_metadata(database):
+    storage = ProblemStorage()
+    for number, difficulty in ((1, 300), (2, 100), (3, 200)):
+        storage.create_or_update(
+            ProblemModel(
+                number=number,
+                title=str(number),
+                difficulty=difficulty,
+                solutions=1,
+                limits='1 s',
+                text='<p>x</p>' * 100,
+            )
+        )
+
+    assert [problem.number for problem in storage.get_all()] == [2, 3, 1]
+    statement = storage.get_statement_or_none(3)
+    assert (statement.limits, statement.text) == ('1 s', '<p>x</p>' * 100)
+    assert storage.get_statement_or_none(3, space=2) is None
+    with db.create_session() as session:
+        assert len(session.query(db.ProblemStatement.text).filter_by(problem_id=1).scalar()) < 100
+
+
+def test_threads_do_not_share_a_transaction(tmp_path):
+    DBSettings(url=f'sqlite:///{tmp_path / "bot.sqlite"}').setup_db()
+    seen = []
+
+    def _count_users():
+        with db.create_session() as session:
+            seen.append(session.query(db.TelegramUser).count())
+
+    try:
+        with pytest.raises(RuntimeError), db.create_session() as session:
+            session.add(db.TelegramUser(user_id=1, timus_id=1))
+            session.flush()
+            thread = threading.Thread(target=_count_users)
+            thread.start()
+            thread.join()
+            raise RuntimeError('rolled back')
+        _count_users()
+        assert seen == [0, 0]
+    finally:
+        db.metadata.bind.dispose()
+
+
+def test_legacy_database_is_migrated(tmp_path):
+    url = f'sqlite:///{tmp_path / "legacy.sqlite"}'
+    engine = sa.create_engine(url)
+    with engine.begin() as connection:
+        for statement in LEGACY_SCHEMA:
+            connection.execute(sa.text(statement))
+        connection.execute(
+            sa.text(
+                "INSERT INTO problem (number, title, difficulty, solutions, limits, text)"
+                " VALUES (1, 'A', 1, 1, '', '<p>legacy</p>')"
+            )
+        )
+    engine.dispose()
+
+    DBSettings(url=url).setup_db()
+    DBSettings(url=url).setup_db()
+    try:
+        storage = ProblemStorage()
+        assert storage.get_by_number_or_none(1).space == 1
+        assert storage.get_statement_or_none(1).text == '<p>legacy</p>'
+        storage.create_or_update(
+            ProblemModel(number=1, title='B', difficulty=1, solutions=1, limits='', text=''), space=2
+        )
+        assert storage.get_by_number_or_none(1, space=2).title == 'B'
+        with pytest.raises(sa.exc.IntegrityError), db.create_session() as session:
+            session.add(db.Problem(space=2, number=1, title='C', difficulty=1, solutions=1))
+    finally:
+        db.metadata.bind.dispose()
+
+
+LEGACY_SCHEMA = [
+    'CREATE TABLE problem (problem_id INTEGER NOT NULL PRIMARY KEY,'
+    ' created_at DATETIME DEFAULT (CURRENT_TIMESTAMP) NOT NULL, number INTEGER NOT NULL, title TEXT NOT NULL,'
+    ' difficulty INTEGER NOT NULL, solutions INTEGER NOT NULL, limits TEXT NOT NULL, text TEXT NOT NULL)',
+    'CREATE UNIQUE INDEX ix_problem_number ON problem (number)',
+    'CREATE TABLE submit (submit_id INTEGER NOT NULL PRIMARY KEY,'
+    ' created_at DATETIME DEFAULT (CURRENT_TIMESTAMP) NOT NULL, timus_submit_id BIGINT NOT NULL UNIQUE,'
+    ' timus_user_id INTEGER NOT NULL, timus_problem_id INTEGER NOT NULL, date DATETIME NOT NULL,'
+    ' language TEXT NOT NULL, verdict TEXT NOT NULL, test INTEGER NOT NULL, runtime_ms INTEGER NOT NULL,'
+    ' memory_kb INTEGER NOT NULL)',
+]
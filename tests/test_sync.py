@@ -0,0 +1,147 @@
+import datetime
+
+import pytest
+
+from src.loader import TimusAPISubmit
+from src.storage import DBUser, SubmitStorage, SyncStateStorage
+from src.sync import Backfiller, SubmitSyncer, SyncSettings
+
+AUTHOR_ID = 248409
+
+
+class FakeTimusClient:
+    def __init__(self, submit_ids):
+        self.submit_ids = sorted(submit_ids, reverse=True)
+        self.requests = 0
+        self.on_request = None
+
+    def get_submits(self, *, author_id, count, from_submit_id=None):
+        self.requests += 1
+        page = [submit_id for submit_id in self.submit_ids if from_submit_id is None or submit_id <= from_submit_id]
+        if self.on_request is not None:
+            self.on_request()
+        return [self._make_submit(submit_id) for submit_id in page[:count]]
+
+    def _make_submit(self, submit_id):
+        return TimusAPISubmit(
+            submit_id=submit_id,
+            date=datetime.datetime(2021, 1, 1),
+            author_id=AUTHOR_ID,
+            problem=1000 + submit_id % 100,
+            language='Python 3.8',
+            verdict='Accepted',
+            test=0,
+            runtime_ms=15,
+            memory_kb=100,
+        )
+
+
+@pytest.fixture()
+def settings():
+    return SyncSettings(initial_page_size=10, max_page_size=40, first_sync_max_pages=2, backfill_page_size=50)
+
+
+def make_syncer(settings, client):
+    submit_storage = SubmitStorage()
+    sync_state_storage = SyncStateStorage()
+    backfiller = Backfiller(settings.copy(update={'backfill_interval': 0}), submit_storage, sync_state_storage, client)
+    return SubmitSyncer(settings, submit_storage, sync_state_storage, client, backfiller), backfiller
+
+
+def stored_submit_ids():
+    return {submit.submit_id for submit in SubmitStorage().get_all_by_author(AUTHOR_ID)}
+
+
+@pytest.mark.usefixtures('database')
+def test_first_sync_is_bounded_and_backfilled(settings):
+    client = FakeTimusClient(range(1, 501))
+    syncer, backfiller = make_syncer(settings, client)
+
+    syncer.sync(DBUser(id=1, telegram_id=1, timus_id=AUTHOR_ID))
+
+    assert client.requests == 2
+    assert stored_submit_ids() == set(range(471, 501))
+    state = SyncStateStorage().get_or_none(AUTHOR_ID)
+    assert state.high_watermark == 500
+    assert not state.backfill_complete
+
+    backfiller.backfill(AUTHOR_ID)
+
+    assert stored_submit_ids() == set(range(1, 501))
+    assert SyncStateStorage().get_or_none(AUTHOR_ID).backfill_complete
+
+
+@pytest.mark.usefixtures('database')
+def test_sync_stops_without_exact_sentinel(settings):
+    client = FakeTimusClient(range(1, 8))
+    syncer, _ = make_syncer(settings, client)
+    user = DBUser(id=1, telegram_id=1, timus_id=AUTHOR_ID)
+    syncer.sync(user)
+
+    client.submit_ids = [submit_id for submit_id in client.submit_ids if submit_id != 7] + [9, 8]
+    client.submit_ids.sort(reverse=True)
+    client.requests = 0
+    syncer.sync(user)
+
+    assert client.requests == 1
+    assert stored_submit_ids() == set(range(1, 10))
+    state = SyncStateStorage().get_or_none(AUTHOR_ID)
+    assert state.high_watermark == 9
+    assert state.backfill_complete
+
+
+@pytest.mark.usefixtures('database')
+def test_unfinished_backfill_keeps_its_lower_bound(settings):
+    client = FakeTimusClient(range(1, 101))
+    syncer, backfiller = make_syncer(settings, client)
+    user = DBUser(id=1, telegram_id=1, timus_id=AUTHOR_ID)
+    syncer.sync(user)
+    backfiller.backfill(AUTHOR_ID)
+
+    client.submit_ids = list(range(500, 0, -1))
+    syncer.sync(user)
+    client.submit_ids = list(range(900, 0, -1))
+    syncer.sync(user)
+    state = SyncStateStorage().get_or_none(AUTHOR_ID)
+    assert (state.backfill_from, state.backfill_to) == (550, 100)
+
+    client.requests = 0
+    backfiller.backfill(AUTHOR_ID)
+
+    assert client.requests == 10
+    assert stored_submit_ids() == set(range(1, 901))
+
+
+@pytest.mark.usefixtures('database')
+def test_sync_between_backfill_pages_is_not_overwritten(settings):
+    client = FakeTimusClient(range(1, 501))
+    syncer, backfiller = make_syncer(settings, client)
+    user = DBUser(id=1, telegram_id=1, timus_id=AUTHOR_ID)
+    syncer.sync(user)
+
+    def _sync_new_submits():
+        client.on_request = None
+        client.submit_ids = list(range(1000, 0, -1))
+        syncer.sync(user)
+
+    client.on_request = _sync_new_submits
+    backfiller.backfill(AUTHOR_ID)
+
+    assert stored_submit_ids() == set(range(1, 1001))
+    assert SyncStateStorage().get_or_none(AUTHOR_ID).backfill_complete
+
+
+def test_schedule_of_a_queued_user_backfills_again(settings):
+    backfiller = Backfiller(settings, SubmitStorage(), SyncStateStorage(), FakeTimusClient([]))
+    backfilled = []
+    backfiller.backfill = backfilled.append
+    backfiller.schedule(AUTHOR_ID)
+    backfiller.schedule(AUTHOR_ID)
+
+    backfiller.start()
+    backfiller.wait()
+
+    assert backfilled == [AUTHOR_ID, AUTHOR_ID]
+    backfiller.schedule(AUTHOR_ID)
+    backfiller.wait()
+    assert backfilled == [AUTHOR_ID, AUTHOR_ID, AUTHOR_ID]
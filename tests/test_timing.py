@@ -0,0 +1,25 @@
+import logging
+
+import pytest
+
+from src.timing import PhaseTimer
+
+
+def test_phase_timer_records_and_reports_every_phase(caplog):
+    timer = PhaseTimer('startup')
+
+    with caplog.at_level(logging.INFO, logger='src.timing'):
+        with timer.phase('setup db'):
+            pass
+        with pytest.raises(RuntimeError), timer.phase('load model'):
+            raise RuntimeError('failed')
+
+    durations = timer.durations
+    assert list(durations) == ['setup db', 'load model']
+    assert all(0 <= duration <= timer.elapsed for duration in durations.values())
+    report = timer.report()
+    assert report.startswith('startup: setup db=') and ', load model=' in report and '(elapsed ' in report
+    assert [record.getMessage().split(' took ')[0] for record in caplog.records] == [
+        "startup: phase 'setup db'",
+        "startup: phase 'load model'",
+    ]
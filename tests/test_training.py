@@ -0,0 +1,98 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from src.loader import TimusAPISubmit
+from src.storage import SubmitStorage
+from src.training import (
+    Interactions,
+    MemoryBudgetExceeded,
+    deduplicate,
+    filter_active_authors,
+    load_unique_interactions,
+    split_by_authors,
+)
+
+
+def make_interactions(rows):
+    submit_ids, author_ids, problem_ids = (np.array(column, dtype=np.int64) for column in zip(*rows))
+    return Interactions(submit_ids, author_ids, problem_ids)
+
+
+def test_deduplicate_keeps_first_accepted_submit():
+    interactions = make_interactions([(1, 10, 1000), (2, 11, 1000), (3, 10, 1000), (4, 10, 1001)])
+
+    result = deduplicate(interactions)
+
+    assert result.submit_ids.tolist() == [1, 2, 4]
+
+
+def test_filter_active_authors():
+    interactions = make_interactions([(1, 10, 1000), (2, 11, 1000), (3, 10, 1001), (4, 12, 1000)])
+
+    result = filter_active_authors(interactions, min_problems=1)
+
+    assert result.author_ids.tolist() == [10, 10]
+
+
+def test_split_by_authors_holds_out_latest_problems():
+    rows = [(submit_id, 10 + submit_id % 2, 1000 + submit_id) for submit_id in range(1, 21)]
+    interactions = make_interactions(rows)
+
+    train, test = split_by_authors(interactions, test_fraction=1.0, holdout_per_author=3, seed=0)
+
+    assert sorted(test.submit_ids.tolist()) == [15, 16, 17, 18, 19, 20]
+    assert len(train) == 14
+
+
+def test_split_by_authors_is_deterministic():
+    rows = [(submit_id, submit_id % 7, submit_id) for submit_id in range(100)]
+    interactions = make_interactions(rows)
+
+    first = split_by_authors(interactions, test_fraction=0.4, holdout_per_author=2, seed=42)
+    second = split_by_authors(interactions, test_fraction=0.4, holdout_per_author=2, seed=42)
+
+    assert first[1].fingerprint() == second[1].fingerprint()
+
+
+def store_submits(count):
+    SubmitStorage().batch_create(
+        [
+            TimusAPISubmit(
+                submit_id=submit_id,
+                date=datetime.datetime(2021, 1, 1),
+                author_id=submit_id % 3,
+                problem=1000 + submit_id % 10,
+                language='C++',
+                verdict='Accepted' if submit_id % 4 else 'Wrong answer',
+                test=0,
+                runtime_ms=1,
+                memory_kb=1,
+            )
+            for submit_id in range(1, count + 1)
+        ]
+    )
+
+
+@pytest.mark.usefixtures('database')
+def test_load_unique_interactions_deduplicates_while_reading():
+    store_submits(100)
+    accepted = [submit_id for submit_id in range(1, 101) if submit_id % 4]
+    first = {}
+    for submit_id in accepted:
+        first.setdefault((submit_id % 3, submit_id % 10), submit_id)
+
+    interactions, read = load_unique_interactions(SubmitStorage(), chunk_size=5)
+
+    assert read == len(accepted)
+    assert interactions.submit_ids.tolist() == sorted(first.values())
+    assert interactions.problem_ids.tolist() == [1000 + submit_id % 10 for submit_id in sorted(first.values())]
+
+
+@pytest.mark.usefixtures('database')
+def test_load_unique_interactions_stops_over_memory_budget():
+    store_submits(10)
+
+    with pytest.raises(MemoryBudgetExceeded):
+        load_unique_interactions(SubmitStorage(), chunk_size=5, memory_budget_mb=1)
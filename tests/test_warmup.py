@@ -0,0 +1,44 @@
+import logging
+import threading
+
+from src.warmup import ModelHolder
+
+
+def test_holder_is_ready_once_the_model_is_loaded():
+    release = threading.Event()
+    ready = []
+    holder = ModelHolder()
+
+    def _load():
+        assert release.wait(timeout=5)
+        return 'model'
+
+    thread = holder.warm_up_in_background(_load, on_ready=lambda: ready.append(holder.get_or_none()))
+
+    assert not holder.is_ready
+    assert holder.get_or_none() is None
+    assert not holder.wait(timeout=0.01)
+    release.set()
+    thread.join(timeout=5)
+
+    assert holder.is_ready
+    assert holder.get_or_none() == 'model'
+    assert ready == ['model']
+
+
+def test_failed_warm_up_is_logged_and_keeps_the_holder_empty(caplog):
+    holder = ModelHolder()
+    ready = []
+
+    def _load():
+        raise RuntimeError('model file is missing')
+
+    with caplog.at_level(logging.ERROR, logger='src.warmup'):
+        holder.warm_up_in_background(_load, on_ready=lambda: ready.append(True)).join(timeout=5)
+
+    assert not holder.is_ready
+    assert holder.get_or_none() is None
+    assert ready == []
+    (record,) = caplog.records
+    assert record.getMessage() == 'Model warm-up failed'
+    assert 'model file is missing' in record.exc_text
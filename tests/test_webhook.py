@@ -0,0 +1,147 @@
+import http.client
+import json
+import threading
+import time
+
+import pytest
+import telebot
+
+from src.handlers import HelpHandler
+from src.webhook import SECRET_TOKEN_HEADER, WebhookServer, stop_bot_workers
+
+PATH = '/telegram'
+SECRET_TOKEN = 'synthetic-secret'
+
+
+def make_update(update_id, text):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': update_id, 'type': 'private'},
+            'from': {'id': update_id, 'is_bot': False, 'first_name': 'synthetic'},
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}],
+        },
+    }
+
+
+def post(address, payload, path=PATH, secret_token=SECRET_TOKEN):
+    headers = {'Content-Type': 'application/json'}
+    if secret_token is not None:
+        headers[SECRET_TOKEN_HEADER] = secret_token
+    connection = http.client.HTTPConnection(*address)
+    connection.request('POST', path, body=json.dumps(payload), headers=headers)
+    status = connection.getresponse().status
+    connection.close()
+    return status
+
+
+class RecordingBot(telebot.TeleBot):
+    def __init__(self):
+        super().__init__('0:synthetic', threaded=False)
+        self.replied_at = {}
+        self.replied = threading.Condition()
+
+    def reply_to(self, message, text, **kwargs):
+        with self.replied:
+            self.replied_at[message.message_id] = time.perf_counter()
+            self.replied.notify_all()
+
+
+@pytest.fixture()
+def bot():
+    bot = RecordingBot()
+    bot.message_handler(commands=['help'])(HelpHandler(bot))
+    return bot
+
+
+def make_server(process_update, queue_size=64):
+    return WebhookServer(
+        process_update,
+        host='127.0.0.1',
+        port=0,
+        path=PATH,
+        secret_token=SECRET_TOKEN,
+        queue_size=queue_size,
+        workers=2,
+    )
+
+
+def test_webhook_feeds_updates_to_handlers(bot):
+    server = make_server(lambda update: bot.process_new_updates([update]))
+    server.start()
+    count = 200
+    posted_at = {}
+    try:
+        for update_id in range(1, count + 1):
+            posted_at[update_id] = time.perf_counter()
+            assert post(server.address, make_update(update_id, '/help')) == 200
+        with bot.replied:
+            assert bot.replied.wait_for(lambda: len(bot.replied_at) == count, timeout=10)
+    finally:
+        server.stop(timeout=5)
+
+    latencies = sorted(bot.replied_at[update_id] - posted_at[update_id] for update_id in posted_at)
+    assert latencies[len(latencies) // 2] < 0.5
+
+
+def test_webhook_rejects_updates_when_queue_is_full():
+    release = threading.Event()
+    server = make_server(lambda update: release.wait(5), queue_size=1)
+    server.start()
+    try:
+        statuses = [post(server.address, make_update(update_id, '/help')) for update_id in range(1, 6)]
+    finally:
+        release.set()
+        server.stop(timeout=5)
+
+    assert statuses.count(200) >= 1
+    assert statuses[-1] == 503
+
+
+def test_webhook_rejects_unknown_path_and_garbage():
+    server = make_server(lambda update: None)
+    server.start()
+    try:
+        assert post(server.address, make_update(1, '/help'), path='/other') == 404
+        assert post(server.address, 'not an update') == 400
+    finally:
+        server.stop(timeout=5)
+
+
+def test_webhook_rejects_updates_without_secret_token():
+    processed = []
+    server = make_server(lambda update: processed.append(update.update_id))
+    server.start()
+    try:
+        assert post(server.address, make_update(1, '/help'), secret_token=None) == 403
+        assert post(server.address, make_update(2, '/help'), secret_token='guess') == 403
+    finally:
+        server.stop(timeout=5)
+
+    assert processed == []
+
+
+def test_webhook_stop_drains_queue():
+    processed = []
+    server = make_server(lambda update: processed.append(update.update_id) or time.sleep(0.01))
+    server.start()
+    for update_id in range(1, 11):
+        post(server.address, make_update(update_id, '/help'))
+    server.stop(timeout=5)
+
+    assert sorted(processed) == list(range(1, 11))
+
+
+def test_stop_bot_workers_finishes_queued_handlers():
+    bot = telebot.TeleBot('0:synthetic', threaded=True, num_threads=2)
+    processed = []
+    for update_id in range(1, 11):
+        bot.worker_pool.put(lambda update_id=update_id: processed.append(update_id) or time.sleep(0.01))
+
+    stop_bot_workers(bot, timeout=5)
+
+    assert sorted(processed) == list(range(1, 11))
+    assert not any(worker.is_alive() for worker in bot.worker_pool.workers)